@@ -0,0 +1,504 @@
+"""Benchmarks for single steps of the build
+
+The results are only printed. Most benchmarks need the same environment as
+the step they measure, e.g. a running Virtuoso or existing raw databases.
+"""
+import resource
+import shutil
+import sqlite3
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import product
+
+from tabulate import tabulate
+
+import infer
+import process
+import sparql.queries as sparql
+from parse import html_parser
+from sparql.run import create_raw_indexes, raw_index_names
+
+
+class CountingReader:
+    """Wrap a binary stream and count the bytes read from it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.stream.readinto(b)
+        self.bytes_read += n
+        return n
+
+    @property
+    def closed(self):
+        return self.stream.closed
+
+
+def sparql_format(lang, to_lang, limit, **kwargs):
+    """Compare transfer size and speed of the JSON and TSV result formats"""
+    cases = [
+        ("form", sparql.form_query, dict(lang=lang)),
+        (
+            "translation_sense",
+            sparql.translation_query["sense"],
+            dict(from_lang=lang, to_lang=to_lang),
+        ),
+    ]
+    table = []
+    for table_name, query, fmt_args in cases:
+        for result_format in sparql.RESULT_FORMATS:
+            url = sparql.make_url(
+                query,
+                limit=limit,
+                offset=0,
+                result_format=result_format,
+                **fmt_args,
+            )
+            start = time.perf_counter()
+            response = CountingReader(urllib.request.urlopen(url))
+            rows = sparql.open_results(response, result_format)
+            convert_row = sparql.row_converters[result_format](
+                table_name, rows.cols, lang
+            )
+            row_count = sum(1 for row in rows if convert_row(row))
+            duration = time.perf_counter() - start
+            table.append(
+                [
+                    table_name,
+                    result_format,
+                    row_count,
+                    response.bytes_read / 1e6,
+                    response.bytes_read / max(row_count, 1),
+                    row_count / duration,
+                ]
+            )
+    print(
+        tabulate(
+            table,
+            ["table", "format", "rows", "MB", "bytes/row", "rows/s"],
+            floatfmt=".1f",
+        )
+    )
+
+
+def sparql_convert(table_name, recorded_page, lang, **kwargs):
+    """Measure the row conversion of get_query on a recorded JSON page
+
+    A page can be recorded by saving the response for a `make_url` URL.
+    """
+    with open(recorded_page, "rb") as f:
+        page = sparql.BindingStream(f)
+        bindings = list(page)
+    convert_row = sparql.make_json_row_converter(table_name, page.cols, lang)
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for row in bindings:
+            convert_row(row)
+        best = min(best, time.perf_counter() - start)
+    print("%d rows, %.0f rows/s" % (len(bindings), len(bindings) / best))
+
+
+def best_time(func, values, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for x in values:
+            func(x)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def html(lang, to_lang, sample_size, **kwargs):
+    """Compare the HTML cleaning with and without the single pass scanner
+
+    The corpus is a random sample of `form.other_written` and
+    `translation.sense` from the raw dbs.
+    """
+    corpora = [
+        (f"dictionaries/raw/{lang}.sqlite3", "form", "other_written"),
+        (f"dictionaries/raw/{lang}-{to_lang}.sqlite3", "translation", "sense"),
+    ]
+
+    def html_parser_only(x):
+        # the behavior before the scanner was added
+        if "<" not in x:
+            return x
+        return html_parser.parse_with_html_parser(x)
+
+    table = []
+    for db_path, table_name, col in corpora:
+        conn = sqlite3.connect(db_path)
+        values = [
+            x
+            for x, in conn.execute(
+                f"""
+                SELECT {col} FROM {table_name}
+                WHERE {col} IS NOT NULL
+                ORDER BY random() LIMIT ?
+                """,
+                [sample_size],
+            )
+        ]
+        name = f"{table_name}.{col}"
+        markup = [x for x in values if "<" in x or "&" in x]
+        changed = sum(html_parser.parse(x) != html_parser_only(x) for x in values)
+        for label, parse in [
+            ("HTMLParser", html_parser_only),
+            ("scanner", html_parser.parse),
+        ]:
+            table.append(
+                [
+                    name,
+                    label,
+                    len(values),
+                    len(markup),
+                    len(values) / best_time(parse, values),
+                    len(markup) / best_time(parse, markup),
+                    changed,
+                ]
+            )
+    print(
+        tabulate(
+            table,
+            [
+                "corpus",
+                "parser",
+                "rows",
+                "with markup",
+                "rows/s",
+                "markup rows/s",
+                "different",
+            ],
+            floatfmt=".0f",
+        )
+    )
+    print(
+        "Rows can differ because entities are now also decoded in text "
+        "without tags and trailing text with '&' is not lost anymore."
+    )
+
+
+def raw_indexes(lang, repeat, **kwargs):
+    """Time the entry and form targets with and without the raw indexes
+
+    The targets run on a copy of the raw db, so that it stays unchanged. The
+    query plans of both runs are printed, too.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = f"{tmp}/raw.sqlite3"
+        shutil.copy(f"dictionaries/raw/{lang}.sqlite3", raw_path)
+        conn = sqlite3.connect(f"{tmp}/processed.sqlite3")
+        conn.execute("ATTACH DATABASE ? AS raw", [raw_path])
+        for name in raw_index_names(conn, "raw"):
+            conn.execute(f"DROP INDEX IF EXISTS raw.{name}")
+        conn.execute("DROP TABLE IF EXISTS raw.sqlite_stat1")
+        process.make_inflection_table(conn, lang)
+
+        def best_of(target):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                target(conn, lang)
+                conn.commit()
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        times = {}
+        plans = {}
+        for indexed in [False, True]:
+            if indexed:
+                start = time.perf_counter()
+                create_raw_indexes(conn, "raw")
+                conn.commit()
+                index_time = time.perf_counter() - start
+            for name, target in [
+                ("entry", process.make_entry),
+                ("form", partial(process.make_form, version="bench")),
+            ]:
+                times[name, indexed] = best_of(target)
+            plans[indexed] = process.query_plans(conn)
+        conn.close()
+
+    for indexed in [False, True]:
+        print("Query plans %s indexes" % ("with" if indexed else "without"))
+        print("\n".join("    " + line for line in plans[indexed]))
+
+    print(
+        tabulate(
+            [
+                [name, times[name, False], times[name, True]]
+                for name in ["entry", "form"]
+            ]
+            + [["create indexes", None, index_time]],
+            ["target", "without indexes (s)", "with indexes (s)"],
+            floatfmt=".2f",
+        )
+    )
+
+
+# The grouping before the staging table: the joined rows are sorted by
+# lexentry_id to order json_group_array and then sorted again for the GROUP BY.
+UNSTAGED_TRANSLATION_QUERY = process.TRANSLATION_QUERY.replace(
+    "FROM temp.translation_staging",
+    f"FROM ({process.TRANSLATION_STAGING_QUERY} ORDER BY lexentry_id)",
+)
+
+
+def run_grouping(lang_pair, staged):
+    """Build the translation table into a temp table in a fresh process"""
+    from_lang, to_lang = lang_pair.split("-")
+    conn = sqlite3.connect(f"dictionaries/processed/{lang_pair}.sqlite3")
+    conn.execute(
+        f"ATTACH DATABASE 'dictionaries/processed/{from_lang}.sqlite3' AS lang"
+    )
+    conn.execute(
+        f"ATTACH DATABASE 'dictionaries/processed/{to_lang}.sqlite3' AS other_lang"
+    )
+    start = time.perf_counter()
+    if staged:
+        process.stage_translations(conn)
+        query = process.TRANSLATION_QUERY
+    else:
+        query = UNSTAGED_TRANSLATION_QUERY
+    conn.execute("CREATE TEMPORARY TABLE translation AS " + query)
+    seconds = time.perf_counter() - start
+    temp_btrees = sum(
+        "TEMP B-TREE" in detail
+        for *_, detail in conn.execute("EXPLAIN QUERY PLAN " + query)
+    )
+    conn.close()
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return temp_btrees, seconds, peak_mb
+
+
+def translation_grouping(lang_pairs, repeat, **kwargs):
+    """Time the grouping of the cleaned translations and its peak memory
+
+    Each run is a new process, so that the peak RSS only includes that run.
+    The staged runs include filling and indexing the staging table. The pairs
+    need existing processed dbs.
+    """
+    table = []
+    for lang_pair in lang_pairs:
+        for label, staged in [
+            ("sort by lexentry_id, then group", False),
+            ("group indexed staging table", True),
+        ]:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(1) as executor:
+                    future = executor.submit(run_grouping, lang_pair, staged)
+                    runs.append(future.result())
+            temp_btrees = runs[0][0]
+            table.append(
+                [
+                    lang_pair,
+                    label,
+                    temp_btrees,
+                    min(seconds for _, seconds, _ in runs),
+                    max(peak_mb for *_, peak_mb in runs),
+                ]
+            )
+    print(
+        tabulate(
+            table,
+            ["pair", "query", "temp b-trees", "best time (s)", "peak RSS (MB)"],
+            floatfmt=".2f",
+        )
+    )
+
+
+def run_infer_sql(out_path, langs, max_fanout):
+    """Run infer.sql for all pairs of `langs` in a fresh process
+
+    Returns the time, the peak RSS and the number of dropped pivot
+    candidates for each pair.
+    """
+    conn = sqlite3.connect(out_path)
+    conn.create_aggregate("agg_by_score", 2, infer.AggByScore)
+    conn.execute("ATTACH DATABASE 'dictionaries/infer.sqlite3' AS shared")
+    infer.create_scope(conn, *infer.all_pairs(langs), max_fanout)
+    start = time.perf_counter()
+    conn.executescript(open("src/infer.sql").read())
+    conn.commit()
+    seconds = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    dropped = {}
+    if max_fanout is not None:
+        for from_lang, to_lang, count in conn.execute(
+            """
+            SELECT from_lang, to_lang, count(*) FROM pivot_join
+            WHERE NOT used
+            GROUP BY from_lang, to_lang
+        """
+        ):
+            dropped[from_lang, to_lang] = count
+    conn.close()
+    return seconds, peak_mb, dropped
+
+
+def pivot_fanout(langs, max_fanout, **kwargs):
+    """Show what limiting the translations of each pivot vocable changes
+
+    Runs infer.sql for all pairs of `langs` with and without `max_fanout`,
+    each in a new process, and compares the indirect rows and the
+    infer_grouped translation lists of each pair. The top translation is the
+    first one of a translation list.
+    """
+    if not langs:
+        langs = infer.partition_langs(sqlite3.connect("dictionaries/infer.sqlite3"))
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = {}
+        indirect_rows = {}
+        trans_lists = {}
+        for label, fanout in [("full", None), ("pruned", max_fanout)]:
+            with ProcessPoolExecutor(1) as executor:
+                future = executor.submit(
+                    run_infer_sql,
+                    f"{tmp}/{label}.sqlite3",
+                    langs,
+                    fanout,
+                )
+                runs[label] = future.result()
+        # only read after all runs, so that the runs don't inherit the memory
+        for label in runs:
+            conn = sqlite3.connect(f"{tmp}/{label}.sqlite3")
+            indirect_rows[label] = {
+                (from_lang, to_lang): count
+                for from_lang, to_lang, count in conn.execute(
+                    """
+                    SELECT from_lang, to_lang, count(*) FROM indirect
+                    GROUP BY from_lang, to_lang
+                """
+                )
+            }
+            trans_lists[label] = {
+                tuple(key): trans_list
+                for *key, trans_list in conn.execute(
+                    """
+                    SELECT from_lang, to_lang, lexentry_id, sense_num, sense,
+                        from_vocable, trans_list
+                    FROM infer_grouped
+                """
+                )
+            }
+            conn.close()
+
+    def top(trans_list):
+        return trans_list and trans_list.split(" | ")[0]
+
+    changed_lists = Counter()
+    changed_tops = Counter()
+    full, pruned = trans_lists["full"], trans_lists["pruned"]
+    for key in full.keys() | pruned.keys():
+        pair = key[:2]
+        if full.get(key) != pruned.get(key):
+            changed_lists[pair] += 1
+        if top(full.get(key)) != top(pruned.get(key)):
+            changed_tops[pair] += 1
+
+    dropped = runs["pruned"][2]
+    table = [
+        [
+            f"{from_lang}-{to_lang}",
+            dropped.get((from_lang, to_lang), 0),
+            indirect_rows["full"].get((from_lang, to_lang), 0),
+            indirect_rows["pruned"].get((from_lang, to_lang), 0),
+            changed_lists[from_lang, to_lang],
+            changed_tops[from_lang, to_lang],
+        ]
+        for from_lang, to_lang in product(langs, repeat=2)
+        if dropped.get((from_lang, to_lang)) or changed_lists[from_lang, to_lang]
+    ]
+    print(
+        tabulate(
+            table,
+            [
+                "pair",
+                "dropped candidates",
+                "indirect rows",
+                "pruned indirect rows",
+                "changed lists",
+                "changed top translations",
+            ],
+        )
+    )
+    print()
+    for label, (seconds, peak_mb, _) in runs.items():
+        print("%s: %.2fs, peak RSS %.0f MB" % (label, seconds, peak_mb))
+    print(
+        "%d pivot candidates dropped, %d of %d pairs have changed top translations"
+        % (
+            sum(dropped.values()),
+            len(changed_tops),
+            len(langs) ** 2,
+        )
+    )
+
+
+def add_subparsers(subparsers):
+    bench = subparsers.add_parser("bench", help="run benchmarks")
+    bench_subparsers = bench.add_subparsers(dest="benchmark")
+    bench_subparsers.required = True
+
+    b = bench_subparsers.add_parser(
+        "sparql-format", help="JSON vs. TSV SPARQL results (needs Virtuoso)"
+    )
+    b.add_argument("lang")
+    b.add_argument("to_lang")
+    b.add_argument("--limit", type=int, default=int(1e5))
+    b.set_defaults(func=sparql_format)
+
+    b = bench_subparsers.add_parser(
+        "sparql-convert", help="row conversion speed on a recorded JSON page"
+    )
+    b.add_argument("table_name")
+    b.add_argument("recorded_page")
+    b.add_argument("--lang", default="de")
+    b.set_defaults(func=sparql_convert)
+
+    b = bench_subparsers.add_parser(
+        "html", help="HTML cleaning speed on a sample of the raw dbs"
+    )
+    b.add_argument("lang")
+    b.add_argument("to_lang")
+    b.add_argument("--sample-size", type=int, default=int(1e5))
+    b.set_defaults(func=html)
+
+    b = bench_subparsers.add_parser(
+        "raw-indexes", help="entry and form targets with and without raw indexes"
+    )
+    b.add_argument("lang")
+    b.add_argument("--repeat", type=int, default=3)
+    b.set_defaults(func=raw_indexes)
+
+    b = bench_subparsers.add_parser(
+        "translation-grouping",
+        help="time and memory of grouping the translations of processed pairs",
+    )
+    b.add_argument("lang_pairs", nargs="+", metavar="lang_pair")
+    b.add_argument("--repeat", type=int, default=3)
+    b.set_defaults(func=translation_grouping)
+
+    b = bench_subparsers.add_parser(
+        "pivot-fanout",
+        help="dropped pivot candidates and changed translations for a max fanout",
+    )
+    b.add_argument("langs", nargs="*", metavar="lang")
+    b.add_argument("--max-fanout", type=int, required=True)
+    b.set_defaults(func=pivot_fanout)
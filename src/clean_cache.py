@@ -0,0 +1,164 @@
+"""Persistent cache for the results of the text cleaning functions
+
+Many pairs share the same source language, so the same strings are cleaned
+again for each of them. The cache is a SQLite db shared by all processes.
+Results are keyed by the input itself and stored per stage together with the
+version of the cleaning code, so that changes to the code never return stale
+results.
+
+Looking up a single string in SQLite takes longer than cleaning it, so the
+cached functions work on whole batches of strings, whose results are looked
+up with a few queries. Only strings that contain markup are cached at all.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+CACHE_PATH = "dictionaries/cache/clean.sqlite3"
+# The bytes of a cached result, as counted for `CleanCache.max_size`
+RESULT_SIZE = "(length(CAST(input AS BLOB)) + ifnull(length(CAST(value AS BLOB)), 0))"
+
+
+def source_version(*modules):
+    """Return a hash of the source files of `modules`"""
+    version = hashlib.blake2b(digest_size=8)
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            version.update(f.read())
+    return version.hexdigest()
+
+
+class CleanCache:
+    """Cache the results of cleaning functions on disk
+
+    New results are written when the cache is closed, so that parallel
+    processes only hold the write lock briefly. When the stored inputs and
+    results take more than `max_size` bytes, the ones which have been used
+    least recently are removed.
+    """
+
+    def __init__(self, version, path=CACHE_PATH, max_size=2 * 2**30):
+        self.version = version
+        self.max_size = max_size
+        self.now = int(time.time())
+        self.stages = {}
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=600)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            DROP TABLE IF EXISTS clean_cache;  -- hashed inputs of older versions
+            CREATE TABLE IF NOT EXISTS clean_result (
+                stage text,
+                input text,
+                value text,
+                used int,  -- time of last use
+                PRIMARY KEY (stage, input)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS clean_result_used_idx ON clean_result(used);
+            """
+        )
+
+    def wrap(self, stage, func, worth_caching):
+        """Return a cached version of `func` for lists of values
+
+        `func` must take a single str. The returned function takes a list
+        of values and returns the list of their results. Only inputs for
+        which `worth_caching` returns True are cached.
+        """
+        stage = f"{stage}:{self.version}"
+        used = set()
+        new = {}
+        stats = [0, 0]
+        self.stages[stage] = (used, new, stats)
+
+        def cached(values):
+            keys = [x if x is not None and worth_caching(x) else None for x in values]
+            stored = self.lookup(stage, set(keys) - new.keys() - {None})
+            results = []
+            for x, key in zip(values, keys):
+                if key is None:
+                    results.append(func(x))
+                    continue
+                if key in new:
+                    value = new[key]
+                    stats[0] += 1
+                elif key in stored:
+                    value = stored[key]
+                    stats[0] += 1
+                    used.add(key)
+                else:
+                    value = new[key] = func(x)
+                    stats[1] += 1
+                results.append(value)
+            return results
+
+        return cached
+
+    def lookup(self, stage, keys, chunk_size=500):
+        """Return the stored values of `keys` in `stage` as dict"""
+        keys = list(keys)
+        values = {}
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i : i + chunk_size]
+            values.update(
+                self.conn.execute(
+                    "SELECT input, value FROM clean_result "
+                    "WHERE stage = ? AND input IN (%s)" % ", ".join("?" * len(chunk)),
+                    [stage, *chunk],
+                )
+            )
+        return values
+
+    def report(self):
+        for stage, (used, new, (hits, misses)) in self.stages.items():
+            print(
+                "Cache hits for %s: %d of %d (%.1f%%)"
+                % (
+                    stage.split(":")[0],
+                    hits,
+                    hits + misses,
+                    100 * hits / max(hits + misses, 1),
+                )
+            )
+
+    def close(self):
+        self.report()
+        with self.conn:
+            for stage, (used, new, stats) in self.stages.items():
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO clean_result VALUES (?, ?, ?, ?)",
+                    ((stage, key, value, self.now) for key, value in new.items()),
+                )
+                self.conn.executemany(
+                    "UPDATE clean_result SET used = ? WHERE stage = ? AND input = ?",
+                    ((self.now, stage, key) for key in used - new.keys()),
+                )
+        self.evict()
+        self.conn.close()
+
+    def evict(self):
+        (size,) = self.conn.execute(
+            f"SELECT coalesce(sum({RESULT_SIZE}), 0) FROM clean_result"
+        ).fetchone()
+        if size <= self.max_size:
+            return
+        # Remove the least recently used results until enough bytes are gone
+        with self.conn:
+            self.conn.execute(
+                f"""
+                DELETE FROM clean_result WHERE (stage, input) IN (
+                    SELECT stage, input
+                    FROM (
+                        SELECT stage, input, sum({RESULT_SIZE}) OVER (
+                            ORDER BY used ROWS UNBOUNDED PRECEDING
+                        ) - {RESULT_SIZE} AS removed_before
+                        FROM clean_result
+                    )
+                    WHERE removed_before < ?
+                )
+                """,
+                [size - self.max_size],
+            )
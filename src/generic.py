@@ -8,9 +8,9 @@ def translation(conn, lang):
         """
         CREATE TABLE translation AS
         WITH lang_trans AS (
-            SELECT lexentry, sense_num, sense,
+            SELECT lexentry_id, sense_num, sense,
                 from_vocable AS written_rep, trans_list, score,
-                score >= 20 AND lexentry IS NOT NULL AS is_good,
+                score >= 20 AND lexentry_id IS NOT NULL AS is_good,
                 from_importance * to_importance AS importance
             FROM infer.infer_grouped
             WHERE from_lang = ? AND to_lang = ?
@@ -34,16 +34,16 @@ def translation(conn, lang):
         """
         DROP VIEW IF EXISTS main.translation_grouped;
         CREATE VIEW translation_grouped AS
-        SELECT lexentry, written_rep, min(sense_num) AS min_sense_num,
+        SELECT lexentry_id, written_rep, min(sense_num) AS min_sense_num,
             group_concat(sense, ' | ') AS sense_list,
             trans_list, max(score) AS score, max(importance) AS importance
         FROM (
             -- force order in group_concat
             SELECT *
             FROM translation
-            ORDER BY lexentry, written_rep, trans_list, sense_num, score DESC
+            ORDER BY lexentry_id, written_rep, trans_list, sense_num, score DESC
         )
-        GROUP BY lexentry, written_rep, trans_list
+        GROUP BY lexentry_id, written_rep, trans_list
     """
     )
 
@@ -116,6 +116,38 @@ def make_targets(
     print()
 
 
+def compare_tables(conn, schema_a, schema_b):
+    """Return the number of rows which differ for each table of `schema_b`"""
+    differences = {}
+    for (table,) in conn.execute(
+        f"""
+        SELECT name FROM {schema_b}.sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+        ORDER BY name
+    """
+    ).fetchall():
+        columns = ", ".join(
+            '"%s"' % name
+            for (name,) in conn.execute(
+                "SELECT name FROM pragma_table_info(?, ?)", [table, schema_b]
+            )
+        )
+        counted = "SELECT {0}, count(*) FROM {1}.%s GROUP BY {0}" % table
+        (count,) = conn.execute(
+            f"""
+            SELECT count(*) FROM (
+                SELECT * FROM ({counted.format(columns, schema_a)}
+                               EXCEPT {counted.format(columns, schema_b)})
+                UNION ALL
+                SELECT * FROM ({counted.format(columns, schema_b)}
+                               EXCEPT {counted.format(columns, schema_a)})
+            )
+        """
+        ).fetchone()
+        differences[table] = count
+    return differences
+
+
 def koreader_dict_list():
     """Generate KOReader's downloadable-dictionary list for all built StarDict
     dictionaries, as a self-contained Lua module printed to stdout.
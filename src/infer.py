@@ -1,43 +1,148 @@
+import os
 import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, permutations, product
 
-from helper import make_targets
+from helper import compare_tables, make_targets, supported_langs
 
+# all_trans is stored in one table per from_lang, so that the translations
+# of a language can be replaced without touching the other languages. The
+# all_trans view adds the from_lang as a constant, which lets SQLite skip
+# the other partitions when querying for a from_lang.
+CREATE_PARTITION = """
+    CREATE TABLE IF NOT EXISTS all_trans_%s(
+        to_lang text NOT NULL,
+        lexentry_id int,
+        sense_num text,
+        sense text NOT NULL,
+        from_vocable text NOT NULL,
+        to_vocable text NOT NULL,
+        from_importance float NOT NULL,
+        to_importance floa NOT NULL
+    );
+"""
+CREATE_PARTITION_INDEX = """
+    CREATE INDEX IF NOT EXISTS all_trans_%s_to_lang_idx ON all_trans_%s(to_lang);
+"""
+COLLECT_QUERY = """
+    SELECT ?, lexentry_id, sense_num, coalesce(sense, ''),
+        written_rep, trans, from_importance, to_importance
+    FROM %s.translation
+"""
 
-def collect(conn, lang):
-    (from_lang, to_lang) = lang.split("-")
+
+def partition_langs(conn, schema="main"):
+    """Return the from_langs which have an all_trans partition"""
+    return [
+        name[len("all_trans_") :]
+        for (name,) in conn.execute(
+            rf"""
+            SELECT name FROM {schema}.sqlite_master
+            WHERE type = 'table' AND name LIKE 'all\_trans\_%' ESCAPE '\'
+            ORDER BY name
+        """
+        )
+    ]
+
+
+def create_all_trans_view(conn):
+    conn.execute("DROP VIEW IF EXISTS main.all_trans")
+    conn.execute(
+        "CREATE VIEW main.all_trans AS "
+        + "\nUNION ALL\n".join(
+            f"SELECT '{lang}' AS from_lang, * FROM all_trans_{lang}"
+            for lang in partition_langs(conn)
+        )
+    )
+
+
+def create_changed_pair(conn):
+    # pairs which have been collected since the last infer run
     conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS all_trans(
-            from_lang text NOT NULL,
-            to_lang text NOT NULL,
-            lexentry text,
-            sense_num text,
-            sense text NOT NULL,
-            from_vocable text NOT NULL,
-            to_vocable text NOT NULL,
-            from_importance float NOT NULL,
-            to_importance floa NOT NULL
+        CREATE TABLE IF NOT EXISTS changed_pair(
+            from_lang text,
+            to_lang text,
+            PRIMARY KEY (from_lang, to_lang)
         );
     """
     )
+
+
+def collect(conn, lang):
+    (from_lang, to_lang) = lang.split("-")
+    if from_lang not in partition_langs(conn):
+        conn.execute(CREATE_PARTITION % from_lang)
+        conn.execute(CREATE_PARTITION_INDEX % (from_lang, from_lang))
+        create_all_trans_view(conn)
+    create_changed_pair(conn)
+    conn.execute(f"DELETE FROM all_trans_{from_lang} WHERE to_lang = ?", [to_lang])
     conn.execute(
-        """
-        DELETE FROM all_trans
-        WHERE from_lang = ? AND to_lang = ?
-    """,
-        [from_lang, to_lang],
+        f"INSERT INTO all_trans_{from_lang} " + COLLECT_QUERY % "processed", [to_lang]
     )
     conn.execute(
-        """
-        INSERT INTO all_trans
-        SELECT ?, ?, lexentry, sense_num, coalesce(sense, ''),
-            written_rep, trans, from_importance, to_importance
-        FROM processed.translation
-    """,
-        [from_lang, to_lang],
+        "INSERT OR IGNORE INTO changed_pair VALUES (?, ?)", [from_lang, to_lang]
     )
 
 
+def collect_all(langs, **kwargs):
+    """Collect all pairs of `langs` from their processed pair dbs
+
+    This replaces one `infer-collect` run per pair. As many pair dbs as
+    SQLite allows are attached at once and loaded in a single transaction.
+    The partitions are only indexed after loading. Pairs with languages
+    which are not in `langs` are kept.
+    """
+    if langs == ["all"]:
+        langs = supported_langs
+    start = time.perf_counter()
+    conn = sqlite3.connect("dictionaries/infer.sqlite3", isolation_level=None)
+    batch_size = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    create_changed_pair(conn)
+    print("infer.sqlite3: collect", flush=True, end=" ")
+    for from_lang, pairs in groupby(permutations(langs, 2), key=lambda p: p[0]):
+        pairs = list(pairs)
+        if from_lang in partition_langs(conn):
+            conn.execute(f"DROP INDEX IF EXISTS all_trans_{from_lang}_to_lang_idx")
+            conn.execute(
+                f"""
+                DELETE FROM all_trans_{from_lang}
+                WHERE to_lang IN ({", ".join("?" * len(pairs))})
+            """,
+                [to_lang for _, to_lang in pairs],
+            )
+        conn.execute(CREATE_PARTITION % from_lang)
+        for i in range(0, len(pairs), batch_size):
+            batch = pairs[i : i + batch_size]
+            for n, (_, to_lang) in enumerate(batch):
+                path = f"dictionaries/processed/{from_lang}-{to_lang}.sqlite3"
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+                conn.execute(f"ATTACH DATABASE ? AS pair{n}", [path])
+            # The attached dbs stay locked until the end of the transaction,
+            # so each batch is inserted in its own one before detaching them.
+            conn.execute(
+                f"INSERT INTO all_trans_{from_lang} "
+                + " UNION ALL ".join(
+                    COLLECT_QUERY % f"pair{n}" for n in range(len(batch))
+                ),
+                [to_lang for _, to_lang in batch],
+            )
+            for n in range(len(batch)):
+                conn.execute(f"DETACH DATABASE pair{n}")
+        conn.executemany("INSERT OR IGNORE INTO changed_pair VALUES (?, ?)", pairs)
+        print(from_lang, flush=True, end=" ")
+    print("index", flush=True, end=" ")
+    for lang in langs:
+        conn.execute(CREATE_PARTITION_INDEX % (lang, lang))
+    create_all_trans_view(conn)
+    (count,) = conn.execute("SELECT count(*) FROM all_trans").fetchone()
+    conn.close()
+    print("(%d rows in %.1fs)" % (count, time.perf_counter() - start))
+
+
 class AggByScore:
     def __init__(self):
         self.trans_list = []
@@ -58,12 +163,234 @@ class AggByScore:
         return " | ".join(result)
 
 
-def infer(**kwargs):
-    conn = sqlite3.connect("dictionaries/infer.sqlite3")
+# The tables created by infer.sql in dependency order, with the condition
+# which limits them to the scope of a run
+INFER_TABLES = {
+    "backlink_score": "(from_lang, to_lang) IN (SELECT * FROM backlink_pair)",
+    "indirect": "(from_lang, pivot_lang, to_lang) IN (SELECT * FROM indirect_triple)",
+    "with_lexentry": "(from_lang, to_lang) IN (SELECT * FROM infer_pair)",
+    "infer": "(from_lang, to_lang) IN (SELECT * FROM infer_pair)",
+    "infer_grouped": "(from_lang, to_lang) IN (SELECT * FROM infer_pair)",
+}
+
+
+def affected_pairs(changed, langs):
+    """Return the scope of the infer tables which depends on `changed` pairs
+
+    Returns the pairs for backlink_score, the (from_lang, pivot_lang,
+    to_lang) triples for indirect and the pairs for all later tables. A
+    changed pair X-Y is used for
+    - its backlinks and those of Y-X,
+    - indirect translations from X via Y, from Y via X (which use the
+      backlinks of Y-X) and from anywhere via X to Y,
+    - direct translations X-Y and their reversal Y-X.
+    """
+    langs = set(langs) | {lang for pair in changed for lang in pair}
+    backlink_pairs = set()
+    triples = set()
+    pairs = set()
+    for from_lang, to_lang in changed:
+        backlink_pairs |= {(from_lang, to_lang), (to_lang, from_lang)}
+        for lang in langs:
+            triples |= {
+                (from_lang, to_lang, lang),
+                (to_lang, from_lang, lang),
+                (lang, from_lang, to_lang),
+            }
+            pairs |= {(from_lang, lang), (to_lang, lang), (lang, to_lang)}
+    return sorted(backlink_pairs), sorted(triples), sorted(pairs)
+
+
+def all_pairs(langs):
+    """Return the scope of a full infer run, see `affected_pairs`"""
+    pairs = list(product(langs, repeat=2))
+    return pairs, list(product(langs, repeat=3)), pairs
+
+
+def create_scope(conn, backlink_pairs, triples, pairs, max_fanout=None):
+    """Fill the temp tables which limit the rows computed by infer.sql
+
+    With a `max_fanout`, only the `max_fanout` most important translations
+    of each pivot vocable are used for indirect translations, and those
+    with a backlink to the source vocable.
+    """
+    conn.executescript(
+        """
+        DROP TABLE IF EXISTS temp.backlink_pair;
+        DROP TABLE IF EXISTS temp.indirect_triple;
+        DROP TABLE IF EXISTS temp.infer_pair;
+        DROP TABLE IF EXISTS temp.pivot_fanout;
+        CREATE TEMPORARY TABLE backlink_pair (from_lang, to_lang);
+        CREATE TEMPORARY TABLE indirect_triple (from_lang, pivot_lang, to_lang);
+        CREATE TEMPORARY TABLE infer_pair (from_lang, to_lang);
+        CREATE TEMPORARY TABLE pivot_fanout (max_fanout);
+    """
+    )
+    conn.executemany("INSERT INTO backlink_pair VALUES (?, ?)", backlink_pairs)
+    conn.executemany("INSERT INTO indirect_triple VALUES (?, ?, ?)", triples)
+    conn.executemany("INSERT INTO infer_pair VALUES (?, ?)", pairs)
+    conn.execute("INSERT INTO pivot_fanout VALUES (?)", [max_fanout])
+
+
+# The rows which infer.sql reads besides the ones it computes for the scope
+SHARD_CONTEXT = {
+    "backlink_score": """
+        (from_lang, to_lang) IN (SELECT from_lang, pivot_lang FROM indirect_triple)
+    """,
+    "indirect": "(from_lang, to_lang) IN (SELECT * FROM infer_pair)",
+}
+
+
+def infer_shard(shard_path, scope, max_fanout):
+    """Run infer.sql for the `scope` of one from_lang into the db `shard_path`"""
+    started = time.perf_counter()
+    conn = sqlite3.connect(shard_path)
     conn.create_aggregate("agg_by_score", 2, AggByScore)
+    # all_trans is read from here, the infer tables are written to the shard
+    conn.execute("ATTACH DATABASE 'dictionaries/infer.sqlite3' AS shared")
+    create_scope(conn, *scope, max_fanout)
+    for table, where in SHARD_CONTEXT.items():
+        create_sql = conn.execute(
+            "SELECT sql FROM shared.sqlite_master WHERE name = ?", [table]
+        ).fetchone()
+        if create_sql:  # only for incremental runs
+            conn.execute(create_sql[0])
+            conn.execute(
+                f"INSERT INTO main.{table} SELECT * FROM shared.{table} WHERE {where}"
+            )
     conn.executescript(open("src/infer.sql").read())
-    conn.isolation_level = None
-    conn.execute("ANALYZE main")
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def infer_sharded(conn, scope, jobs, max_fanout):
+    """Run infer.sql for each from_lang of `scope` in a pool of processes
+
+    The rows of a from_lang only depend on all_trans and on rows of the same
+    from_lang, so each from_lang is computed in its own staging db. The
+    shards are merged in the order of their from_langs, without the rows
+    they only copied from infer.sqlite3 to compute the others.
+    """
+    # The shards need to see everything written so far
+    conn.commit()
+    staging_path = "dictionaries/staging"
+    os.makedirs(staging_path, exist_ok=True)
+    langs = sorted({pair[0] for part in scope for pair in part})
+    shard_paths = [f"{staging_path}/infer.{lang}.sqlite3" for lang in langs]
+    for path in shard_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    print(f"({len(langs)} shards, {jobs} jobs)")
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(
+                infer_shard,
+                path,
+                [[row for row in part if row[0] == lang] for part in scope],
+                max_fanout,
+            )
+            for lang, path in zip(langs, shard_paths)
+        ]
+        results = [f.result() for f in futures]
+
+    create_scope(conn, *scope, max_fanout)
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+    for table, where in INFER_TABLES.items():
+        if table in tables:
+            conn.execute(f"DELETE FROM {table} WHERE {where}")
+    indexes = []
+    for lang, path, seconds in zip(langs, shard_paths, results):
+        print("  shard %s: %.2fs" % (lang, seconds))
+        conn.execute("ATTACH DATABASE ? AS shard", [path])
+        for table, where in INFER_TABLES.items():
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS main.{table} AS
+                SELECT * FROM shard.{table} LIMIT 0
+            """
+            )
+            conn.execute(
+                f"""
+                INSERT INTO main.{table}
+                SELECT * FROM shard.{table} WHERE {where}
+            """
+            )
+        indexes = conn.execute(
+            "SELECT name, sql FROM shard.sqlite_master WHERE type = 'index'"
+        ).fetchall()
+        conn.commit()
+        conn.execute("DETACH DATABASE shard")
+        os.remove(path)
+    # Indexes are only created after merging, like in a single process
+    for name, sql in indexes:
+        if name not in tables:
+            conn.execute(sql)
+
+
+def verify_infer(max_fanout=None):
+    """Run infer.sql from scratch and compare it with the incremental result"""
+    path = "dictionaries/verify/infer.sqlite3"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.create_aggregate("agg_by_score", 2, AggByScore)
+    conn.execute("ATTACH DATABASE 'dictionaries/infer.sqlite3' AS incremental")
+    for lang in partition_langs(conn, "incremental"):
+        conn.execute(CREATE_PARTITION % lang)
+        conn.execute(
+            f"INSERT INTO all_trans_{lang} SELECT * FROM incremental.all_trans_{lang}"
+        )
+        conn.execute(CREATE_PARTITION_INDEX % (lang, lang))
+    create_all_trans_view(conn)
+    conn.commit()
+    create_scope(conn, *all_pairs(partition_langs(conn)), max_fanout)
+    # infer.sql must not see the tables of the incremental run
+    conn.execute("DETACH DATABASE incremental")
+    conn.executescript(open("src/infer.sql").read())
+    conn.execute("ATTACH DATABASE 'dictionaries/infer.sqlite3' AS incremental")
+    differences = compare_tables(conn, "incremental", "main")
+    conn.close()
+    for table, count in differences.items():
+        print(f"  {table}: {count} rows differ")
+    if any(differences.values()):
+        sys.exit("Incremental infer differs from the full one")
+
+
+def infer(incremental, verify, jobs, max_fanout, **kwargs):
+    conn = sqlite3.connect("dictionaries/infer.sqlite3")
+    conn.create_aggregate("agg_by_score", 2, AggByScore)
+    create_changed_pair(conn)
+    done = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'infer_grouped'"
+    ).fetchone()
+    incremental = (incremental or verify) and done
+    if incremental:
+        changed = conn.execute("SELECT * FROM changed_pair").fetchall()
+        scope = affected_pairs(changed, partition_langs(conn))
+        print(
+            "infer.sqlite3: %d changed pairs affect %d pairs"
+            % (len(changed), len(scope[2]))
+        )
+    else:
+        scope = all_pairs(partition_langs(conn))
+        for table in INFER_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+    if jobs == 1:
+        create_scope(conn, *scope, max_fanout)
+        conn.executescript(open("src/infer.sql").read())
+    else:
+        infer_sharded(conn, scope, jobs, max_fanout)
+    conn.execute("DELETE FROM changed_pair")
+    conn.commit()
+    if not incremental:
+        conn.isolation_level = None
+        conn.execute("ANALYZE main")
+    conn.close()
+    if verify:
+        verify_infer(max_fanout)
 
 
 def do(lang, sql, **kwargs):
@@ -89,5 +416,39 @@ def add_subparsers(subparsers):
     process.set_defaults(func=do)
     process.add_argument("--sql")
 
+    process = subparsers.add_parser(
+        "infer-collect-all",
+        help="collect all pairs of the given languages at once, "
+        "instead of running infer-collect for each pair",
+    )
+    process.add_argument("langs", nargs="*", default=["all"], metavar="lang")
+    process.set_defaults(func=collect_all)
+
     process = subparsers.add_parser("infer", help="")
     process.set_defaults(func=infer)
+    process.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only recompute the pairs affected by the pairs collected since "
+        "the previous infer run",
+    )
+    process.add_argument(
+        "--verify",
+        action="store_true",
+        help="infer incrementally, then from scratch into dictionaries/verify "
+        "and compare both",
+    )
+    process.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="infer the translations of each source language in a separate "
+        "process, using this many processes at once",
+    )
+    process.add_argument(
+        "--max-fanout",
+        type=int,
+        help="only use the MAX_FANOUT most important translations of each "
+        "pivot vocable and those with a backlink to the source vocable "
+        "(see `bench pivot-fanout` for the effect on the results)",
+    )
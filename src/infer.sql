@@ -1,5 +1,8 @@
-DROP VIEW IF EXISTS backlink_full;
-CREATE VIEW backlink_full AS
+-- Only the rows for the pairs in temp.backlink_pair, temp.indirect_triple
+-- and temp.infer_pair are (re)computed. For a full run, these contain all
+-- pairs and the tables are dropped before, see infer.py.
+
+CREATE TEMPORARY VIEW backlink_full AS
 SELECT trans.from_lang, trans.to_lang,
     trans.from_vocable AS from_vocable, trans.to_vocable AS to_vocable,
     trans.sense AS trans_sense, back.sense AS back_sense,
@@ -11,34 +14,68 @@ FROM all_trans trans
         trans.to_lang = back.from_lang AND
         trans.to_vocable = back.from_vocable
     )
+WHERE (trans.from_lang, trans.to_lang) IN (SELECT * FROM backlink_pair)
 GROUP BY trans.from_lang, trans.to_lang, trans.from_vocable, trans.to_vocable,
     trans.sense, back.sense;
 
 
-DROP TABLE IF EXISTS backlink_score;
-CREATE TABLE backlink_score AS
+CREATE TEMPORARY VIEW backlink_score_query AS
 SELECT from_lang, to_lang, from_vocable, to_vocable, back_sense,
     max(cast(good_backlinks AS float) / all_backlinks) AS backlink_score
 FROM backlink_full
 GROUP BY from_lang, to_lang, from_vocable, to_vocable, back_sense;
 
+CREATE TABLE IF NOT EXISTS backlink_score AS
+SELECT * FROM backlink_score_query LIMIT 0;
+DELETE FROM backlink_score
+WHERE (from_lang, to_lang) IN (SELECT * FROM backlink_pair);
+INSERT INTO backlink_score
+SELECT * FROM backlink_score_query;
+
+
+-- The translations from the pivot languages. Only the translations which
+-- are `top` and those with a backlink to the source vocable are used for
+-- indirect translations. With a max_fanout, only the max_fanout most
+-- important translations of each pivot vocable are `top`, so that
+-- polysemous pivot vocables don't add hundreds of rows for each source
+-- vocable.
+CREATE TEMPORARY TABLE pivot_trans (
+    pivot_lang, to_lang, pivot_vocable, to_vocable, sense, to_importance, top
+);
+INSERT INTO pivot_trans
+SELECT from_lang, to_lang, from_vocable, to_vocable, sense, to_importance, 1
+FROM all_trans
+WHERE (from_lang, to_lang) IN (SELECT pivot_lang, to_lang FROM indirect_triple)
+    AND (SELECT max_fanout FROM pivot_fanout) IS NULL;
+INSERT INTO pivot_trans
+SELECT from_lang, to_lang, from_vocable, to_vocable, sense, to_importance,
+    dense_rank() OVER (
+        PARTITION BY from_lang, to_lang, from_vocable
+        ORDER BY max_importance DESC, to_vocable
+    ) <= (SELECT max_fanout FROM pivot_fanout)
+FROM (
+    SELECT *, max(to_importance) OVER (
+            PARTITION BY from_lang, to_lang, from_vocable, to_vocable
+        ) AS max_importance
+    FROM all_trans
+    WHERE (from_lang, to_lang) IN (SELECT pivot_lang, to_lang FROM indirect_triple)
+        AND (SELECT max_fanout FROM pivot_fanout) IS NOT NULL
+);
+CREATE INDEX temp.pivot_trans_idx ON pivot_trans(pivot_lang, pivot_vocable);
 
-DROP TABLE IF EXISTS indirect;
-CREATE TABLE indirect AS
-SELECT t1.from_lang, t2.to_lang, 'indirect' AS source,
-    t1.to_lang || CASE
-            WHEN backlink_score = 1 THEN '+'
-            WHEN backlink_score < 1 THEN '-'
-            ELSE ''
-        END || ':' || t1.to_vocable AS source_detail,
+
+-- The translations via a pivot vocable, marked whether they are used
+CREATE TEMPORARY VIEW pivot_join AS
+SELECT t1.from_lang, t1.to_lang AS pivot_lang, t2.to_lang,
     t1.from_vocable, t2.to_vocable,
-    t1.lexentry, t1.sense_num, t1.sense,
-    coalesce(round(max(backlink_score * backlink_score) * 10, 1), 1) AS score,
-    t1.from_importance, t2.to_importance
+    t1.lexentry_id, t1.sense_num, t1.sense,
+    backlink_score, t1.to_vocable AS pivot_vocable,
+    t1.from_importance, t2.to_importance,
+    t2.top OR backlink_score > 0 AS used
 FROM all_trans t1
-    JOIN all_trans t2 ON (
-        t1.to_lang = t2.from_lang AND
-        t1.to_vocable = t2.from_vocable
+    JOIN pivot_trans t2 ON (
+        t1.to_lang = t2.pivot_lang AND
+        t1.to_vocable = t2.pivot_vocable
     )
     LEFT JOIN backlink_score backlink ON (
         -- When the intermediate language has a sense with a translation
@@ -50,44 +87,101 @@ FROM all_trans t1
         backlink.to_vocable = t1.to_vocable AND
         backlink.back_sense = t2.sense
     )
+WHERE (t1.from_lang, t1.to_lang) IN (SELECT from_lang, pivot_lang FROM indirect_triple)
+    AND (t1.from_lang, t1.to_lang, t2.to_lang) IN (SELECT * FROM indirect_triple);
 -- Translating from a language to itself makes no sense, but it's great for debugging!
---WHERE t1.from_lang != t2.to_lang
-GROUP BY t1.from_lang, t2.to_lang, t1.from_vocable, t2.to_vocable, t1.to_lang,
-    t1.lexentry, t1.sense_num, t1.sense;
+--  AND t1.from_lang != t2.to_lang
+
+
+-- The best translation of each lexentry via each pivot language. All
+-- columns come from the row with the highest backlink score and, if
+-- several rows have it, with the greatest pivot vocable.
+CREATE TEMPORARY VIEW indirect_best AS
+SELECT from_lang, pivot_lang, to_lang, from_vocable, to_vocable,
+    lexentry_id, sense_num, sense,
+    backlink_score, pivot_vocable,
+    from_importance, to_importance
+FROM (
+    SELECT from_lang, pivot_lang, to_lang, from_vocable, to_vocable,
+        lexentry_id, sense_num, sense,
+        backlink_score, pivot_vocable,
+        from_importance, to_importance,
+        -- Selects the row for all other columns. Backlink scores are ratios
+        -- of small counts, so the 16 digits of printf are enough to order them.
+        max(printf('%.17f', coalesce(backlink_score, -1) + 1) || pivot_vocable)
+    FROM pivot_join
+    WHERE used
+    GROUP BY from_lang, to_lang, from_vocable, to_vocable, pivot_lang,
+        lexentry_id, sense_num, sense
+);
+
 
+CREATE TEMPORARY VIEW indirect_query AS
+SELECT from_lang, pivot_lang, to_lang, 'indirect' AS source,
+    pivot_lang || CASE
+            WHEN backlink_score = 1 THEN '+'
+            WHEN backlink_score < 1 THEN '-'
+            ELSE ''
+        END || ':' || pivot_vocable AS source_detail,
+    from_vocable, to_vocable,
+    lexentry_id, sense_num, sense,
+    coalesce(round(backlink_score * backlink_score * 10, 1), 1) AS score,
+    from_importance, to_importance
+FROM indirect_best;
+
+CREATE TABLE IF NOT EXISTS indirect AS
+SELECT * FROM indirect_query LIMIT 0;
+DELETE FROM indirect
+WHERE (from_lang, pivot_lang, to_lang) IN (SELECT * FROM indirect_triple);
+INSERT INTO indirect
+SELECT * FROM indirect_query;
 
-DROP VIEW IF EXISTS direct;
-CREATE VIEW direct AS
+
+CREATE TEMPORARY VIEW direct AS
 SELECT from_lang, to_lang, 'direct' AS source,
     null AS source_detail,
     from_vocable, to_vocable,
-    lexentry, sense_num, sense,
+    lexentry_id, sense_num, sense,
     100 AS score,
     from_importance, to_importance
 FROM all_trans;
 
 
-DROP VIEW IF EXISTS direct_reverse;
-CREATE VIEW direct_reverse AS
+CREATE TEMPORARY VIEW direct_reverse AS
 SELECT to_lang AS from_lang, from_lang AS to_lang, 'direct_reverse' AS source,
     null AS source_detail,
     to_vocable AS from_vocable, from_vocable AS to_vocable,
-    null AS lexentry, null AS sense_num, null AS sense,
+    null AS lexentry_id, null AS sense_num, null AS sense,
     2 AS score,
     from_importance, to_importance
 FROM all_trans;
 
 
-DROP TABLE IF EXISTS with_lexentry;
-CREATE TABLE with_lexentry AS
+CREATE TEMPORARY VIEW with_lexentry_query AS
 SELECT * FROM direct
+WHERE (from_lang, to_lang) IN (SELECT * FROM infer_pair)
 UNION ALL
-SELECT * FROM indirect;
-CREATE INDEX w_lex_idx  ON with_lexentry(from_lang, to_lang, from_vocable, to_vocable);
-
-
-DROP VIEW IF EXISTS all_inputs;
-CREATE VIEW all_inputs AS
+SELECT from_lang, to_lang, source, source_detail,
+    from_vocable, to_vocable,
+    lexentry_id, sense_num, sense,
+    score,
+    from_importance, to_importance
+FROM indirect
+WHERE (from_lang, to_lang) IN (SELECT * FROM infer_pair);
+
+CREATE TABLE IF NOT EXISTS with_lexentry AS
+SELECT * FROM with_lexentry_query LIMIT 0;
+DELETE FROM with_lexentry
+WHERE (from_lang, to_lang) IN (SELECT * FROM infer_pair);
+-- Sorted, so that the sources of the infer table are concatenated in the
+-- same order by full and incremental runs.
+INSERT INTO with_lexentry
+SELECT * FROM with_lexentry_query
+ORDER BY from_lang, to_lang, from_vocable, to_vocable, source, source_detail;
+CREATE INDEX IF NOT EXISTS w_lex_idx  ON with_lexentry(from_lang, to_lang, from_vocable, to_vocable);
+
+
+CREATE TEMPORARY VIEW all_inputs AS
 SELECT *
 FROM with_lexentry
 UNION ALL
@@ -104,28 +198,42 @@ SELECT * FROM (
 );
 
 
-DROP TABLE IF EXISTS infer;
-CREATE TABLE infer AS
-SELECT from_lang, to_lang, lexentry, sense_num, nullif(sense, '') AS sense,
+CREATE TEMPORARY VIEW infer_query AS
+SELECT from_lang, to_lang, lexentry_id, sense_num, nullif(sense, '') AS sense,
     from_vocable, to_vocable,
     group_concat(source) AS sources,
     group_concat(source_detail) AS source_details,
     sum(score) AS score,
     from_importance, to_importance
 FROM all_inputs
-GROUP BY from_lang, to_lang, lexentry, sense_num, sense,
+WHERE (from_lang, to_lang) IN (SELECT * FROM infer_pair)
+GROUP BY from_lang, to_lang, lexentry_id, sense_num, sense,
     from_vocable, to_vocable, from_importance, to_importance;
+
+CREATE TABLE IF NOT EXISTS infer AS
+SELECT * FROM infer_query LIMIT 0;
+DELETE FROM infer
+WHERE (from_lang, to_lang) IN (SELECT * FROM infer_pair);
+INSERT INTO infer
+SELECT * FROM infer_query;
 /* TODO: The following constraint should be ok, but there's still a few violations. */
-/* CREATE UNIQUE INDEX infer_pkey ON infer(from_lang, to_lang, lexentry, */
+/* CREATE UNIQUE INDEX infer_pkey ON infer(from_lang, to_lang, lexentry_id, */
 /*     sense, from_vocable, to_vocable); */
-CREATE INDEX infer_from_to_idx ON infer(from_lang, to_lang);
+CREATE INDEX IF NOT EXISTS infer_from_to_idx ON infer(from_lang, to_lang);
 
 
-DROP TABLE IF EXISTS infer_grouped;
-CREATE TABLE infer_grouped AS
-SELECT from_lang, to_lang, lexentry, sense_num, sense,
+CREATE TEMPORARY VIEW infer_grouped_query AS
+SELECT from_lang, to_lang, lexentry_id, sense_num, sense,
     from_vocable, agg_by_score(to_vocable, score) AS trans_list,
     max(score) AS score,
     from_importance, to_importance
 FROM infer
-GROUP BY from_lang, to_lang, lexentry, sense_num, sense, from_vocable;
+WHERE (from_lang, to_lang) IN (SELECT * FROM infer_pair)
+GROUP BY from_lang, to_lang, lexentry_id, sense_num, sense, from_vocable;
+
+CREATE TABLE IF NOT EXISTS infer_grouped AS
+SELECT * FROM infer_grouped_query LIMIT 0;
+DELETE FROM infer_grouped
+WHERE (from_lang, to_lang) IN (SELECT * FROM infer_pair);
+INSERT INTO infer_grouped
+SELECT * FROM infer_grouped_query;
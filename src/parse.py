@@ -1,5 +1,6 @@
 import re
 
+from html import unescape
 from html.parser import HTMLParser
 from html.entities import name2codepoint
 
@@ -29,6 +30,73 @@ subscript = {
 
 ignore_tag_content = ["ref"]
 
+# Tags as they are written in the dumps. Anything else that starts with "<"
+# (comments, stray "<", broken end tags like "</small/>") is left to the
+# HTMLParser.
+simple_tag = re.compile(
+    r"""<(?:
+        (?P<start>[a-zA-Z][-.a-zA-Z0-9:_]*)
+        (?:\s+[^\s/>"'=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?)*
+        \s*(?P<self_closing>/)?
+    |
+        /(?P<end>[a-zA-Z][-.a-zA-Z0-9:_]*)\s*
+    )>""",
+    re.VERBOSE,
+)
+# The content of these is not parsed as HTML
+cdata_tags = {"script", "style"}
+
+
+def parse_simple_html(html):
+    """Do the same as `MyHTMLParser` in a single pass over `html`
+
+    Returns None if `html` contains anything but simple tags, entities and
+    text.
+    """
+    output = []
+    tag_data = []  # text since the last tag
+    tag_stack = []
+    pos = 0
+    while True:
+        tag_pos = html.find("<", pos)
+        text = html[pos:] if tag_pos < 0 else html[pos:tag_pos]
+        if text:
+            tag_data.append(unescape(text) if "&" in text else text)
+        if tag_pos < 0:
+            break
+
+        match = simple_tag.match(html, tag_pos)
+        if match is None:
+            return None
+        pos = match.end()
+        start, end = match.group("start", "end")
+        if start:
+            tag = start.lower()
+            if tag in cdata_tags:
+                return None
+            output += tag_data
+            tag_data.clear()
+            tag_stack.append(tag)
+            if not match.group("self_closing"):
+                continue
+        else:
+            tag = end.lower()
+
+        if tag_stack and tag == tag_stack[-1]:
+            tag_stack.pop()
+        if tag == "sup":
+            data = "".join(tag_data)
+            output.append(superscript.get(data, data))
+        elif tag == "sub":
+            data = "".join(tag_data)
+            output.append(subscript.get(data, data))
+        elif tag not in ignore_tag_content:
+            output += tag_data
+        tag_data.clear()
+
+    output += tag_data
+    return "".join(output)
+
 
 class MyHTMLParser(HTMLParser):
     def _flush_tag(self):
@@ -78,13 +146,23 @@ class MyHTMLParser(HTMLParser):
     def parse(self, html):
         if html is None:
             return None
-        if "<" not in html:  # performance optimization
+        if "<" not in html and "&" not in html:  # performance optimization
             return html
+        output = parse_simple_html(html)
+        if output is None:
+            output = self.parse_with_html_parser(html)
+        return output
+
+    def parse_with_html_parser(self, html):
+        # Start from a clean state, so that nothing of the previous input is
+        # left in the parser's buffer.
+        self.reset()
         self.output = ""
         self.tag_stack = []
         self.tag_data = ""
 
         self.feed(html)
+        self.close()
 
         self._flush_tag()
         return self.output
@@ -100,21 +178,32 @@ braces_nocat = re.compile(r"\|(?:\d+ )?{{.*nocat=1")
 braces_notclosed = re.compile(r"{{[^}]+")
 
 
+def has_markup(x):
+    """Return whether `x` could be changed by the HTML or wiki syntax cleanup"""
+    return "<" in x or "&" in x or "[[" in x or "''" in x or "{{" in x
+
+
 def repeated_sub(regex, replacement, string):
     """Repeat substituion as often as possible"""
     while True:
-        string, n = double_brackets.subn(r"\1", string)
+        string, n = regex.subn(replacement, string)
         if n == 0:
             return string
 
 
 def clean_wiki_syntax(x):
-    x = noise_at_start.sub("", x)
-    x = repeated_sub(double_brackets, r"\1", x)
-    x = bold_and_italics.sub("", x)
-    x = braces_nocat.sub("", x)
-    # remove when https://bitbucket.org/serasset/dbnary/issues/25 is fixed
-    x = braces_notclosed.sub("", x)
+    # Each pass only runs if the string contains something it could match,
+    # since most strings don't contain any wiki syntax.
+    if x[:1] in (":", "|"):
+        x = noise_at_start.sub("", x)
+    if "[[" in x:
+        x = repeated_sub(double_brackets, r"\1", x)
+    if "''" in x:
+        x = bold_and_italics.sub("", x)
+    if "{{" in x:
+        x = braces_nocat.sub("", x)
+        # remove when https://bitbucket.org/serasset/dbnary/issues/25 is fixed
+        x = braces_notclosed.sub("", x)
     return x.strip()
 
 
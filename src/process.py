@@ -1,7 +1,17 @@
+import glob
+import hashlib
+import math
+import os
 import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial, wraps
 
-from helper import make_targets
+from helper import compare_tables, make_targets
 from languages import language_codes3
+from clean_cache import CleanCache, source_version
 import parse
 
 sense_num_re = re.compile(r"(\d+)(\w)?")
@@ -44,6 +54,99 @@ INFLECTION_TABLES = {
 }
 
 
+ENTRY_QUERY = """
+        SELECT lexentry, vocable, written_rep, part_of_speech, gender,
+            group_concat(pronun, ' | ') AS pronun_list
+        FROM raw.entry
+            LEFT JOIN raw.pos USING (lexentry)
+            LEFT JOIN (
+                SELECT lexentry,
+                    CASE
+                        WHEN min(gender) == max(gender) THEN gender
+                    END AS gender
+                FROM gender
+                GROUP BY lexentry
+            ) USING (lexentry)
+            LEFT JOIN raw.pronun USING (lexentry)
+        -- Actually, I only want to group by lexentry. But by combinding this
+        -- grouping with a unique index, we'll get an error if the result is
+        -- ambiguous.
+        -- TODO: enable this check and resolve the problems
+        --GROUP BY 1, 2, 3,4;
+        GROUP BY lexentry
+        -- The lexentry_ids are assigned in this order, so that sorting by
+        -- lexentry_id is the same as sorting by lexentry.
+        ORDER BY lexentry
+"""
+
+FORM_QUERY = """
+        SELECT entry.lexentry_id, other_written,
+            form.pos, c.rank, form.number,
+            form.mood, form.person, form.tense, form.voice,
+            form."case", form.definiteness, inflection
+        FROM raw.form
+            JOIN entry USING (lexentry)
+            LEFT JOIN inflection_table c ON (
+                form.pos IS c.pos
+                AND form.number IS c.number
+                AND form.mood IS c.mood
+                AND form.person IS c.person
+                AND form.tense IS c.tense
+                AND form.voice IS c.voice
+                AND form."case" IS c."case"
+                AND form.definiteness IS c.definiteness
+            )
+        WHERE form.rowid BETWEEN :start AND :end
+"""
+
+CLEAN_TRANSLATION_QUERY = """
+        SELECT entry.lexentry_id, sense_num,
+            CASE WHEN s.raw_sense IS NULL THEN translation.sense END,
+            s.sense,
+            trans
+        FROM raw.translation
+            JOIN lang.entry USING (lexentry)
+            LEFT JOIN lang.sense s ON (s.raw_sense = translation.sense)
+        WHERE translation.rowid BETWEEN :start AND :end
+"""
+
+# Added to the queries above to only process the changed lexentries. The
+# unary + keeps SQLite from looping over the changed lexentries and scanning
+# the unindexed raw table for each of them.
+CHANGED_FILTER = """
+            AND +entry.lexentry_id IN (SELECT lexentry_id FROM changed_lexentry)
+"""
+
+# The cleaned translations with the columns of the translation table. They
+# are materialized and indexed on the grouping columns and lexentry_id, so
+# that TRANSLATION_QUERY reads them in the order of its groups.
+TRANSLATION_STAGING_QUERY = """
+        SELECT sense_num, sense, written_rep, trans, lexentry_id,
+            from_imp.rel_score AS from_importance,
+            coalesce(to_imp.rel_score, 0.001) AS to_importance
+        FROM cleaned_translation
+            JOIN lang.entry USING (lexentry_id)
+            JOIN lang.rel_importance from_imp USING (vocable)
+            LEFT JOIN other_lang.rel_importance to_imp ON (raw_trans = to_imp.written_rep_guess)
+        WHERE trans != ''
+"""
+
+# Removes duplicates in the case of different lexentries with the same
+# translation and sense. E.g. for transitive and intransitive variants of a
+# vocable which both map to the same translation. The covering index of
+# translation_staging yields the groups one after the other and orders
+# json_group_array, so no temp b-tree is needed.
+TRANSLATION_QUERY = """
+        SELECT min(lexentry_id) AS lexentry_id, sense_num, sense, written_rep, trans,
+            max(from_importance) AS from_importance, max(to_importance) AS to_importance,
+            json_group_array(lexentry_id) AS all_lexentry_ids
+        FROM temp.translation_staging
+        GROUP BY sense_num, sense, written_rep, trans
+"""
+
+LOG_PATH = "dictionaries/logs"
+
+
 class PartOfSpeechChooser:
     def __init__(self):
         self.pos_list = []
@@ -57,6 +160,7 @@ class PartOfSpeechChooser:
 
 
 def log_exceptions(f):
+    @wraps(f)
     def f_with_log(*args, **kwargs):
         try:
             return f(*args, **kwargs)
@@ -98,6 +202,36 @@ def parse_sense(sense, lang):
     return sense
 
 
+def query_plans(conn):
+    plans = []
+    for name, query in [("entry", ENTRY_QUERY), ("form", FORM_QUERY)]:
+        plans.append(name + ":")
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN " + query, dict(start=None, end=None)
+        ).fetchall()
+        plans += ["    " * depth + detail for depth, detail in plan_tree(plan)]
+    return plans
+
+
+def plan_tree(plan):
+    depths = {0: -1}
+    for node_id, parent, _, detail in plan:
+        depths[node_id] = depths.get(parent, -1) + 1
+        yield depths[node_id], detail
+
+
+def log_query_plans(conn, lang):
+    """Write the query plans of the entry and form queries to the logs
+
+    The form query joins the entry table, so this runs after make_entry. The
+    raw dbs are indexed when they are created, see `sparql.run.RAW_INDEXES`.
+    """
+    os.makedirs(LOG_PATH, exist_ok=True)
+    with open(f"{LOG_PATH}/process-{lang}.plan", "w") as f:
+        f.write(f"Query plans for raw/{lang}\n")
+        f.writelines("    " + line + "\n" for line in query_plans(conn))
+
+
 def make_entry(conn, lang):
     if lang == "sv":
         # Swedish has the gender attributed to the forms. Fill the gender table from there.
@@ -112,26 +246,21 @@ def make_entry(conn, lang):
     conn.executescript(
         """
         DROP TABLE IF EXISTS main.entry;
-        CREATE TABLE entry AS
-        SELECT lexentry, vocable, written_rep, part_of_speech, gender,
-            group_concat(pronun, ' | ') AS pronun_list
-        FROM raw.entry
-            LEFT JOIN raw.pos USING (lexentry)
-            LEFT JOIN (
-                SELECT lexentry,
-                    CASE
-                        WHEN min(gender) == max(gender) THEN gender
-                    END AS gender
-                FROM gender
-                GROUP BY lexentry
-            ) USING (lexentry)
-            LEFT JOIN raw.pronun USING (lexentry)
-        -- Actually, I only want to group by lexentry. But by combinding this
-        -- grouping with a unique index, we'll get an error if the result is
-        -- ambiguous.
-        -- TODO: enable this check and resolve the problems
-        --GROUP BY 1, 2, 3,4;
-        GROUP BY lexentry;
+        CREATE TABLE entry (
+            lexentry_id INTEGER PRIMARY KEY,
+            lexentry TEXT,
+            vocable TEXT,
+            written_rep TEXT,
+            part_of_speech TEXT,
+            gender,
+            pronun_list
+        );
+        INSERT INTO entry (
+            lexentry, vocable, written_rep, part_of_speech, gender, pronun_list
+        )
+    """
+        + ENTRY_QUERY
+        + """;
         CREATE UNIQUE INDEX entry_pkey ON entry(lexentry);
 
 --        SELECT lexentry, written_rep, choose_pos(part_of_speech) AS part_of_speech,
@@ -148,44 +277,472 @@ def make_entry(conn, lang):
     )
 
 
-def make_form(conn, lang):
-    conn.create_function(
-        "clean_wiki_syntax", 1, parse.clean_wiki_syntax, deterministic=True
+def map_list(func, values):
+    return list(map(func, values))
+
+
+def cached(cache, stage, func):
+    """Return a function which applies `func` to a list of values"""
+    if cache:
+        return cache.wrap(stage, func, parse.has_markup)
+    return partial(map_list, func)
+
+
+def insert_rows(conn, table, select_sql, transform, params, batch_size):
+    cur = conn.execute(select_sql, params)
+    (width,) = conn.execute(
+        f"SELECT count(*) FROM pragma_table_info('{table}')"
+    ).fetchone()
+    insert_sql = "INSERT INTO %s VALUES (%s)" % (table, ", ".join("?" * width))
+    count = 0
+    for rows in map(transform, iter(lambda: cur.fetchmany(batch_size), [])):
+        conn.executemany(insert_sql, rows)
+        count += len(rows)
+    return count
+
+
+def map_shard(
+    shard_path, attach, create_sql, table, select_sql, transform, params, batch_size
+):
+    """Write the rows of one rowid range into the staging db `shard_path`"""
+    started = time.perf_counter()
+    conn = sqlite3.connect(shard_path)
+    for name, path in attach:
+        conn.execute("ATTACH DATABASE ? AS %s" % name, [path])
+    conn.execute(create_sql)
+    count = insert_rows(conn, table, select_sql, transform, params, batch_size)
+    conn.commit()
+    conn.close()
+    return count, time.perf_counter() - started
+
+
+def map_rows(conn, table, source, select_sql, transform, jobs=1, batch_size=10000):
+    """Fill `table` with the rows of `select_sql` passed through `transform`
+
+    The rows are read and written in batches, so that `transform` can work
+    on many rows at once instead of being called by SQLite for each value.
+    `select_sql` must only select the rows of the `source` table with
+    `rowid BETWEEN :start AND :end`.
+
+    With more than one job, the rowids of `source` are split into ranges
+    which are processed in a pool of processes, so `transform` must be
+    picklable. Each process writes into its own staging db and these
+    shards are merged into `table` in the order of their rowid ranges, so
+    the result is the same as with a single job.
+    """
+    (start, end) = conn.execute(
+        f"SELECT min(rowid), max(rowid) FROM {source}"
+    ).fetchone()
+    if jobs == 1 or start is None:
+        insert_rows(
+            conn, table, select_sql, transform, dict(start=start, end=end), batch_size
+        )
+        return
+
+    # The staging processes need to see everything written so far
+    conn.commit()
+    databases = {
+        name: path for _, name, path in conn.execute("PRAGMA database_list")
+    }
+    attach = [("processed", databases.pop("main"))] + [
+        (name, path) for name, path in databases.items() if name != "temp"
+    ]
+    (create_sql,) = conn.execute(
+        """
+        SELECT sql FROM sqlite_master WHERE name = :table
+        UNION ALL
+        SELECT sql FROM sqlite_temp_master WHERE name = :table
+        """,
+        dict(table=table),
+    ).fetchone()
+
+    shard_count = jobs * 4
+    size = (end - start) // shard_count + 1
+    ranges = [
+        dict(start=start + i * size, end=min(start + (i + 1) * size - 1, end))
+        for i in range(shard_count)
+    ]
+    staging_path = os.path.join(os.path.dirname(attach[0][1]), "staging")
+    os.makedirs(staging_path, exist_ok=True)
+    db_name = os.path.basename(attach[0][1]).rsplit(".", 1)[0]
+    shard_paths = [
+        f"{staging_path}/{db_name}.{table}.{i}.sqlite3" for i in range(shard_count)
+    ]
+    for path in shard_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    print(f"({shard_count} shards, {jobs} jobs)")
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(
+                map_shard,
+                path,
+                attach,
+                create_sql,
+                table,
+                select_sql,
+                transform,
+                r,
+                batch_size,
+            )
+            for path, r in zip(shard_paths, ranges)
+        ]
+        results = [f.result() for f in futures]
+
+    for path, r, (count, seconds) in zip(shard_paths, ranges, results):
+        print(
+            "  shard rowids %d-%d: %d rows in %.2fs"
+            % (r["start"], r["end"], count, seconds)
+        )
+        conn.execute("ATTACH DATABASE ? AS shard", [path])
+        conn.execute(f"INSERT INTO {table} SELECT * FROM shard.{table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE shard")
+        os.remove(path)
+
+
+def hash_contents(rows, version):
+    return [
+        (
+            lexentry_id,
+            lexentry,
+            hashlib.blake2b(
+                (version + "\n" + content).encode("utf-8", "surrogatepass"),
+                digest_size=16,
+            ).digest(),
+        )
+        for lexentry_id, lexentry, content in rows
+    ]
+
+
+def hash_lexentries(conn, raw_table, entry_table, version):
+    """Hash the rows of `raw_table` for each lexentry into temp.new_hash
+
+    Only lexentries in `entry_table` are hashed. The hash includes `version`,
+    so that all lexentries count as changed when the processing code changes.
+    """
+    columns = [
+        name
+        for (name,) in conn.execute(
+            "SELECT name FROM pragma_table_info(?, 'raw') WHERE name != 'lexentry'",
+            [raw_table],
+        )
+    ]
+    row = " || ',' || ".join('quote("%s")' % c for c in columns)
+    conn.executescript(
+        """
+        DROP TABLE IF EXISTS temp.new_hash;
+        CREATE TEMPORARY TABLE new_hash (
+            lexentry_id INTEGER PRIMARY KEY,
+            lexentry TEXT,
+            hash BLOB
+        );
+    """
     )
-    conn.create_function("clean_html", 1, parse.html_parser.parse, deterministic=True)
-    conn.create_function(
-        "clean_inflection", 1, parse.make_inflection_cleaner(lang), deterministic=True
+    insert_rows(
+        conn,
+        "new_hash",
+        f"""
+        SELECT lexentry_id, lexentry, content
+        FROM (
+            SELECT lexentry, group_concat(row, char(30)) AS content
+            FROM (
+                SELECT lexentry, {row} AS row
+                FROM raw.{raw_table}
+                ORDER BY lexentry, row
+            )
+            GROUP BY lexentry
+        ) JOIN {entry_table} USING (lexentry)
+        """,
+        partial(hash_contents, version=version),
+        {},
+        batch_size=10000,
     )
+
+
+def diff_lexentries(conn, raw_table, table):
+    """Compare the new hashes with those stored by the previous build
+
+    The lexentries which have to be processed again are written to
+    `changed_lexentry` and the previous `table` is kept as `prev_<table>`.
+    Returns False if there is no previous build to take unchanged rows from.
+    """
+    tables = {name for (name,) in conn.execute("SELECT name FROM main.sqlite_master")}
+    if not {table, f"{raw_table}_hash"} <= tables:
+        return False
+
+    conn.executescript(
+        f"""
+        DROP TABLE IF EXISTS temp.reused;
+        CREATE TEMPORARY TABLE reused (
+            prev_id INTEGER PRIMARY KEY,
+            lexentry_id INTEGER
+        );
+        INSERT INTO reused
+        SELECT prev.lexentry_id, new_hash.lexentry_id
+        FROM new_hash
+            JOIN main.{raw_table}_hash prev USING (lexentry, hash);
+
+        DROP TABLE IF EXISTS main.changed_lexentry;
+        CREATE TABLE main.changed_lexentry (lexentry_id INTEGER PRIMARY KEY);
+        INSERT INTO changed_lexentry
+        SELECT lexentry_id FROM new_hash
+        WHERE lexentry_id NOT IN (SELECT lexentry_id FROM reused);
+
+        DROP TABLE IF EXISTS main.prev_{table};
+        ALTER TABLE main.{table} RENAME TO prev_{table};
+    """
+    )
+    # Indexes keep their names when the table is renamed
+    for (index,) in conn.execute(
+        "SELECT name FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ?",
+        [f"prev_{table}"],
+    ).fetchall():
+        conn.execute(f"DROP INDEX main.{index}")
+
+    (changed,) = conn.execute("SELECT count(*) FROM changed_lexentry").fetchone()
+    (total,) = conn.execute("SELECT count(*) FROM new_hash").fetchone()
+    print(f"({changed} of {total} lexentries changed)", flush=True, end=" ")
+    return True
+
+
+def copy_unchanged(conn, table):
+    """Copy the rows of unchanged lexentries from the previous build"""
+    columns = [
+        '"%s"' % name
+        for (name,) in conn.execute(
+            "SELECT name FROM pragma_table_info(?) WHERE name != 'lexentry_id'",
+            [f"prev_{table}"],
+        )
+    ]
+    conn.executescript(
+        f"""
+        INSERT INTO main.{table} (lexentry_id, {", ".join(columns)})
+        SELECT reused.lexentry_id, {", ".join("prev." + c for c in columns)}
+        FROM main.prev_{table} prev
+            JOIN reused ON (prev.lexentry_id = reused.prev_id);
+
+        DROP TABLE main.prev_{table};
+        DROP TABLE main.changed_lexentry;
+        DROP TABLE temp.reused;
+    """
+    )
+
+
+def store_hashes(conn, raw_table, incremental):
+    """Keep the new hashes for the next incremental build
+
+    A full build drops the old hashes instead, so that the next incremental
+    build is a full one, too.
+    """
+    if not incremental:
+        conn.execute(f"DROP TABLE IF EXISTS main.{raw_table}_hash")
+        return
+    conn.executescript(
+        f"""
+        DROP TABLE IF EXISTS main.{raw_table}_hash;
+        CREATE TABLE main.{raw_table}_hash (
+            lexentry_id INTEGER PRIMARY KEY,
+            lexentry TEXT,
+            hash BLOB
+        );
+        INSERT INTO main.{raw_table}_hash SELECT * FROM new_hash;
+        DROP TABLE temp.new_hash;
+    """
+    )
+
+
+inflection_cleaner = lru_cache()(parse.make_inflection_cleaner)
+
+
+def clean_forms(rows, lang, clean_html, clean_wiki_syntax):
+    (lexentry_ids, other_written, *rest) = zip(*rows)
+    full = clean_wiki_syntax(clean_html(other_written))
+    inflected = map(inflection_cleaner(lang), full)
+    return list(zip(lexentry_ids, full, *rest, inflected))
+
+
+def make_form(conn, lang, version, cache=None, jobs=1, incremental=False):
+    if incremental:
+        hash_lexentries(conn, "form", "entry", version)
+    reuse = incremental and diff_lexentries(conn, "form", "form")
     conn.executescript(
         """
         DROP TABLE IF EXISTS main.form;
-        CREATE TABLE form AS
-        SELECT *,
-            clean_inflection(other_written_full) AS other_written
-        FROM (
-            SELECT lexentry,
-                clean_wiki_syntax(clean_html(other_written)) AS other_written_full,
-                form.pos, c.rank, form.number,
-                form.mood, form.person, form.tense, form.voice,
-                form."case", form.definiteness, inflection
-            FROM raw.form
-                LEFT JOIN inflection_table c ON (
-                    form.pos IS c.pos
-                    AND form.number IS c.number
-                    AND form.mood IS c.mood
-                    AND form.person IS c.person
-                    AND form.tense IS c.tense
-                    AND form.voice IS c.voice
-                    AND form."case" IS c."case"
-                    AND form.definiteness IS c.definiteness
-                )
+        CREATE TABLE form(
+            lexentry_id INTEGER,
+            other_written_full,
+            pos TEXT,
+            rank,
+            number TEXT,
+            mood TEXT,
+            person TEXT,
+            tense TEXT,
+            voice TEXT,
+            "case" TEXT,
+            definiteness TEXT,
+            inflection TEXT,
+            other_written
         );
-        CREATE INDEX form_lexentry_idx ON form(lexentry);  -- TODO make uniqe on rank?
+    """
+    )
+    map_rows(
+        conn,
+        "form",
+        "raw.form",
+        FORM_QUERY + CHANGED_FILTER if reuse else FORM_QUERY,
+        partial(
+            clean_forms,
+            lang=lang,
+            clean_html=cached(cache, "clean_html", parse.html_parser.parse),
+            clean_wiki_syntax=cached(
+                cache, "clean_wiki_syntax", parse.clean_wiki_syntax
+            ),
+        ),
+        jobs,
+    )
+    if reuse:
+        copy_unchanged(conn, "form")
+    store_hashes(conn, "form", incremental)
+    # TODO make uniqe on rank?
+    conn.execute("CREATE INDEX form_lexentry_idx ON form(lexentry_id)")
+
+
+def local_importance(conn, pair_paths):
+    """Compute the importance of the vocables from the raw dbs
+
+    This gives the same scores as `sparql.queries.importance_query` without
+    running that slow query on Virtuoso. Only the translations into the
+    supported languages are in the raw pair dbs in `pair_paths`, so vocables
+    with translations into other languages get lower scores. The result is
+    in temp.local_importance.
+    """
+    conn.create_function("sqrt", 1, math.sqrt, deterministic=True)
+    conn.execute(
+        """
+        CREATE TEMPORARY TABLE gloss_translation (
+            lexentry TEXT,
+            trans_entity TEXT,
+            PRIMARY KEY (lexentry, trans_entity)
+        ) WITHOUT ROWID
+    """
+    )
+    for path in pair_paths:
+        conn.execute("ATTACH DATABASE ? AS pair", [path])
+        tables = {
+            name
+            for (name,) in conn.execute("SELECT name FROM pair.sqlite_master")
+        }
+        # Like the SPARQL query, only count translations of the whole
+        # lexentry. These come from the gloss query, which has no sense_num.
+        # Some of them are dropped when merging into the translation table.
+        if "translation_gloss" in tables:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO gloss_translation
+                SELECT lexentry, trans_entity FROM pair.translation_gloss
+            """
+            )
+        elif "translation" in tables:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO gloss_translation
+                SELECT lexentry, trans_entity FROM pair.translation
+                WHERE sense_num = ''
+            """
+            )
+        conn.commit()
+        conn.execute("DETACH DATABASE pair")
+
+    # The synonyms point to a page, but the raw nym table only has the
+    # written_rep of its lexentries, which is mapped back to the vocables.
+    conn.executescript(
+        """
+        DROP TABLE IF EXISTS temp.local_importance;
+        CREATE TEMPORARY TABLE local_importance AS
+        SELECT vocable,
+            sqrt(translation_count) + sqrt(coalesce(synonym_count, 0)) AS score
+        FROM (
+            SELECT vocable, count(DISTINCT trans_entity) AS translation_count
+            FROM (
+                SELECT DISTINCT vocable, lexentry
+                FROM raw.entry
+                    JOIN raw.pos USING (lexentry)
+                WHERE part_of_speech NOT IN ('abbreviation', 'letter')
+            )
+                LEFT JOIN gloss_translation USING (lexentry)
+            GROUP BY vocable
+        )
+            LEFT JOIN (
+                SELECT vocable, count(DISTINCT f) AS synonym_count
+                FROM raw.nym
+                    JOIN (
+                        SELECT DISTINCT vocable, written_rep FROM raw.entry
+                    ) ON (t_rep = written_rep)
+                WHERE nym = 'synonym'
+                GROUP BY vocable
+            ) USING (vocable);
+        DROP TABLE temp.gloss_translation;
     """
     )
 
 
-def make_importance(conn, lang):
+def report_importance(conn, lang):
+    """Compare the local importance with the one from the SPARQL query
+
+    A summary is printed and all differing vocables are written to the logs.
+    """
+    conn.executescript(
+        """
+        CREATE TEMPORARY TABLE sparql_importance AS
+        SELECT vocable, avg(score) AS score
+        FROM raw.importance
+        WHERE substr(vocable, 0, 4) = '%(lang3)s'
+        GROUP BY vocable;
+        CREATE UNIQUE INDEX temp.sparql_importance_vocable_idx
+            ON sparql_importance(vocable);
+    """
+        % dict(lang3=language_codes3[lang])
+    )
+    differences = conn.execute(
+        """
+        SELECT * FROM (
+            SELECT vocable, s.score AS sparql_score, l.score AS local_score
+            FROM sparql_importance s
+                LEFT JOIN importance l USING (vocable)
+            WHERE l.score IS NULL OR abs(l.score - s.score) > 1e-9
+            UNION ALL
+            SELECT vocable, NULL, score
+            FROM importance
+            WHERE vocable NOT IN (SELECT vocable FROM sparql_importance)
+        )
+        ORDER BY abs(coalesce(sparql_score, 0) - coalesce(local_score, 0)) DESC
+    """
+    ).fetchall()
+    (total,) = conn.execute("SELECT count(*) FROM importance").fetchone()
+    conn.execute("DROP TABLE temp.sparql_importance")
+
+    only_sparql = sum(local is None for _, _, local in differences)
+    only_local = sum(sparql is None for _, sparql, _ in differences)
+    print(
+        "(%d of %d vocables differ from SPARQL: %d only local, %d only SPARQL)"
+        % (len(differences), total, only_local, only_sparql),
+        flush=True,
+        end=" ",
+    )
+    os.makedirs(LOG_PATH, exist_ok=True)
+    with open(f"{LOG_PATH}/importance-{lang}.tsv", "w") as f:
+        f.write("vocable\tsparql_score\tlocal_score\n")
+        for row in differences:
+            f.write("\t".join("" if x is None else str(x) for x in row) + "\n")
+
+
+def make_importance(conn, lang, local=False):
+    if local:
+        local_importance(
+            conn, sorted(glob.glob("dictionaries/raw/%s-*.sqlite3" % lang))
+        )
     conn.executescript(
         """
         DROP TABLE IF EXISTS main.importance;
@@ -198,7 +755,7 @@ def make_importance(conn, lang):
            --       representation. Case might be different, probably other
            --       things, too.
            replace(substr(vocable, 5), '_', ' ') AS written_rep_guess
-        FROM raw.importance
+        FROM %(source)s
         WHERE substr(vocable, 0, 4) = '%(lang3)s'
         GROUP BY vocable;
 
@@ -219,52 +776,165 @@ def make_importance(conn, lang):
         CREATE UNIQUE INDEX imp_unique_vocable ON importance(vocable);
         CREATE UNIQUE INDEX imp_unique_rep ON importance(written_rep_guess);
         CREATE UNIQUE INDEX rel_imp_unique_rep ON rel_importance(written_rep_guess);
+        CREATE UNIQUE INDEX rel_imp_unique_vocable ON rel_importance(vocable);
     """
-        % dict(lang3=language_codes3[lang])
+        % dict(
+            lang3=language_codes3[lang],
+            source="temp.local_importance" if local else "raw.importance",
+        )
     )
+    if local:
+        conn.execute("DROP TABLE temp.local_importance")
+        if conn.execute(
+            "SELECT 1 FROM raw.sqlite_master WHERE name = 'importance'"
+        ).fetchone():
+            report_importance(conn, lang)
 
 
-def make_translation(conn, lang):
-    (from_lang, _) = lang.split("-")
+def parse_senses(rows, lang, parse_sense):
+    raw_senses = [raw_sense for (raw_sense,) in rows]
+    return list(zip(raw_senses, parse_sense(raw_senses)))
+
 
-    def parse_sense_with_lang(x):
-        return parse_sense(x, from_lang)
+def make_sense(conn, lang, cache=None):
+    """Clean all senses of translations from `lang` once
 
-    conn.create_function("parse_sense_num", 1, parse_sense_num, deterministic=True)
-    conn.create_function("parse_sense", 1, parse_sense_with_lang, deterministic=True)
-    conn.create_function(
-        "clean_wiki_syntax", 1, parse.clean_wiki_syntax, deterministic=True
+    The senses are collected from all raw pair dbs of `lang`, so that the
+    pairs can look up the cleaned senses instead of cleaning the same
+    senses again for each target language.
+    """
+    conn.execute("CREATE TEMPORARY TABLE raw_sense (raw_sense text PRIMARY KEY)")
+    for path in sorted(glob.glob("dictionaries/raw/%s-*.sqlite3" % lang)):
+        conn.execute("ATTACH DATABASE ? AS pair", [path])
+        if conn.execute(
+            "SELECT 1 FROM pair.sqlite_master WHERE name = 'translation'"
+        ).fetchone():
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO raw_sense
+                SELECT sense FROM pair.translation WHERE sense IS NOT NULL
+            """
+            )
+        conn.commit()
+        conn.execute("DETACH DATABASE pair")
+    conn.executescript(
+        """
+        DROP TABLE IF EXISTS main.sense;
+        CREATE TABLE sense (raw_sense text, sense text);
+    """
+    )
+    map_rows(
+        conn,
+        "sense",
+        "temp.raw_sense",
+        "SELECT raw_sense FROM temp.raw_sense WHERE rowid BETWEEN :start AND :end",
+        partial(
+            parse_senses,
+            lang=lang,
+            parse_sense=cached(
+                cache, "parse_sense_" + lang, partial(parse_sense, lang=lang)
+            ),
+        ),
     )
     conn.executescript(
         """
-        CREATE TEMPORARY TABLE t AS
-        SELECT lexentry,
-            parse_sense_num(sense_num) AS sense_num,
-            sense_num AS orig_sense_num,
-            parse_sense(sense) AS sense,
-            written_rep,
-            clean_wiki_syntax(trans) AS trans,
-            coalesce(to_imp.rel_score, 0.001) AS to_importance,
-            from_imp.rel_score AS from_importance
-        FROM raw.translation
-            JOIN lang.entry USING (lexentry)
-            JOIN lang.rel_importance from_imp USING (vocable)
-            LEFT JOIN other_lang.rel_importance to_imp ON (trans = to_imp.written_rep_guess)
+        CREATE UNIQUE INDEX sense_raw_idx ON sense(raw_sense);
+        DROP TABLE temp.raw_sense;
     """
     )
-    # The outer query removes duplicates in the case of different lexentries
-    # with the same translation and sense. E.g. for transitive and intransitive
-    # variants of a vocable which both map to the same translation.
+
+
+def clean_translations(rows, parse_sense, clean_wiki_syntax):
+    (lexentry_ids, sense_nums, unparsed_senses, senses, trans) = zip(*rows)
+    senses = [
+        sense if unparsed is None else parse_sense(unparsed)
+        for unparsed, sense in zip(unparsed_senses, senses)
+    ]
+    return list(
+        zip(
+            lexentry_ids,
+            map(parse_sense_num, sense_nums),
+            sense_nums,
+            senses,
+            trans,
+            clean_wiki_syntax(trans),
+        )
+    )
+
+
+def make_translation(conn, lang, version, cache=None, jobs=1, incremental=False):
+    (from_lang, _) = lang.split("-")
+
+    # The cleaned translations are kept, so that the next incremental build
+    # only has to clean the translations of changed lexentries. The
+    # importances are normalized over all vocables, so they are joined
+    # afterwards.
+    if incremental:
+        hash_lexentries(conn, "translation", "lang.entry", version)
+    reuse = incremental and diff_lexentries(
+        conn, "translation", "cleaned_translation"
+    )
+    conn.executescript(
+        """
+        DROP TABLE IF EXISTS main.cleaned_translation;
+        CREATE TABLE cleaned_translation (
+            lexentry_id INTEGER,
+            sense_num,
+            orig_sense_num TEXT,
+            sense,
+            raw_trans TEXT,
+            trans
+        );
+    """
+    )
+    # The senses have already been cleaned in lang.sense. Senses which are
+    # missing there (e.g. when the raw pair db is newer) are cleaned here.
+    map_rows(
+        conn,
+        "cleaned_translation",
+        "raw.translation",
+        CLEAN_TRANSLATION_QUERY + CHANGED_FILTER
+        if reuse
+        else CLEAN_TRANSLATION_QUERY,
+        partial(
+            clean_translations,
+            parse_sense=partial(parse_sense, lang=from_lang),
+            clean_wiki_syntax=cached(
+                cache, "clean_wiki_syntax", parse.clean_wiki_syntax
+            ),
+        ),
+        jobs,
+    )
+    if reuse:
+        copy_unchanged(conn, "cleaned_translation")
+    store_hashes(conn, "translation", incremental)
+
+    stage_translations(conn)
     conn.executescript(
         """
         DROP TABLE IF EXISTS main.translation;
         CREATE TABLE translation AS
-        SELECT min(lexentry) AS lexentry, sense_num, sense, written_rep, trans,
-            max(from_importance) AS from_importance, max(to_importance) AS to_importance,
-            json_group_array(lexentry) AS all_lexentries
-        FROM t
-        WHERE trans != ''
-        GROUP BY sense_num, sense, written_rep, trans;
+    """
+        + TRANSLATION_QUERY
+        + """;
+        DROP TABLE temp.translation_staging;
+    """
+    )
+
+
+def stage_translations(conn):
+    """Fill temp.translation_staging, which TRANSLATION_QUERY groups"""
+    conn.executescript(
+        """
+        DROP TABLE IF EXISTS temp.translation_staging;
+        CREATE TEMPORARY TABLE translation_staging AS
+    """
+        + TRANSLATION_STAGING_QUERY
+        + """;
+        CREATE INDEX temp.translation_staging_idx ON translation_staging(
+            sense_num, sense, written_rep, trans, lexentry_id,
+            from_importance, to_importance
+        );
     """
     )
 
@@ -284,25 +954,85 @@ def make_inflection_table(conn, lang):
         conn.executescript(INFLECTION_TABLES[lang])
 
 
-def do(lang, only, sql, **kwargs):
+def get_targets(lang, version, cache, jobs, incremental, local_importance):
     if "-" not in lang:
         targets = [
-            ("entry", make_entry),
             ("inflection_table", make_inflection_table),
-            ("form", make_form),
-            ("importance", make_importance),
+            ("entry", make_entry),
+            ("query_plans", log_query_plans),
+            (
+                "form",
+                partial(
+                    make_form,
+                    version=version,
+                    cache=cache,
+                    jobs=jobs,
+                    incremental=incremental,
+                ),
+            ),
+            ("importance", partial(make_importance, local=local_importance)),
+            ("sense", partial(make_sense, cache=cache)),
         ]
         attach = []
     else:
         (from_lang, to_lang) = lang.split("-")
         targets = [
-            ("translation", make_translation),
+            (
+                "translation",
+                partial(
+                    make_translation,
+                    version=version,
+                    cache=cache,
+                    jobs=jobs,
+                    incremental=incremental,
+                ),
+            ),
         ]
         attach = [
             "'dictionaries/processed/%s.sqlite3' AS lang" % (from_lang),
             "'dictionaries/processed/%s.sqlite3' AS other_lang" % (to_lang),
         ]
+    return targets, attach
 
+
+def verify_build(lang, version, jobs, only, local_importance):
+    """Build `lang` from scratch and compare it with the incremental build"""
+    targets, attach = get_targets(
+        lang, version, None, jobs, False, local_importance
+    )
+    path = f"dictionaries/processed/verify/{lang}.sqlite3"
+    if os.path.exists(path):
+        os.remove(path)
+    make_targets(
+        lang,
+        in_path="raw",
+        out_path="processed/verify",
+        targets=targets,
+        attach=attach,
+        only=only,
+    )
+
+    conn = sqlite3.connect(f"dictionaries/processed/{lang}.sqlite3")
+    conn.execute("ATTACH DATABASE ? AS verify", [path])
+    differences = compare_tables(conn, "main", "verify")
+    conn.close()
+    for table, count in differences.items():
+        print(f"  {table}: {count} rows differ")
+    if any(differences.values()):
+        sys.exit(f"Incremental build of {lang} differs from the full build")
+
+
+def do(
+    lang, only, sql, use_cache, jobs, incremental, verify, local_importance, **kwargs
+):
+    version = source_version(parse, sys.modules[__name__])
+    cache = None
+    if use_cache and not sql and jobs == 1:
+        cache = CleanCache(version)
+
+    targets, attach = get_targets(
+        lang, version, cache, jobs, incremental or verify, local_importance
+    )
     make_targets(
         lang,
         in_path="raw",
@@ -312,6 +1042,10 @@ def do(lang, only, sql, **kwargs):
         only=only,
         sql=sql,
     )
+    if cache:
+        cache.close()
+    if verify and not sql:
+        verify_build(lang, version, jobs, only, local_importance)
 
 
 def add_subparsers(subparsers):
@@ -322,3 +1056,34 @@ def add_subparsers(subparsers):
     process.set_defaults(func=do)
     process.add_argument("--only")
     process.add_argument("--sql")
+    process.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="don't use the cache of cleaned strings in dictionaries/cache",
+    )
+    process.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="clean forms and translations in this many processes "
+        "(disables the cache)",
+    )
+    process.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only clean the forms and translations of lexentries which "
+        "changed since the previous incremental build",
+    )
+    process.add_argument(
+        "--verify",
+        action="store_true",
+        help="build incrementally, then build from scratch into "
+        "dictionaries/processed/verify and compare both",
+    )
+    process.add_argument(
+        "--local-importance",
+        action="store_true",
+        help="compute the importance from the raw dbs instead of the SPARQL "
+        "importance query and report the differences to the latter",
+    )
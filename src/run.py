@@ -50,6 +50,9 @@ if __name__ == "__main__":
     import generic
 
     generic.add_subparsers(subparsers)
+    import bench
+
+    bench.add_subparsers(subparsers)
 
     search = subparsers.add_parser("search")
     search.add_argument("from_lang")
@@ -1,15 +1,39 @@
 import urllib.request, urllib.error, urllib.parse
 from urllib.parse import urlencode
+import http.client
 import sqlite3
 import re
 import os
+import io
 import json
-from itertools import chain
+import codecs
+import glob
+import hashlib
+import queue
+import threading
+import time
+from collections import defaultdict, namedtuple
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
 
 from languages import language_codes3
 
-namespace_re = re.compile(r"^(?:http://kaiko.getalp.org/dbnary/|http://.*#)")
+DBNARY_NS = "http://kaiko.getalp.org/dbnary/"
+LEXVO_NS = "http://lexvo.org/id/iso639-3/"
+bucket_key_re = re.compile(r"SELECT\s+(?:DISTINCT\s+)?\?(\w+)", re.IGNORECASE)
+# Marks where `bucket_query` puts the bucket filter into an aggregate query
+BUCKET_FILTER = "# bucket filter"
 fr_sense_re = re.compile(r"^(.*?)[.]?\s*(?:\(\d+\)|\|\d+)?:?$", re.DOTALL)
+tsv_escape_re = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))")
+tsv_escapes = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f"}
+
+CACHE_PATH = "dictionaries/cache/sparql"
+TTL_PATH = "virtuoso/ttl"
+
+RESULT_FORMATS = {
+    "json": "application/json",
+    "tsv": "text/tab-separated-values",
+}
 
 form_query = """
     SELECT ?lexentry ?other_written ?pos
@@ -155,6 +179,27 @@ translation_query = {
 }
 
 
+def all_targets_query(query, to_langs):
+    """Turn a `translation_query` into one for all languages in `to_langs`
+
+    The target language is returned as additional `target_lang` column, so
+    that the results can be split into pairs afterwards.
+    """
+    assert "dbnary:targetLanguage lexvo:%(to_lang3)s" in query
+    target_langs = " ".join("<%s%s>" % (LEXVO_NS, language_codes3[l]) for l in to_langs)
+    query = query.replace(
+        "dbnary:targetLanguage lexvo:%(to_lang3)s",
+        "dbnary:targetLanguage ?target_lang",
+    )
+    select, where = query.split("WHERE {", 1)
+    return (
+        select
+        + "    ?target_lang\n        WHERE {\n"
+        + "            VALUES ?target_lang { %s }" % target_langs
+        + where
+    )
+
+
 importance_query = """
     SELECT ?vocable
         bif:sqrt(?translation_count) + bif:sqrt(?synonym_count) AS ?score
@@ -168,6 +213,7 @@ importance_query = """
             ?vocable a dbnary:Page ;
                      dbnary:describes ?lexentry .
             ?lexentry dct:language lexvo:%(lang3)s .
+            # bucket filter
             OPTIONAL {
                 ?synonym dbnary:synonym ?vocable .
             }
@@ -210,7 +256,7 @@ WHERE {
 """
 
 
-def make_url(query, **fmt_args):
+def make_url(query, result_format="json", **fmt_args):
     assert fmt_args["limit"] <= 1048576, (
         "Virtuoso does not support more than 1048576 results"
     )
@@ -236,7 +282,7 @@ def make_url(query, **fmt_args):
             {
                 "default-graph-uri": "",
                 "query": query % fmt_args,
-                "format": "application/json",
+                "format": RESULT_FORMATS[result_format],
                 "timeout": 0,
             }
         )
@@ -245,31 +291,408 @@ def make_url(query, **fmt_args):
     return url
 
 
-def page_through_results(query, limit, **kwargs):
-    offset = 0
-    while True:
-        url = make_url(query, limit=limit, offset=offset, **kwargs)
+connections = threading.local()
+
+
+def urlopen(url):
+    """Open `url` on a keep-alive connection of the current thread
+
+    `urllib.request.urlopen` opens a new connection for every request.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if not hasattr(connections, "by_host"):
+        connections.by_host = {}
+    conn = connections.by_host.get(parts.netloc)
+    if conn is None:
+        conn = connections.by_host[parts.netloc] = http.client.HTTPConnection(
+            parts.netloc
+        )
+    path = parts.path + "?" + parts.query
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+    except (http.client.HTTPException, ConnectionError):
+        # The server has closed the idle connection or the previous response
+        # has not been read completely. Retry on a new connection.
+        conn.close()
+        conn.request("GET", path)
+        response = conn.getresponse()
+    if response.status != 200:
+        raise urllib.error.HTTPError(
+            url, response.status, response.reason, response.headers, response
+        )
+    return response
+
+
+def dump_version(lang):
+    """Return a stamp that changes when the dumps of `lang` are replaced
+
+    It is based on the names, sizes and modification times of the TTL files
+    loaded by `insert_single_ttl.py`. Returns None if no files are found.
+    """
+    files = sorted(
+        path
+        for name in [lang, language_codes3[lang]]
+        for path in glob.glob(f"{TTL_PATH}/{name}_*.ttl.gz")
+    )
+    if not files:
+        return None
+    stamp = hashlib.sha256()
+    for path in files:
+        stat = os.stat(path)
+        stamp.update(f"{path} {stat.st_size} {stat.st_mtime_ns}\n".encode())
+    return stamp.hexdigest()
+
+
+class ResponseCache:
+    """On-disk cache for SPARQL responses
+
+    The responses are stored under a hash of the URL (which contains the
+    final query text, offset, limit and result format) and the
+    `dump_version`, so that they are invalidated when new dumps are loaded.
+    When the cache exceeds `max_size` bytes, the least recently used
+    responses are removed. With `refresh`, all responses are fetched again.
+    """
+
+    def __init__(self, version, max_size, refresh=False, path=CACHE_PATH):
+        self.version = version
+        self.max_size = max_size
+        self.refresh = refresh
+        self.path = path
+
+    def open(self, url):
+        key = hashlib.sha256(f"{url}\n{self.version}".encode()).hexdigest()
+        filename = os.path.join(self.path, key)
+        if not self.refresh and os.path.exists(filename):
+            os.utime(filename)  # mark as recently used
+            return open(filename, "rb")
+        os.makedirs(self.path, exist_ok=True)
+        return io.BufferedReader(CacheWriter(urlopen(url), filename, self))
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already removed by another process
+            size -= entry_size
+
+
+class CacheWriter(io.RawIOBase):
+    """Copy a response into the cache while it is being read
+
+    The copy is only added to the cache when the response has been read
+    completely, so that interrupted downloads are never used.
+    """
+
+    def __init__(self, response, filename, cache):
+        self.response = response
+        self.filename = filename
+        self.cache = cache
+        self.tmp_filename = "%s.%d.tmp" % (filename, threading.get_native_id())
+        self.file = open(self.tmp_filename, "wb")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.file.closed:
+            return 0
+        size = self.response.readinto(b)
+        if size:
+            self.file.write(b[:size])
+        else:
+            self.file.close()
+            os.replace(self.tmp_filename, self.filename)
+            self.cache.evict()
+        return size
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.tmp_filename)
+        super().close()
+
+
+class BindingStream:
+    """Decode a SPARQL JSON result while it is still being received
+
+    `json.load` keeps the whole decoded result in memory before the first
+    row can be used. This only keeps the current chunk of the response and
+    hands out one binding at a time, so the memory usage does not depend on
+    the page size.
+    """
+
+    decoder = json.JSONDecoder()
+    separator_re = re.compile(r"[\s,]*")
+
+    def __init__(self, response, chunk_size=1 << 16):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.decode = codecs.getincrementaldecoder("utf-8")().decode
+        self.buf = ""
+        self.pos = 0
+        self._skip_past('"vars"')
+        self._skip_past(":")
+        self.cols = self._decode_value()
+        self._skip_past('"bindings"')
+        self._skip_past("[")
+
+    def _read_more(self):
+        data = self.response.read(self.chunk_size)
+        self.buf = self.buf[self.pos :] + self.decode(data, final=not data)
+        self.pos = 0
+        return bool(data)
+
+    def _skip_past(self, marker):
+        while (found := self.buf.find(marker, self.pos)) < 0:
+            self.pos = max(self.pos, len(self.buf) - len(marker))
+            if not self._read_more():
+                raise ValueError("No %s in SPARQL result" % marker)
+        self.pos = found + len(marker)
+
+    def _skip_separators(self):
+        while True:
+            self.pos = self.separator_re.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._read_more():
+                return
+
+    def _decode_value(self):
+        self._skip_separators()
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+                return value
+            except json.JSONDecodeError:
+                # Probably cut off at the end of the buffer
+                if not self._read_more():
+                    raise
+
+    def __iter__(self):
+        while True:
+            self._skip_separators()
+            if self.buf.startswith("]", self.pos):
+                return
+            yield self._decode_value()
+
+
+class TsvStream:
+    """Read a SPARQL TSV result line by line
+
+    Each row is a list of RDF terms in their serialized form, which are
+    converted by `make_tsv_row_converter`. Tabs and newlines inside of
+    literals are escaped, so splitting lines at tabs is safe.
+    """
+
+    def __init__(self, response):
+        self.lines = io.TextIOWrapper(response, encoding="utf-8", newline="\n")
+        header = self.lines.readline().rstrip("\r\n")
+        self.cols = [col.strip('"').lstrip("?") for col in header.split("\t")]
+
+    def __iter__(self):
+        for line in self.lines:
+            yield line.rstrip("\r\n").split("\t")
+
+
+def open_results(response, result_format):
+    return {"json": BindingStream, "tsv": TsvStream}[result_format](response)
+
+
+# Marks the end of a page when paging with checkpoints. `offset` is where
+# the next page of `bucket` starts, or None if there are no more pages.
+PageEnd = namedtuple("PageEnd", ["bucket", "offset"])
+# Marks that the following rows belong to `bucket`, when the rows of several
+# buckets are interleaved.
+BucketRows = namedtuple("BucketRows", ["bucket"])
+CHECKPOINTS = (PageEnd, BucketRows)
+# The column names of the result, returned before the first row
+Columns = namedtuple("Columns", ["names"])
+
+
+def page_through_results(
+    query,
+    limit,
+    stop=None,
+    result_format="json",
+    cache=None,
+    offset=0,
+    bucket="",
+    checkpoints=False,
+    **kwargs,
+):
+    """Page through the results of `query`
+
+    Returns the `Columns` of the result and then its rows, with `PageEnd`
+    markers if `checkpoints` is set.
+    """
+    first_page = True
+    while not (stop and stop.is_set()):
+        url = make_url(
+            query, limit=limit, offset=offset, result_format=result_format, **kwargs
+        )
         try:
-            response = urllib.request.urlopen(url)
+            response = cache.open(url) if cache else urlopen(url)
         except urllib.error.HTTPError as e:
             print(e.read())
             raise
 
-        data = json.load(response)
-
-        global cols
-        cols = data["head"]["vars"]
-        result = data["results"]["bindings"]
-        yield result
-        if len(result) < limit:
+        rows = open_results(response, result_format)
+        if first_page:
+            yield Columns(rows.cols)
+            first_page = False
+        page_size = 0
+        for row in rows:
+            page_size += 1
+            yield row
+        response.read()  # allow reuse of the connection
+        response.close()
+        if page_size < limit:
+            if checkpoints:
+                yield PageEnd(bucket, None)
             break
         else:
             offset += limit
+            if checkpoints:
+                yield PageEnd(bucket, offset)
             print(".")
 
 
-def create_table(conn, table_name, first_result=None):
-    sql_filename = "src/sql/sparql/{}.sql".format(table_name)
+def bucket_prefixes(buckets):
+    digits = 0
+    while 16**digits < buckets:
+        digits += 1
+    assert 16**digits == buckets, "Number of buckets must be a power of 16"
+    return ["%0*x" % (digits, i) for i in range(buckets)] if digits else [""]
+
+
+def bucket_query(query, prefix):
+    """Restrict `query` to rows whose first column hashes to `prefix`
+
+    The md5 hex digest of the first column is evenly distributed, so the
+    prefixes of a given length cut the result into disjoint buckets of
+    similar size, which can be paged through independently.
+
+    Aggregate queries have to group by the first column and contain
+    `BUCKET_FILTER` in the WHERE clause of the grouping. The filter is put
+    there, so that each bucket only groups its own rows instead of the whole
+    result.
+    """
+    key = bucket_key_re.search(query).group(1)
+    bucket_filter = 'FILTER (STRSTARTS(MD5(STR(?%s)), "%s"))' % (key, prefix)
+    if BUCKET_FILTER in query:
+        query = query.replace(BUCKET_FILTER, bucket_filter)
+        bucket_filter = ""
+    return """
+        SELECT *
+        WHERE {
+            {
+                %s
+            }
+            %s
+        }
+        ORDER BY 1
+    """ % (query, bucket_filter)
+
+
+def page_through_buckets(
+    query, limit, buckets, jobs, batch_size=int(1e4), progress=None, **kwargs
+):
+    """Like `page_through_results`, but fetch hash buckets in parallel
+
+    Each bucket is paged through on its own, so that later pages don't make
+    Virtuoso sort and skip the rows of the whole result. At most `jobs`
+    buckets are fetched at the same time and at most `jobs` batches of
+    fetched rows are kept in memory while waiting to be consumed.
+
+    If `progress` is given, `PageEnd` markers are returned between the
+    pages, `BucketRows` markers before the rows of each bucket, and each
+    bucket continues at the offset given in `progress` (a finished bucket
+    has the offset None).
+    """
+    if progress is not None:
+        kwargs["checkpoints"] = True
+    else:
+        progress = {}
+
+    if buckets == 1:
+        if progress.get("", 0) is not None:
+            yield from page_through_results(
+                query, limit, offset=progress.get("", 0), **kwargs
+            )
+        return
+
+    batches = queue.Queue(maxsize=jobs)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def fetch_bucket(prefix):
+        try:
+            results = page_through_results(
+                bucket_query(query, prefix),
+                limit,
+                stop=stop,
+                offset=progress.get(prefix, 0),
+                bucket=prefix,
+                **kwargs,
+            )
+            while batch := list(islice(results, batch_size)):
+                if kwargs.get("checkpoints"):
+                    batch.insert(0, BucketRows(prefix))
+                put(batch)
+        except BaseException as e:
+            put(e)
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(jobs) as executor:
+        try:
+            todo = [
+                prefix
+                for prefix in bucket_prefixes(buckets)
+                if progress.get(prefix, 0) is not None
+            ]
+            remaining = len(todo)
+            for prefix in todo:
+                executor.submit(fetch_bucket, prefix)
+            while remaining:
+                batch = batches.get()
+                if batch is done:
+                    remaining -= 1
+                elif isinstance(batch, BaseException):
+                    raise batch
+                else:
+                    yield from batch
+        finally:
+            stop.set()
+
+
+def sql_filename(table_name):
+    return "src/sql/sparql/{}.sql".format(table_name)
+
+
+def saved_col_types(table_name):
+    """Return the column types from the saved table definition"""
+    with open(sql_filename(table_name)) as f:
+        return dict(re.findall(r'"(\w+)" (\w+)', f.read()))
+
+
+def create_table(conn, table_name, first_result=None, cols=None):
     if first_result:
         sql_types = {
             "http://www.w3.org/2001/XMLSchema#integer": "int",
@@ -278,8 +701,12 @@ def create_table(conn, table_name, first_result=None):
             "http://www.w3.org/2001/XMLSchema#string": "text",
             None: "text",
         }
+        # IRI columns are marked, so that the TSV results can tell them from
+        # literals. The declared type still contains "text" for its affinity.
         col_types = [
-            sql_types[first_result.get(col_name, {}).get("datatype")]
+            "iri text"
+            if first_result.get(col_name, {}).get("type") == "uri"
+            else sql_types[first_result.get(col_name, {}).get("datatype")]
             for col_name in cols
         ]
         sql = """
@@ -294,88 +721,415 @@ def create_table(conn, table_name, first_result=None):
         # Save definition to file. This is required for cases where the query
         # returns no results, so that we can't determine the columns and types
         # from the result.
-        with open(sql_filename, "w") as f:
+        with open(sql_filename(table_name), "w") as f:
             f.write(sql)
     else:
-        with open(sql_filename) as f:
+        with open(sql_filename(table_name)) as f:
             sql = f.read()
 
     conn.executescript(sql)
 
 
-def get_query(table_name, query, **kwargs):
-    if "lang" in kwargs:
-        lang = kwargs["lang"]
-        db_name = lang
-    else:
-        lang = kwargs["from_lang"]
-        kwargs["lang"] = lang
-        db_name = "{}-{}".format(kwargs["from_lang"], kwargs["to_lang"])
+def strip_namespace(uri):
+    """Remove the dbnary namespace or anything up to the last "#" of a URI
 
-    print("Fetch {} (SPARQL)".format(table_name))
-    limit = int(5e5)
-    batches = page_through_results(query, limit=limit, **kwargs)
-    results = chain.from_iterable(batches)
-    path = "dictionaries/raw"
-    os.makedirs(path, exist_ok=True)
-    conn = sqlite3.connect("%s/%s.sqlite3" % (path, db_name))
+    This was a regex substitution before, but prefix checks are faster.
+    """
+    if uri.startswith(DBNARY_NS):
+        return uri[len(DBNARY_NS) :]
+    if uri.startswith("http://"):
+        newline = uri.find("\n")
+        hash_pos = uri.rfind("#", 7, newline if newline >= 0 else len(uri))
+        if hash_pos >= 0:
+            return uri[hash_pos + 1 :]
+    return uri
 
-    try:
-        first_result = next(results)
-    except StopIteration:
-        print("No results!")
-        create_table(conn, table_name)  # create empty table
-        return
 
-    # put first result back into iterable
-    results = chain([first_result], results)
+def fix_encoding(value):
+    # The input contains some badly encoded characters.
+    # Replace these with ?-Symbols to avoid later errors
+    if value.isascii():
+        return value
+    return value.encode("utf-8", "replace").decode()
+
+
+def make_literal_converter(lang, col_name):
+    if lang == "fr" and col_name == "sense":
+
+        def convert_fr_sense(value):
+            # remove sense number references from the end of the gloss
+            match = fr_sense_re.match(value)
+            assert match, f"malformed gloss: {value!r}"
+            return fix_encoding(match.group(1))
+
+        return convert_fr_sense
 
-    create_table(conn, table_name, first_result)
+    return fix_encoding
 
+
+def make_json_row_converter(table_name, cols, lang):
+    """Build a function that converts a JSON binding into table values
+
+    All decisions which only depend on the column are made once here, so
+    that the per-row work is a single pass over prepared converters.
+    """
     py_types = {
         "http://www.w3.org/2001/XMLSchema#integer": int,
         "http://www.w3.org/2001/XMLSchema#decimal": float,
         "http://www.w3.org/2001/XMLSchema#double": float,
-        "http://www.w3.org/2001/XMLSchema#string": str,
+        "http://www.w3.org/2001/XMLSchema#string": fix_encoding,
     }
 
-    def postprocess_literal(col_name, value, **kwargs):
-        if lang == "fr" and col_name == "sense":
-            # remove sense number references from the end of the gloss
-            match = fr_sense_re.match(value)
-            assert match, f"malformed gloss: {value!r}"
-            return match.group(1)
+    def make_cell_converter(col_name):
+        convert_literal = make_literal_converter(lang, col_name)
 
-        return value
+        def convert_cell(cell):
+            cell_type = cell["type"]
+            if cell_type == "literal":
+                return convert_literal(cell["value"])
+            if cell_type == "uri":
+                return fix_encoding(strip_namespace(cell["value"]))
+            return py_types[cell["datatype"]](cell["value"])
 
-    postprocess = {
-        "literal": postprocess_literal,
-        "uri": lambda col_name, value, **kwargs: namespace_re.sub("", value),
-        "typed-literal": lambda col_name, value, datatype, **kwargs: py_types[datatype](
-            value
-        ),
-    }
+        return convert_cell
 
-    def postprocess_row(row):
-        for col_name in cols:
-            if col_name not in row:
-                yield None
-                continue
-            cell = row[col_name]
-            processed = postprocess[cell["type"]](col_name, **cell)
-            if isinstance(processed, str):
-                # The input contains some badly encoded characters.
-                # Replace these with ?-Symbols to avoid later errors
-                processed = processed.encode("utf-8", "replace").decode()
-            yield processed
-
-    print("Inserting into db")
-    cur = conn.cursor()
-    cur.executemany(
-        "INSERT INTO %s VALUES (%s)" % (table_name, ", ".join(["?"] * len(cols))),
-        (list(postprocess_row(r)) for r in results),
+    converters = tuple(
+        (col_name, make_cell_converter(col_name)) for col_name in cols
     )
-    print("Inserted", cur.rowcount, "rows")
 
+    def convert_row(row):
+        return [
+            convert(row[col_name]) if col_name in row else None
+            for col_name, convert in converters
+        ]
+
+    return convert_row
+
+
+def unescape_tsv(match):
+    if match.group(3) is not None:
+        return tsv_escapes.get(match.group(3), match.group(3))
+    return chr(int(match.group(1) or match.group(2), 16))
+
+
+def parse_tsv_term(term, iri=False):
+    """Return the lexical value of an RDF term from a SPARQL TSV result
+
+    `iri` tells whether the term is in an IRI column. Only then are quoted
+    values shortened like IRIs.
+    """
+    if term.startswith("<"):
+        return strip_namespace(term[1:-1])
+    if term.startswith('"'):
+        # Strip language tag or datatype
+        value = term[1 : term.rindex('"')]
+        if "\\" in value:
+            value = tsv_escape_re.sub(unescape_tsv, value)
+        # Virtuoso writes IRIs as plain strings in TSV results
+        return strip_namespace(value) if iri else value
+    # Numbers and booleans are written without quotes
+    return term
+
+
+def make_tsv_row_converter(table_name, cols, lang):
+    """Build a function that converts a TSV result row into table values
+
+    The TSV results don't contain datatypes for the cells, so the column
+    types are taken from the table definition saved by `create_table`.
+    """
+    col_types = saved_col_types(table_name)
+    # Additional columns (like the `target_lang` of `all_targets_query`)
+    # are treated as text.
+    assert [col_name for col_name in cols if col_name in col_types] == list(
+        col_types
+    ), (
+        "Columns differ from %s, run once with JSON results to update it"
+        % sql_filename(table_name)
+    )
+
+    py_types = {"int": int, "real": float}
+    converters = tuple(
+        py_types.get(col_types.get(col_name)) or make_literal_converter(lang, col_name)
+        for col_name in cols
+    )
+    iri_cols = tuple(col_types.get(col_name) == "iri" for col_name in cols)
+
+    def convert_row(row):
+        return [
+            convert(parse_tsv_term(term, iri)) if term else None
+            for convert, iri, term in zip(converters, iri_cols, row)
+        ]
+
+    return convert_row
+
+
+row_converters = {
+    "json": make_json_row_converter,
+    "tsv": make_tsv_row_converter,
+}
+
+
+def fetch_rows(
+    table_name,
+    query,
+    lang,
+    limit=int(5e5),
+    buckets=1,
+    bucket_jobs=4,
+    result_format="json",
+    progress=None,
+    **kwargs,
+):
+    """Fetch the results of `query` and convert them into table rows
+
+    Returns the column names, the first unconverted result (needed by
+    `create_table` to get the column types of JSON results) or None if there
+    are no results, and an iterator over all converted rows. With `progress`,
+    the iterator also contains the `PageEnd` and `BucketRows` markers, see
+    `page_through_buckets`.
+    """
+    results = page_through_buckets(
+        query,
+        limit=limit,
+        buckets=buckets,
+        jobs=bucket_jobs,
+        result_format=result_format,
+        progress=progress,
+        lang=lang,
+        **kwargs,
+    )
+    cols = None
+    checkpoints = []
+    for first_result in results:
+        if type(first_result) is Columns:
+            cols = first_result.names
+        elif type(first_result) in CHECKPOINTS:
+            checkpoints.append(first_result)
+        else:
+            break
+    else:
+        return cols, None, iter(checkpoints)
+
+    # put first result back into iterable
+    results = chain(checkpoints, [first_result], results)
+    convert_row = row_converters[result_format](table_name, cols, lang)
+    # Each bucket returns the columns again
+    if progress is None:
+        rows = (convert_row(row) for row in results if type(row) is not Columns)
+    else:
+        rows = (
+            row if type(row) in CHECKPOINTS else convert_row(row)
+            for row in results
+            if type(row) is not Columns
+        )
+    return cols, first_result, rows
+
+
+def connect_bulk(db_path):
+    """Open a raw db with settings for loading many rows
+
+    The changes are only written to the OS at commits and not synced to the
+    disk. If the process dies, the committed pages are still there to resume
+    from, but if the OS crashes the db can be lost. That is fine, since
+    failed raw dbs are refetched anyway. `close_bulk` switches back to the
+    default journal mode, so that the final file is a normal SQLite db.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        """
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = OFF;
+        PRAGMA cache_size = -262144;  -- 256 MiB
+        PRAGMA temp_store = MEMORY;
+        """
+    )
+    return conn
+
+
+def close_bulk(conn):
     conn.commit()
+    conn.execute("PRAGMA journal_mode = DELETE")
     conn.close()
+
+
+def print_insert_rate(row_count, table_name, start):
+    seconds = time.perf_counter() - start
+    print(
+        "Inserted %d rows into %s in %.1fs (%d rows/s)"
+        % (row_count, table_name, seconds, row_count / max(seconds, 1e-3))
+    )
+
+
+def insert_by_target(conns, table_name, rows, batch_size=int(1e5)):
+    """Insert the rows of an `all_targets_query` into the dbs of their target
+
+    `conns` maps the target languages to the connections of the raw pair
+    dbs. The `target_lang` column is dropped.
+    """
+    start = time.perf_counter()
+    lang_by_uri = {LEXVO_NS + language_codes3[lang]: lang for lang in conns}
+    for conn in conns.values():
+        create_table(conn, table_name)
+    insert_sql = "INSERT INTO %s VALUES (%s)" % (
+        table_name,
+        ", ".join(["?"] * len(saved_col_types(table_name))),
+    )
+
+    batches = {to_lang: [] for to_lang in conns}
+    row_counts = dict.fromkeys(conns, 0)
+    for row in rows:
+        to_lang = lang_by_uri[row[-1]]
+        batch = batches[to_lang]
+        batch.append(row[:-1])
+        if len(batch) == batch_size:
+            conns[to_lang].executemany(insert_sql, batch)
+            row_counts[to_lang] += len(batch)
+            batch.clear()
+    for to_lang, batch in batches.items():
+        conns[to_lang].executemany(insert_sql, batch)
+        row_counts[to_lang] += len(batch)
+    print(" ".join("%s:%d" % count for count in row_counts.items()))
+    print_insert_rate(sum(row_counts.values()), table_name, start)
+
+
+def load_progress(conn, table_name, query_hash):
+    """Return the progress of an interrupted fetch of `table_name`
+
+    The progress maps each bucket to the offset of its next page. Returns
+    None if there is nothing to resume for this query.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS raw_progress (
+            table_name text, bucket text, next_offset int, query_hash text,
+            PRIMARY KEY (table_name, bucket)
+        )
+        """
+    )
+    rows = conn.execute(
+        """
+        SELECT bucket, next_offset, query_hash
+        FROM raw_progress WHERE table_name = ?
+        """,
+        [table_name],
+    ).fetchall()
+    if not rows or any(row[2] != query_hash for row in rows):
+        conn.execute("DELETE FROM raw_progress WHERE table_name = ?", [table_name])
+        conn.commit()
+        return None
+    return {bucket: next_offset for bucket, next_offset, _ in rows}
+
+
+def finish_progress(conn, table_name):
+    conn.execute("DELETE FROM raw_progress WHERE table_name = ?", [table_name])
+    if not conn.execute("SELECT 1 FROM raw_progress").fetchone():
+        conn.execute("DROP TABLE raw_progress")
+    conn.commit()
+
+
+def get_query(
+    table_name,
+    query,
+    result_format="json",
+    db_path=None,
+    batch_size=int(1e5),
+    **kwargs,
+):
+    """Fetch the results of `query` into the table `table_name`
+
+    The rows are committed page by page together with the progress of
+    their bucket, so that an interrupted fetch continues after the last
+    committed page of each bucket when it is run again.
+    """
+    if "lang" in kwargs:
+        lang = kwargs.pop("lang")
+        db_name = lang
+    else:
+        lang = kwargs["from_lang"]
+        db_name = "{}-{}".format(kwargs["from_lang"], kwargs["to_lang"])
+
+    if not db_path:
+        path = "dictionaries/raw"
+        os.makedirs(path, exist_ok=True)
+        db_path = "%s/%s.sqlite3" % (path, db_name)
+    conn = connect_bulk(db_path)
+    start = time.perf_counter()
+
+    # Offsets can only be reused for the same query, pages and buckets
+    query_hash = hashlib.sha256(
+        repr(
+            (
+                query,
+                db_name,
+                kwargs.get("limit"),
+                kwargs.get("buckets"),
+            )
+        ).encode()
+    ).hexdigest()
+    progress = load_progress(conn, table_name, query_hash)
+
+    if progress is None:
+        print("Fetch {} (SPARQL)".format(table_name))
+        progress = {}
+        resume = False
+    else:
+        print("Resume fetching {} (SPARQL) after the last page".format(table_name))
+        resume = True
+    try:
+        cols, first_result, rows = fetch_rows(
+            table_name,
+            query,
+            lang,
+            result_format=result_format,
+            progress=progress,
+            **kwargs,
+        )
+
+        if not resume:
+            if first_result is None:
+                print("No results!")
+                create_table(conn, table_name)  # create empty table
+            elif result_format == "json":
+                create_table(conn, table_name, first_result, cols)
+            else:
+                create_table(conn, table_name)
+
+        print("Inserting {} into db".format(table_name))
+        insert_sql = "INSERT INTO %s VALUES (%s)" % (
+            table_name,
+            ", ".join(["?"] * len(saved_col_types(table_name))),
+        )
+        # The uncommitted rows of each bucket. Only a single bucket can insert
+        # rows before its page ends, because the commit at the end of
+        # another bucket's page would also commit them.
+        batches = defaultdict(list)
+        single_bucket = kwargs.get("buckets", 1) == 1
+        bucket = ""
+        row_count = 0
+        for row in rows:
+            if type(row) is BucketRows:
+                bucket = row.bucket
+            elif type(row) is PageEnd:
+                batch = batches.pop(row.bucket, [])
+                conn.executemany(insert_sql, batch)
+                row_count += len(batch)
+                conn.execute(
+                    "INSERT OR REPLACE INTO raw_progress VALUES (?, ?, ?, ?)",
+                    [table_name, row.bucket, row.offset, query_hash],
+                )
+                conn.commit()
+            else:
+                batch = batches[bucket]
+                batch.append(row)
+                if single_bucket and len(batch) == batch_size:
+                    conn.executemany(insert_sql, batch)
+                    row_count += len(batch)
+                    batch.clear()
+        print_insert_rate(row_count, table_name, start)
+    except BaseException:
+        # only close, so that the committed pages are kept for resuming
+        conn.close()
+        raise
+
+    finish_progress(conn, table_name)
+    close_bulk(conn)
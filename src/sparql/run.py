@@ -1,11 +1,95 @@
 #!/usr/bin/env python3
 
-import sqlite3
+import os
+from concurrent.futures import ProcessPoolExecutor
 
+from helper import supported_langs
 from . import queries as sparql
+from . import ttl
 
+translation_queries = {
+    "translation_sense": sparql.translation_query["sense"],
+    "translation_gloss": sparql.translation_query["gloss"],
+}
 
-def make_raw(lang, only):
+# The join keys of the raw tables in `process.ENTRY_QUERY`. They are indexed
+# when the raw db is created, so that processing only reads the raw db.
+RAW_INDEXES = {
+    "entry": ["lexentry"],
+    "pos": ["lexentry", "part_of_speech"],
+    "gender": ["lexentry", "gender"],
+    "pronun": ["lexentry", "pronun"],
+}
+
+
+def fetch_tables(db_name, queries, jobs, **kwargs):
+    """Fetch each query result into a table of the same name in the raw db
+
+    With more than one job, the queries run in parallel processes. Each of
+    them writes into its own staging db, so that they don't have to wait
+    for each other's write lock. The staged tables are copied into the raw
+    db when all queries are done.
+    """
+    if jobs == 1:
+        for name, q in queries.items():
+            sparql.get_query(name, q, **kwargs)
+        return
+
+    staging_path = "dictionaries/raw/staging"
+    os.makedirs(staging_path, exist_ok=True)
+    staged = {name: f"{staging_path}/{db_name}.{name}.sqlite3" for name in queries}
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(sparql.get_query, name, q, db_path=staged[name], **kwargs)
+            for name, q in queries.items()
+        ]
+        for f in futures:
+            f.result()
+
+    conn = sparql.connect_bulk(f"dictionaries/raw/{db_name}.sqlite3")
+    conn.isolation_level = None
+    for name, path in staged.items():
+        conn.execute("ATTACH DATABASE ? AS staged", [path])
+        (create_sql,) = conn.execute(
+            "SELECT sql FROM staged.sqlite_master WHERE name = ?", [name]
+        ).fetchone()
+        conn.executescript(
+            f"""
+            BEGIN;
+            DROP TABLE IF EXISTS main.{name};
+            {create_sql};
+            INSERT INTO main.{name} SELECT * FROM staged.{name};
+            COMMIT;
+            """
+        )
+        conn.execute("DETACH DATABASE staged")
+        os.remove(path)
+    sparql.close_bulk(conn)
+
+
+def raw_index_names(conn, schema="main"):
+    """Return the names and columns of the indexes for the existing raw tables"""
+    tables = {
+        name for (name,) in conn.execute(f"SELECT name FROM {schema}.sqlite_master")
+    }
+    return {
+        "%s_%s_idx" % (table, "_".join(columns)): (table, columns)
+        for table, columns in RAW_INDEXES.items()
+        if table in tables
+    }
+
+
+def create_raw_indexes(conn, schema="main"):
+    """Index the join keys of the raw tables and update their statistics"""
+    for name, (table, columns) in raw_index_names(conn, schema).items():
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS %s.%s ON %s(%s)"
+            % (schema, name, table, ", ".join(columns))
+        )
+    conn.execute(f"ANALYZE {schema}")
+
+
+def make_raw(lang, only, skip=(), jobs=1, **fetch_args):
     queries = {
         "form": sparql.form_query,
         "entry": sparql.basic_entry_query,
@@ -15,21 +99,19 @@ def make_raw(lang, only):
         "importance": sparql.importance_query,
         "nym": sparql.nym_query,
     }
-    for name, q in queries.items():
-        if not only or only == name:
-            sparql.get_query(name, q, lang=lang)
-
-
-def make_raw_pair(from_lang, to_lang, only):
     queries = {
-        "translation_sense": sparql.translation_query["sense"],
-        "translation_gloss": sparql.translation_query["gloss"],
+        name: q
+        for name, q in queries.items()
+        if (not only or only == name) and name not in skip
     }
-    for name, q in queries.items():
-        if not only or only == name:
-            sparql.get_query(name, q, from_lang=from_lang, to_lang=to_lang)
+    fetch_tables(lang, queries, jobs, lang=lang, **fetch_args)
 
-    conn = sqlite3.connect(f"dictionaries/raw/{from_lang}-{to_lang}.sqlite3")
+    conn = sparql.connect_bulk(f"dictionaries/raw/{lang}.sqlite3")
+    create_raw_indexes(conn)
+    sparql.close_bulk(conn)
+
+
+def merge_translations(conn):
     conn.executescript(
         """
         CREATE INDEX translation_sense_idx ON translation_sense(lexentry, trans);
@@ -48,15 +130,194 @@ def make_raw_pair(from_lang, to_lang, only):
     )
 
 
-def do(lang, only, **kwargs):
+def make_raw_pair(from_lang, to_lang, only, jobs=1, **fetch_args):
+    queries = {
+        name: q for name, q in translation_queries.items() if not only or only == name
+    }
+    fetch_tables(
+        f"{from_lang}-{to_lang}",
+        queries,
+        jobs,
+        from_lang=from_lang,
+        to_lang=to_lang,
+        **fetch_args,
+    )
+
+    conn = sparql.connect_bulk(f"dictionaries/raw/{from_lang}-{to_lang}.sqlite3")
+    merge_translations(conn)
+    sparql.close_bulk(conn)
+
+
+def open_pair_dbs(from_lang, to_langs):
+    os.makedirs("dictionaries/raw", exist_ok=True)
+    return {
+        to_lang: sparql.connect_bulk(
+            f"dictionaries/raw/{from_lang}-{to_lang}.sqlite3"
+        )
+        for to_lang in to_langs
+    }
+
+
+def make_raw_all_pairs(from_lang, only, jobs=1, **fetch_args):
+    """Fetch the translations into all raw pair dbs of `from_lang` at once
+
+    Each translation query runs only once for all target languages instead
+    of once per pair, so Virtuoso scans the translations of `from_lang` only
+    once. The rows are distributed to the pair dbs while they arrive.
+    The queries are not run in parallel (`jobs` is ignored), since they
+    write into the same dbs.
+
+    Unlike `sparql.get_query`, this does not keep a `raw_progress` table to
+    resume from. The rows of each page go into several pair dbs, which can't
+    be committed together with the progress. `translation` is only merged
+    after all queries are done, so an interrupted run keeps the previous
+    one, and the next run fetches all queries again.
+    """
+    to_langs = [lang for lang in supported_langs if lang != from_lang]
+    conns = open_pair_dbs(from_lang, to_langs)
+    for name, q in translation_queries.items():
+        if only and only != name:
+            continue
+        print("Fetch {} for all targets (SPARQL)".format(name))
+        _, _, rows = sparql.fetch_rows(
+            name,
+            sparql.all_targets_query(q, to_langs),
+            lang=from_lang,
+            from_lang=from_lang,
+            **fetch_args,
+        )
+        sparql.insert_by_target(conns, name, rows)
+    close_pair_dbs(conns)
+
+
+def close_pair_dbs(conns):
+    for conn in conns.values():
+        conn.commit()
+        merge_translations(conn)
+        sparql.close_bulk(conn)
+
+
+def make_raw_from_ttl(lang, only, skip=()):
+    """Create the raw db(s) for `lang` from the Turtle dumps
+
+    Like for SPARQL, `lang` can be a language, a pair or e.g. 'de-all'.
+    """
+    from_lang, _, to_lang = lang.partition("-")
+    store = ttl.connect_store(ttl.make_store(from_lang))
+    if not to_lang:
+        os.makedirs("dictionaries/raw", exist_ok=True)
+        conn = sparql.connect_bulk(f"dictionaries/raw/{lang}.sqlite3")
+        ttl.make_raw(store, conn, lang, only, skip)
+        create_raw_indexes(conn)
+        sparql.close_bulk(conn)
+    else:
+        if to_lang == "all":
+            to_langs = [lang for lang in supported_langs if lang != from_lang]
+        else:
+            to_langs = [to_lang]
+        conns = open_pair_dbs(from_lang, to_langs)
+        ttl.insert_translations(store, conns, from_lang, only)
+        close_pair_dbs(conns)
+    store.close()
+
+
+def do(
+    lang,
+    only,
+    jobs,
+    page_size,
+    buckets,
+    bucket_jobs,
+    result_format,
+    from_ttl,
+    refresh,
+    cache_size,
+    skip,
+    **kwargs,
+):
+    if from_ttl:
+        make_raw_from_ttl(lang, only, skip)
+        return
+    fetch_args = dict(
+        jobs=jobs,
+        limit=page_size,
+        buckets=buckets,
+        bucket_jobs=bucket_jobs,
+        result_format=result_format,
+    )
+    version = sparql.dump_version(lang.split("-")[0])
+    if version is None:
+        print("No TTL files found, SPARQL results are not cached")
+    else:
+        fetch_args["cache"] = sparql.ResponseCache(
+            version, max_size=int(cache_size * 2**30), refresh=refresh
+        )
     if "-" not in lang:
-        make_raw(lang, only)
+        make_raw(lang, only, skip, **fetch_args)
+    elif lang.endswith("-all"):
+        make_raw_all_pairs(lang.split("-")[0], only=only, **fetch_args)
     else:
-        make_raw_pair(*lang.split("-"), only=only)
+        make_raw_pair(*lang.split("-"), only=only, **fetch_args)
 
 
 def add_subparsers(subparsers):
     raw = subparsers.add_parser("raw", help="execute sparql queries and create raw db")
-    raw.add_argument("lang")
+    raw.add_argument(
+        "lang", help="language, language pair or e.g. 'de-all' for all pairs from de"
+    )
     raw.set_defaults(func=do)
     raw.add_argument("--only")
+    raw.add_argument(
+        "--skip",
+        action="append",
+        default=[],
+        help="don't create this table of a language's raw db, e.g. importance "
+        "when using `process --local-importance` (can be repeated)",
+    )
+    raw.add_argument(
+        "--from-ttl",
+        action="store_true",
+        help="read the Turtle dumps in virtuoso/ttl instead of querying Virtuoso",
+    )
+    raw.add_argument(
+        "--refresh",
+        action="store_true",
+        help="fetch all SPARQL results again instead of using the cache",
+    )
+    raw.add_argument(
+        "--cache-size",
+        type=float,
+        default=20,
+        help="size limit for the cache of SPARQL results in GiB",
+    )
+    raw.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of queries to run at the same time",
+    )
+    raw.add_argument(
+        "--format",
+        dest="result_format",
+        choices=sparql.RESULT_FORMATS,
+        default="json",
+        help="SPARQL result format, tsv uses the column types from src/sql/sparql",
+    )
+    raw.add_argument(
+        "--page-size",
+        type=int,
+        default=int(5e5),
+        help="rows per SPARQL request (at most 1048576)",
+    )
+    raw.add_argument(
+        "--buckets",
+        type=int,
+        default=1,
+        help="split results into this many hash buckets (a power of 16)",
+    )
+    raw.add_argument(
+        "--bucket-jobs",
+        type=int,
+        default=4,
+        help="number of buckets to fetch at the same time",
+    )
@@ -0,0 +1,421 @@
+"""Create the raw tables directly from the Turtle dumps, without Virtuoso
+
+The triples of a language's dumps are read into a small SQLite triple store
+(one per language in `STORE_PATH`), keeping only the predicates used by the
+raw queries. The SQL queries below correspond to the SPARQL queries in
+`sparql.queries` and fill the same raw tables.
+"""
+import bz2
+import glob
+import gzip
+import io
+import math
+import os
+import sqlite3
+import time
+
+from languages import language_codes3
+from turtle_reader import Literal, read_triples
+from . import queries as sparql
+
+STORE_PATH = "dictionaries/ttl"
+
+NAMESPACES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dct": "http://purl.org/dc/terms/",
+    "ontolex": "http://www.w3.org/ns/lemon/ontolex#",
+    "lexinfo": "http://www.lexinfo.net/ontology/2.0/lexinfo#",
+    "olia": "http://purl.org/olia/olia.owl#",
+    "dbnary": "http://kaiko.getalp.org/dbnary#",
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+}
+
+OLIA_COLUMNS = {
+    "mood": "hasMood",
+    "number": "hasNumber",
+    "person": "hasPerson",
+    "tense": "hasTense",
+    "voice": "hasVoice",
+    "case": "hasCase",
+    "inflection": "hasInflectionType",
+    "definiteness": "hasDefiniteness",
+    "gender": "hasGender",
+}
+
+# Only these predicates are used by the queries, all others are skipped
+# while reading the dumps.
+PREDICATES = {
+    NAMESPACES[prefix] + name: prefix + ":" + name
+    for prefix, names in {
+        "rdf": ["type", "value"],
+        "dct": ["language"],
+        "ontolex": [
+            "canonicalForm",
+            "otherForm",
+            "writtenRep",
+            "phoneticRep",
+            "sense",
+        ],
+        "lexinfo": ["partOfSpeech", "gender"],
+        "olia": list(OLIA_COLUMNS.values()),
+        "dbnary": [
+            "describes",
+            "senseNumber",
+            "isTranslationOf",
+            "targetLanguage",
+            "writtenForm",
+            "gloss",
+            "synonym",
+            "hypernym",
+            "hyponym",
+        ],
+        "skos": ["definition"],
+    }.items()
+    for name in names
+}
+TYPES = {"LexicalEntry", "LexicalSense", "Page"}
+
+
+def ttl_files(lang):
+    """Return the dumps of `lang`, the same ones `insert_single_ttl.py` loads
+
+    The gzipped copies made for Virtuoso are used if they exist, since they
+    are faster to decompress.
+    """
+    files = []
+    for name in [lang, language_codes3[lang]]:
+        for path in sorted(glob.glob(f"{sparql.TTL_PATH}/{name}_*.ttl.bz2")):
+            gz_path = path[: -len(".bz2")] + ".gz"
+            files.append(gz_path if os.path.exists(gz_path) else path)
+    return files
+
+
+def open_ttl(path):
+    opener = {".bz2": bz2.open, ".gz": gzip.open}.get(os.path.splitext(path)[1], open)
+    return io.TextIOWrapper(opener(path, "rb"), encoding="utf-8")
+
+
+def store_triples(triples):
+    """Yield the triples relevant for the raw tables as (p, s, o) rows
+
+    IRIs are shortened with `strip_namespace`, just like in the results of
+    the SPARQL queries. Predicates get the usual prefixes instead, since
+    some names are used in different namespaces.
+    """
+    rdf_type = NAMESPACES["rdf"] + "type"
+    strip_namespace = sparql.strip_namespace
+    for s, p, o in triples:
+        short_p = PREDICATES.get(p)
+        if short_p is None:
+            continue
+        if type(o) is Literal:
+            o = o.value
+        else:
+            o = strip_namespace(o)
+            if p == rdf_type and o not in TYPES:
+                continue
+        yield short_p, strip_namespace(s), o
+
+
+def create_store(conn):
+    conn.executescript(
+        """
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE triple (
+            p text, s text, o text,
+            PRIMARY KEY (p, s, o)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+def load_ttl(conn, stream, bnode_prefix=""):
+    # Virtuoso stores each triple only once, so duplicates are skipped
+    conn.executemany(
+        "INSERT OR IGNORE INTO triple VALUES (?, ?, ?)",
+        store_triples(read_triples(stream, bnode_prefix)),
+    )
+
+
+def index_store(conn):
+    conn.executescript(
+        """
+        CREATE INDEX triple_po_idx ON triple(p, o);
+        ANALYZE;
+        """
+    )
+
+
+def make_store(lang):
+    """Read the dumps of `lang` into its triple store, if not already done
+
+    The dumps are parsed incrementally and the triples are written straight
+    to disk, so the memory usage does not depend on the dump size.
+    """
+    files = ttl_files(lang)
+    assert files, f"No Turtle dumps for {lang} in {sparql.TTL_PATH}"
+    store_path = f"{STORE_PATH}/{lang}.sqlite3"
+    if os.path.exists(store_path) and os.path.getmtime(store_path) > max(
+        os.path.getmtime(path) for path in files
+    ):
+        return store_path
+
+    os.makedirs(STORE_PATH, exist_ok=True)
+    tmp_path = store_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    create_store(conn)
+    for i, path in enumerate(files):
+        print("Read", path)
+        with open_ttl(path) as f:
+            # blank node labels are only unique within a file
+            load_ttl(conn, f, bnode_prefix=f"f{i}.")
+        conn.commit()
+    index_store(conn)
+    conn.close()
+    os.replace(tmp_path, store_path)
+    return store_path
+
+
+lexentry_cte = """
+    WITH lexentry AS (
+        SELECT s AS lexentry FROM triple
+        WHERE p = 'dct:language' AND o = :lang
+        INTERSECT
+        SELECT s FROM triple
+        WHERE p = 'rdf:type' AND o = 'LexicalEntry'
+    )
+"""
+
+form_query = (
+    lexentry_cte
+    + """
+    SELECT l.lexentry, rep.o AS other_written, pos.o AS pos, %s
+    FROM lexentry l
+        JOIN triple f ON f.p = 'ontolex:otherForm' AND f.s = l.lexentry
+        JOIN triple rep ON rep.p = 'ontolex:writtenRep' AND rep.s = f.o
+        LEFT JOIN triple pos
+            ON pos.p = 'lexinfo:partOfSpeech' AND pos.s = l.lexentry
+        %s
+"""
+    % (
+        ", ".join(f'"{col}".o AS "{col}"' for col in OLIA_COLUMNS),
+        "\n        ".join(
+            f"""LEFT JOIN triple "{col}"
+            ON "{col}".p = 'olia:{name}' AND "{col}".s = f.o"""
+            for col, name in OLIA_COLUMNS.items()
+        ),
+    )
+)
+
+basic_entry_query = (
+    lexentry_cte
+    + """
+    SELECT l.lexentry, d.s AS vocable, rep.o AS written_rep
+    FROM lexentry l
+        JOIN triple cf ON cf.p = 'ontolex:canonicalForm' AND cf.s = l.lexentry
+        JOIN triple rep ON rep.p = 'ontolex:writtenRep' AND rep.s = cf.o
+        JOIN triple d ON d.p = 'dbnary:describes' AND d.o = l.lexentry
+        JOIN triple page
+            ON page.p = 'rdf:type' AND page.s = d.s AND page.o = 'Page'
+"""
+)
+
+basic_entry_pos_query = (
+    lexentry_cte
+    + """
+    SELECT l.lexentry, pos.o AS part_of_speech
+    FROM lexentry l
+        JOIN triple pos ON pos.p = 'lexinfo:partOfSpeech' AND pos.s = l.lexentry
+"""
+)
+
+basic_entry_gender_query = (
+    lexentry_cte
+    + """
+    SELECT l.lexentry, coalesce(form_gender.o, entry_gender.o) AS gender
+    FROM lexentry l
+        LEFT JOIN (
+            SELECT cf.s, g.o
+            FROM triple cf
+                JOIN triple g ON g.p = 'lexinfo:gender' AND g.s = cf.o
+            WHERE cf.p = 'ontolex:canonicalForm'
+        ) form_gender ON form_gender.s = l.lexentry
+        LEFT JOIN triple entry_gender
+            ON entry_gender.p = 'lexinfo:gender' AND entry_gender.s = l.lexentry
+"""
+)
+
+basic_entry_pronun_query = (
+    lexentry_cte
+    + """
+    SELECT l.lexentry, pronun.o AS pronun
+    FROM lexentry l
+        JOIN triple cf ON cf.p = 'ontolex:canonicalForm' AND cf.s = l.lexentry
+        JOIN triple pronun ON pronun.p = 'ontolex:phoneticRep' AND pronun.s = cf.o
+"""
+)
+
+importance_query = """
+    SELECT vocable, sqrt(translation_count) + sqrt(synonym_count) AS score
+    FROM (
+        SELECT d.s AS vocable,
+            count(DISTINCT tr.s) AS translation_count,
+            (
+                SELECT count(DISTINCT syn.s) FROM triple syn
+                WHERE syn.p = 'dbnary:synonym' AND syn.o = d.s
+            ) AS synonym_count
+        FROM triple d
+            JOIN triple page
+                ON page.p = 'rdf:type' AND page.s = d.s AND page.o = 'Page'
+            JOIN triple lang
+                ON lang.p = 'dct:language' AND lang.s = d.o AND lang.o = :lang
+            LEFT JOIN triple tr
+                ON tr.p = 'dbnary:isTranslationOf' AND tr.o = d.o
+        WHERE d.p = 'dbnary:describes'
+          AND EXISTS (
+              SELECT 1 FROM triple pos
+              WHERE pos.p = 'lexinfo:partOfSpeech' AND pos.s = d.o
+                AND pos.o NOT IN ('abbreviation', 'letter')
+          )
+        GROUP BY d.s
+    )
+    ORDER BY score DESC
+"""
+
+nym_query = """
+    SELECT DISTINCT n.s AS f, substr(n.p, length('dbnary:') + 1) AS nym,
+        rep.o AS t_rep
+    FROM triple n
+        JOIN triple lang
+            ON lang.p = 'dct:language' AND lang.s = n.s AND lang.o = :lang
+        JOIN triple f_pos ON f_pos.p = 'lexinfo:partOfSpeech' AND f_pos.s = n.s
+        JOIN triple d ON d.p = 'dbnary:describes' AND d.s = n.o
+        JOIN triple t_pos ON t_pos.p = 'lexinfo:partOfSpeech' AND t_pos.s = d.o
+        JOIN triple cf ON cf.p = 'ontolex:canonicalForm' AND cf.s = d.o
+        JOIN triple rep ON rep.p = 'ontolex:writtenRep' AND rep.s = cf.o
+    WHERE n.p IN ('dbnary:synonym', 'dbnary:hypernym', 'dbnary:hyponym')
+      AND f_pos.o = t_pos.o
+"""
+
+# Like `sparql.all_targets_query`, these return the target language as an
+# additional `target_lang` column.
+translation_query = {
+    "sense": lexentry_cte
+    + """
+    SELECT l.lexentry, sn.o AS sense_num, def_value.o AS sense,
+        tr.s AS trans_entity, written.o AS trans, target.o AS target_lang
+    FROM lexentry l
+        JOIN triple ls ON ls.p = 'ontolex:sense' AND ls.s = l.lexentry
+        JOIN triple st
+            ON st.p = 'rdf:type' AND st.s = ls.o AND st.o = 'LexicalSense'
+        JOIN triple sn ON sn.p = 'dbnary:senseNumber' AND sn.s = ls.o
+        JOIN triple def ON def.p = 'skos:definition' AND def.s = ls.o
+        JOIN triple def_value ON def_value.p = 'rdf:value' AND def_value.s = def.o
+        JOIN triple tr ON tr.p = 'dbnary:isTranslationOf' AND tr.o = ls.o
+        JOIN triple target
+            ON target.p = 'dbnary:targetLanguage' AND target.s = tr.s
+        JOIN triple written
+            ON written.p = 'dbnary:writtenForm' AND written.s = tr.s
+        -- unused, but repeats rows just like the OPTIONAL in the SPARQL query
+        LEFT JOIN (
+            SELECT g.s
+            FROM triple g
+                JOIN triple gn ON gn.p = 'dbnary:senseNumber' AND gn.s = g.o
+            WHERE g.p = 'dbnary:gloss'
+        ) tr_sense_num ON tr_sense_num.s = tr.s
+    WHERE target.o IN (%s)
+""",
+    "gloss": lexentry_cte
+    + """
+    SELECT l.lexentry, '' AS sense_num, gloss.o AS sense,
+        tr.s AS trans_entity, written.o AS trans, target.o AS target_lang
+    FROM lexentry l
+        JOIN triple tr ON tr.p = 'dbnary:isTranslationOf' AND tr.o = l.lexentry
+        JOIN triple target
+            ON target.p = 'dbnary:targetLanguage' AND target.s = tr.s
+        JOIN triple written
+            ON written.p = 'dbnary:writtenForm' AND written.s = tr.s
+        LEFT JOIN (
+            SELECT g.s, gv.o
+            FROM triple g
+                JOIN triple gv ON gv.p = 'rdf:value' AND gv.s = g.o
+            WHERE g.p = 'dbnary:gloss'
+        ) gloss ON gloss.s = tr.s
+    WHERE target.o IN (%s)
+""",
+}
+
+raw_queries = {
+    "form": form_query,
+    "entry": basic_entry_query,
+    "pos": basic_entry_pos_query,
+    "gender": basic_entry_gender_query,
+    "pronun": basic_entry_pronun_query,
+    "importance": importance_query,
+    "nym": nym_query,
+}
+
+
+def lexvo_uri(lang):
+    return sparql.LEXVO_NS + language_codes3[lang]
+
+
+def connect_store(store_path):
+    conn = sqlite3.connect(store_path)
+    conn.create_function("sqrt", 1, math.sqrt, deterministic=True)
+    return conn
+
+
+def query_rows(store, table_name, query, lang, params=()):
+    """Run `query` on the store and convert the rows like SPARQL results"""
+    col_types = sparql.saved_col_types(table_name)
+    converters = [
+        sparql.make_literal_converter(lang, col_name)
+        if col_type in ("text", "iri")
+        else None
+        for col_name, col_type in col_types.items()
+    ]
+    # The `target_lang` column of the translation queries is kept as is
+    converters += [None]
+    for row in store.execute(query, dict(params, lang=lexvo_uri(lang))):
+        yield [
+            convert(value) if convert and value is not None else value
+            for convert, value in zip(converters, row)
+        ]
+
+
+def make_raw(store, conn, lang, only, skip=()):
+    """Fill the raw tables of `lang` in `conn` from the triple `store`"""
+    for name, q in raw_queries.items():
+        if only and only != name or name in skip:
+            continue
+        print("Query {} (Turtle store)".format(name))
+        start = time.perf_counter()
+        sparql.create_table(conn, name)
+        cur = conn.executemany(
+            "INSERT INTO %s VALUES (%s)"
+            % (name, ", ".join(["?"] * len(sparql.saved_col_types(name)))),
+            query_rows(store, name, q, lang),
+        )
+        sparql.print_insert_rate(cur.rowcount, name, start)
+        conn.commit()
+
+
+def insert_translations(store, conns, from_lang, only):
+    """Insert the translations from `from_lang` into the pair dbs in `conns`
+
+    `conns` maps the target languages to the connections of the raw pair
+    dbs, as for `sparql.insert_by_target`.
+    """
+    targets = {f"target{i}": lexvo_uri(to_lang) for i, to_lang in enumerate(conns)}
+    placeholders = ", ".join(":" + param for param in targets)
+    for kind, q in translation_query.items():
+        name = "translation_" + kind
+        if only and only != name:
+            continue
+        print("Query {} for all targets (Turtle store)".format(name))
+        rows = query_rows(store, name, q % placeholders, from_lang, targets)
+        sparql.insert_by_target(conns, name, rows)
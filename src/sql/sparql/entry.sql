@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS entry;
-            CREATE TABLE entry ("lexentry" text, "vocable" text, "written_rep" text);
+            CREATE TABLE entry ("lexentry" iri text, "vocable" iri text, "written_rep" text);
         
\ No newline at end of file
@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS form;
-            CREATE TABLE form ("lexentry" text, "other_written" text, "pos" text, "mood" text, "number" text, "person" text, "tense" text, "voice" text, "case" text, "inflection" text, "definiteness" text, "gender" text);
+            CREATE TABLE form ("lexentry" iri text, "other_written" text, "pos" iri text, "mood" iri text, "number" iri text, "person" iri text, "tense" iri text, "voice" iri text, "case" iri text, "inflection" iri text, "definiteness" iri text, "gender" iri text);
         
\ No newline at end of file
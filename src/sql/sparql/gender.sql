@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS gender;
-            CREATE TABLE gender ("lexentry" text, "gender" text);
+            CREATE TABLE gender ("lexentry" iri text, "gender" iri text);
         
\ No newline at end of file
@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS importance;
-            CREATE TABLE importance ("vocable" text, "score" real);
+            CREATE TABLE importance ("vocable" iri text, "score" real);
         
\ No newline at end of file
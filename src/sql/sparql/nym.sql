@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS nym;
-            CREATE TABLE nym ("f" text, "nym" text, "t_rep" text);
+            CREATE TABLE nym ("f" iri text, "nym" iri text, "t_rep" text);
         
\ No newline at end of file
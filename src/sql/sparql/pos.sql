@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS pos;
-            CREATE TABLE pos ("lexentry" text, "part_of_speech" text);
+            CREATE TABLE pos ("lexentry" iri text, "part_of_speech" iri text);
         
\ No newline at end of file
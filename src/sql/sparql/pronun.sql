@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS pronun;
-            CREATE TABLE pronun ("lexentry" text, "pronun" text);
+            CREATE TABLE pronun ("lexentry" iri text, "pronun" text);
         
\ No newline at end of file
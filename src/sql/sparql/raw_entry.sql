@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS raw_entry;
-            CREATE TABLE raw_entry ("lexentry" text, "written_rep" text, "part_of_speech" text, "gender" text, "pronun_list" text);
+            CREATE TABLE raw_entry ("lexentry" iri text, "written_rep" text, "part_of_speech" iri text, "gender" iri text, "pronun_list" text);
         
\ No newline at end of file
@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS translation;
-            CREATE TABLE translation ("lexentry" text, "sense_num" text, "sense" text, "trans_entity" text, "trans" text);
+            CREATE TABLE translation ("lexentry" iri text, "sense_num" text, "sense" text, "trans_entity" iri text, "trans" text);
         
\ No newline at end of file
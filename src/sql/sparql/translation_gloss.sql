@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS translation_gloss;
-            CREATE TABLE translation_gloss ("lexentry" text, "sense_num" text, "sense" text, "trans_entity" text, "trans" text);
+            CREATE TABLE translation_gloss ("lexentry" iri text, "sense_num" text, "sense" text, "trans_entity" iri text, "trans" text);
         
\ No newline at end of file
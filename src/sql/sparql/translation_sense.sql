@@ -1,4 +1,4 @@
 
             DROP TABLE IF EXISTS translation_sense;
-            CREATE TABLE translation_sense ("lexentry" text, "sense_num" text, "sense" text, "trans_entity" text, "trans" text);
+            CREATE TABLE translation_sense ("lexentry" iri text, "sense_num" text, "sense" text, "trans_entity" iri text, "trans" text);
         
\ No newline at end of file
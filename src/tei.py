@@ -214,7 +214,7 @@ def get_translations(from_lang, to_lang):
     )[0]
     measured_exec = lambda *args, **kwargs: measured_execute(conn, *args, **kwargs)
     conn.execute("BEGIN")
-    measured_exec("CREATE INDEX from_lang.from_lexentry_idx ON form(lexentry)")
+    measured_exec("CREATE INDEX from_lang.from_lexentry_idx ON form(lexentry_id)")
 
     expected_good_translations = 45000
     min_translation_score = round(
@@ -228,7 +228,7 @@ def get_translations(from_lang, to_lang):
     )
     translations = measured_exec(
         """
-        SELECT lexentry,
+        SELECT e.lexentry_id,
             t.written_rep, t.sense_list, t.trans_list,
             e.gender, e.part_of_speech, e.pronun_list
         FROM translation t
@@ -273,11 +273,11 @@ def get_translations(from_lang, to_lang):
                 """
             SELECT other_written, min(rank) AS rank
             FROM form f
-            WHERE lexentry = ?
+            WHERE lexentry_id = ?
             GROUP BY other_written
             ORDER BY rank;
         """,
-                [t["lexentry"]],
+                [t["lexentry_id"]],
             )
         )
 
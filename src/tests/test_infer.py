@@ -1,8 +1,40 @@
 # vim: set fileencoding=utf-8 :
+import io
+import os
+import tempfile
 import unittest
 import sqlite3
+from contextlib import redirect_stdout
+from itertools import permutations
 
-from infer import AggByScore
+import infer
+from infer import AggByScore, collect, collect_all
+
+
+def collect_processed(test_case, translations):
+    """Collect processed pair dbs with the given rows in a temp working dir
+
+    `translations` maps pairs like "de-en" to the rows of their translation
+    table. The working dir is restored after the test.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    test_case.addCleanup(tmp.cleanup)
+    test_case.addCleanup(os.chdir, os.getcwd())
+    os.chdir(tmp.name)
+    os.symlink(os.path.dirname(os.path.abspath(infer.__file__)), "src")
+    os.makedirs("dictionaries/processed")
+    for pair, rows in translations.items():
+        conn = sqlite3.connect(f"dictionaries/processed/{pair}.sqlite3")
+        conn.execute(
+            "CREATE TABLE translation (lexentry_id, sense_num, sense, "
+            "written_rep, trans, from_importance, to_importance)"
+        )
+        conn.executemany("INSERT INTO translation VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        conn.close()
+    langs = sorted({lang for pair in translations for lang in pair.split("-")})
+    with redirect_stdout(io.StringIO()):
+        collect_all(langs)
 
 
 class TestInfer(unittest.TestCase):
@@ -25,5 +57,182 @@ class TestInfer(unittest.TestCase):
         self.assertEqual(cur.fetchall(), [("Wohnung | Haus",)])
 
 
+class TestCollect(unittest.TestCase):
+    # more pairs than can be attached at once
+    langs = ["de", "en", "fr", "sv"]
+
+    def setUp(self):
+        collect_processed(
+            self,
+            {
+                f"{from_lang}-{to_lang}": [
+                    (
+                        i,
+                        "1",
+                        None if i % 2 else "sense",
+                        f"{from_lang}{i}",
+                        f"{to_lang}{i}",
+                        1,
+                        2,
+                    )
+                    for i in range(3)
+                ]
+                for from_lang, to_lang in permutations(self.langs, 2)
+            },
+        )
+
+    def collect_each_pair(self):
+        """Return all_trans as collected by `collect` for each pair"""
+        expected = sqlite3.connect(":memory:")
+        for from_lang, to_lang in permutations(self.langs, 2):
+            expected.execute(
+                "ATTACH DATABASE ? AS processed",
+                [f"dictionaries/processed/{from_lang}-{to_lang}.sqlite3"],
+            )
+            collect(expected, f"{from_lang}-{to_lang}")
+            expected.commit()
+            expected.execute("DETACH DATABASE processed")
+        return expected.execute("SELECT * FROM all_trans").fetchall()
+
+    def test_collect_all(self):
+        conn = sqlite3.connect("dictionaries/infer.sqlite3")
+        all_trans = conn.execute("SELECT * FROM all_trans").fetchall()
+        self.assertEqual(all_trans, self.collect_each_pair())
+        self.assertEqual(len(all_trans), 36)
+        self.assertEqual(
+            all_trans[-1], ("sv", "fr", 2, "1", "sense", "sv2", "fr2", 1.0, 2.0)
+        )
+
+    def test_collect_subset(self):
+        conn = sqlite3.connect("dictionaries/processed/de-en.sqlite3")
+        conn.execute("UPDATE translation SET trans = 'en9' WHERE trans = 'en1'")
+        conn.commit()
+        conn = sqlite3.connect("dictionaries/infer.sqlite3")
+        conn.execute("DELETE FROM changed_pair")
+        conn.commit()
+        with redirect_stdout(io.StringIO()):
+            collect_all(["de", "en"])
+        self.assertEqual(
+            sorted(conn.execute("SELECT * FROM all_trans").fetchall()),
+            sorted(self.collect_each_pair()),
+        )
+        self.assertEqual(
+            conn.execute("SELECT * FROM changed_pair ORDER BY 1").fetchall(),
+            [("de", "en"), ("en", "de")],
+        )
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        collect_processed(
+            self,
+            {
+                f"{from_lang}-{to_lang}": [
+                    (i, "1", "sense", f"{from_lang}{i}", f"{to_lang}{i}", 1, 2)
+                    for i in range(4)
+                ]
+                for from_lang, to_lang in permutations(["de", "en", "fr"], 2)
+            },
+        )
+
+    def change_and_infer(self, jobs):
+        processed = "dictionaries/processed/en-fr.sqlite3"
+        conn = sqlite3.connect(processed)
+        conn.execute("UPDATE translation SET trans = 'fr9' WHERE trans = 'fr1'")
+        conn.execute("DELETE FROM translation WHERE trans = 'fr2'")
+        conn.commit()
+        conn = sqlite3.connect("dictionaries/infer.sqlite3")
+        conn.execute("ATTACH DATABASE ? AS processed", [processed])
+        collect(conn, "en-fr")
+        conn.commit()
+        conn.close()
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            # exits if the result differs from the one of a full run
+            infer.infer(
+                incremental=True,
+                verify=True,
+                jobs=jobs,
+                max_fanout=None,
+            )
+        self.assertIn("1 changed pairs affect 7 pairs", out.getvalue())
+        conn = sqlite3.connect("dictionaries/infer.sqlite3")
+        self.assertEqual(
+            conn.execute(
+                """
+                SELECT from_vocable, source_details FROM infer
+                WHERE from_lang = 'de' AND to_lang = 'fr' AND to_vocable = 'fr9'
+            """
+            ).fetchall(),
+            [("de1", "en+:en1")],
+        )
+
+    def test_same_as_full_infer(self):
+        with redirect_stdout(io.StringIO()):
+            infer.infer(
+                incremental=False,
+                verify=False,
+                jobs=1,
+                max_fanout=None,
+            )
+        self.change_and_infer(jobs=1)
+
+    def test_sharded(self):
+        with redirect_stdout(io.StringIO()):
+            infer.infer(
+                incremental=False,
+                verify=False,
+                jobs=2,
+                max_fanout=None,
+            )
+            # compares with an infer run in a single process
+            infer.verify_infer()
+        self.change_and_infer(jobs=2)
+
+
+class TestPivotFanout(unittest.TestCase):
+    def setUp(self):
+        translations = {
+            "de-en": [(1, "1", "building", "Haus", "house", 1, 1)],
+            # "home" is the sense with a backlink to "Haus"
+            "en-de": [(2, "1", "home", "house", "Haus", 1, 1)],
+            "en-fr": [
+                (3, "1", "building", "house", "maison", 1, 3),
+                (4, "1", "residence", "house", "domicile", 1, 2),
+                (5, "1", "home", "house", "foyer", 1, 1),
+            ],
+        }
+        collect_processed(
+            self,
+            {
+                f"{from_lang}-{to_lang}": translations.get(f"{from_lang}-{to_lang}", [])
+                for from_lang, to_lang in permutations(["de", "en", "fr"], 2)
+            },
+        )
+
+    def test_max_fanout(self):
+        with redirect_stdout(io.StringIO()):
+            infer.infer(
+                incremental=False,
+                verify=False,
+                jobs=1,
+                max_fanout=1,
+            )
+        conn = sqlite3.connect("dictionaries/infer.sqlite3")
+        self.assertEqual(
+            conn.execute(
+                """
+                SELECT to_vocable, source_detail FROM indirect
+                WHERE from_lang = 'de' AND to_lang = 'fr'
+                ORDER BY to_vocable
+            """
+            ).fetchall(),
+            # "domicile" has neither a backlink nor the highest importance, but
+            # "foyer" is kept because of its backlink
+            [("foyer", "en+:house"), ("maison", "en:house")],
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 # vim: set fileencoding=utf-8 :
 # pylint: disable=line-too-long
+import os
+import sqlite3
+import tempfile
 import unittest
+from unittest import mock
 
 import sys
+from clean_cache import CleanCache
 from parse import (
     html_parser,
     clean_wiki_syntax,
+    has_markup,
     is_dummy_sense,
     make_inflection_cleaner,
 )
@@ -37,6 +43,29 @@ class TestParseHTML(unittest.TestCase):
             "Beschlag aus Holz, Knochen oder Metall am (herabhängenden) Ende eines Gürtels, zur Verstärkung und Beschwerung",
         )
 
+    def test_same_as_html_parser(self):
+        for html in [
+            "m<sup>2</sup> and m<SUP>3</SUP>",
+            "a<br>b<br/>c<i>&#x41;&#66;&amp</i>",
+            "<span class='x' title=\"a>b\">t</span>",
+            'x<ref name="a" />y<ref>abc<i>q</i>def</ref>z',
+            # not handled by the scanner
+            "a < b",
+            "<!-- comment -->x",
+            "x<ref>t</ref",
+        ]:
+            with self.subTest(html):
+                self.assertEqual(
+                    html_parser.parse(html), html_parser.parse_with_html_parser(html)
+                )
+
+    def test_trailing_ampersand(self):
+        # the HTMLParser used to keep this in its buffer for the next call
+        for parse in [html_parser.parse, html_parser.parse_with_html_parser]:
+            with self.subTest(parse):
+                self.assertEqual(parse("a<b>x</b> &amp foo &abc"), "ax & foo &abc")
+                self.assertEqual(parse("<i>next</i>"), "next")
+
 
 class TestParseCleanup(unittest.TestCase):
     def test_bold_and_italics(self):
@@ -108,5 +137,68 @@ class TestCleanInflection(unittest.TestCase):
         self.assertEqual(cleaner("die Bäume"), "Bäume")
 
 
+class TestCleanCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "clean.sqlite3")
+        self.calls = []
+
+    def clean(self, x):
+        self.calls.append(x)
+        return clean_wiki_syntax(x)
+
+    def run_cached(self, version, inputs, **kwargs):
+        cache = CleanCache(version, path=self.path, **kwargs)
+        func = cache.wrap("clean_wiki_syntax", self.clean, has_markup)
+        # the results of the first batch are reused in the second one
+        results = func(inputs[:2]) + func(inputs[2:])
+        cache.close()
+        return results
+
+    def test_persist(self):
+        inputs = ["[[Haus]]", "plain", "[[Haus]]", "''bold''"]
+        expected = [clean_wiki_syntax(x) for x in inputs]
+        self.assertEqual(self.run_cached("v1", inputs), expected)
+        self.assertEqual(self.calls, ["[[Haus]]", "plain", "''bold''"])
+
+        # second run only cleans strings without markup
+        del self.calls[:]
+        self.assertEqual(self.run_cached("v1", inputs), expected)
+        self.assertEqual(self.calls, ["plain"])
+
+        # a new version of the code ignores old results
+        del self.calls[:]
+        self.assertEqual(self.run_cached("v2", inputs), expected)
+        self.assertEqual(self.calls, ["[[Haus]]", "plain", "''bold''"])
+
+    def test_inputs_as_keys(self):
+        inputs = ["[[Haus]]", "[[Haus]] ", "[[Häuser]]", "[[Haus]]"]
+        expected = [clean_wiki_syntax(x) for x in inputs]
+        self.assertEqual(self.run_cached("v1", inputs), expected)
+        del self.calls[:]
+        self.assertEqual(self.run_cached("v1", inputs), expected)
+        self.assertEqual(self.calls, [])
+
+    def test_evict(self):
+        old = ["[[old %d]] " % i + "x" * 1000 for i in range(200)]
+        new = ["[[new %d]] " % i + "x" * 1000 for i in range(200)]
+        with mock.patch("time.time", return_value=0):
+            self.run_cached("v1", old, max_size=2**30)
+        with mock.patch("time.time", return_value=1):
+            self.run_cached("v1", new, max_size=500 * 1024)
+
+        conn = sqlite3.connect(self.path)
+        (size,) = conn.execute(
+            "SELECT sum(length(input) + length(value)) FROM clean_result"
+        ).fetchone()
+        self.assertLessEqual(size, 500 * 1024)
+        self.assertGreater(size, 500 * 1024 - 2100)  # one result is ~2 kB
+        # only the least recently used results are removed
+        used = conn.execute("SELECT used, count(*) FROM clean_result GROUP BY 1")
+        self.assertEqual(used.fetchall()[-1], (1, 200))
+        conn.close()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,436 @@
+# vim: set fileencoding=utf-8 :
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from functools import partial
+
+import parse
+from process import (
+    TRANSLATION_QUERY,
+    cached,
+    clean_forms,
+    local_importance,
+    log_query_plans,
+    make_entry,
+    make_form,
+    make_inflection_table,
+    make_sense,
+    make_translation,
+    map_rows,
+    parse_sense,
+    stage_translations,
+)
+from sparql.run import create_raw_indexes
+
+
+def create_db(path, tables):
+    """Create the db `path` with `tables`, mapping table definitions to rows"""
+    conn = sqlite3.connect(path)
+    for definition, rows in tables.items():
+        conn.execute("CREATE TABLE " + definition)
+        for row in rows:
+            conn.execute(
+                "INSERT INTO %s VALUES (%s)"
+                % (definition.split()[0], ", ".join("?" * len(row))),
+                row,
+            )
+    conn.commit()
+    return conn
+
+
+class TestMapRows(unittest.TestCase):
+    def test_same_for_all_jobs(self):
+        results = []
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        raw_path = os.path.join(tmp.name, "raw.sqlite3")
+        create_db(
+            raw_path,
+            {
+                "form (lexentry, other_written, pos)": [
+                    ("deu/x%d" % i, "die [[Bäume]]&nbsp;%d" % i, "noun")
+                    for i in range(100)
+                ]
+            },
+        )
+
+        for jobs in [1, 2]:
+            conn = sqlite3.connect(os.path.join(tmp.name, "%d.sqlite3" % jobs))
+            conn.execute("ATTACH DATABASE ? AS raw", [raw_path])
+            conn.execute("CREATE TABLE form (lexentry, full, pos, other_written)")
+            map_rows(
+                conn,
+                "form",
+                "raw.form",
+                "SELECT * FROM raw.form WHERE rowid BETWEEN :start AND :end",
+                partial(
+                    clean_forms,
+                    lang="de",
+                    clean_html=cached(None, "clean_html", parse.html_parser.parse),
+                    clean_wiki_syntax=cached(
+                        None, "clean_wiki_syntax", parse.clean_wiki_syntax
+                    ),
+                ),
+                jobs,
+                batch_size=7,
+            )
+            results.append(conn.execute("SELECT * FROM form").fetchall())
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0]), 100)
+        self.assertEqual(
+            results[0][3], ("deu/x3", "die Bäume\xa03", "noun", "Bäume\xa03")
+        )
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.raw = create_db(
+            os.path.join(self.tmp, "raw.sqlite3"),
+            {
+                "entry (lexentry, vocable, written_rep)": [],
+                "pos (lexentry, part_of_speech)": [],
+                "gender (lexentry, gender)": [],
+                "pronun (lexentry, pronun)": [],
+                """form (lexentry, other_written, pos, mood, number, person,
+                    tense, voice, "case", inflection, definiteness)""": [],
+            },
+        )
+        for word in ["Baum", "Haus", "Maus"]:
+            self.add_entry(word)
+
+    def add_entry(self, word):
+        self.raw.execute(
+            "INSERT INTO entry VALUES (?, ?, ?)", ["deu/" + word, "deu/" + word, word]
+        )
+        self.raw.execute(
+            "INSERT INTO form (lexentry, other_written, pos, number, \"case\") "
+            "VALUES (?, ?, 'noun', 'Plural', 'Nominative')",
+            ["deu/" + word, "die [[%ser]]" % word],
+        )
+        self.raw.commit()
+
+    def build(self, name, incremental):
+        conn = sqlite3.connect(os.path.join(self.tmp, name))
+        conn.execute(
+            "ATTACH DATABASE ? AS raw", [os.path.join(self.tmp, "raw.sqlite3")]
+        )
+        make_inflection_table(conn, "de")
+        make_entry(conn, "de")
+        out = io.StringIO()
+        with redirect_stdout(out):
+            make_form(conn, "de", version="1", incremental=incremental)
+        conn.commit()
+        form = conn.execute("SELECT * FROM form ORDER BY lexentry_id").fetchall()
+        conn.close()
+        return form, out.getvalue()
+
+    def test_same_as_full_build(self):
+        self.build("incremental.sqlite3", incremental=True)
+
+        self.raw.execute(
+            "UPDATE form SET other_written = 'die Häuser' WHERE lexentry = 'deu/Haus'"
+        )
+        self.raw.execute("DELETE FROM entry WHERE lexentry = 'deu/Maus'")
+        self.add_entry("Apfel")
+        form, out = self.build("incremental.sqlite3", incremental=True)
+        self.assertEqual(out, "(2 of 3 lexentries changed) ")
+
+        full_form, _ = self.build("full.sqlite3", incremental=False)
+        self.assertEqual(form, full_form)
+        self.assertEqual(
+            [(lexentry_id, other_written) for lexentry_id, *_, other_written in form],
+            [(1, "Apfeler"), (2, "Baumer"), (3, "Häuser")],
+        )
+
+    def test_full_build_drops_hashes(self):
+        self.build("processed.sqlite3", incremental=True)
+        self.build("processed.sqlite3", incremental=False)
+        conn = sqlite3.connect(os.path.join(self.tmp, "processed.sqlite3"))
+        self.assertIsNone(
+            conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'form_hash'"
+            ).fetchone()
+        )
+        conn.close()
+        # so the next incremental build cleans all lexentries again
+        _, out = self.build("processed.sqlite3", incremental=True)
+        self.assertEqual(out, "")
+
+
+class TestQueryPlans(unittest.TestCase):
+    def test_indexed_plans(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name)
+        raw = create_db(
+            "raw.sqlite3",
+            {
+                "entry (lexentry, vocable, written_rep)": [
+                    ("deu/Haus", "deu/Haus", "Haus")
+                ],
+                "pos (lexentry, part_of_speech)": [("deu/Haus", "noun")],
+                "gender (lexentry, gender)": [("deu/Haus", "neuter")],
+                "pronun (lexentry, pronun)": [],
+                """form (lexentry, other_written, pos, mood, number, person,
+                    tense, voice, "case", inflection, definiteness)""": [],
+            },
+        )
+        create_raw_indexes(raw)
+        raw.commit()
+        raw.close()
+
+        conn = sqlite3.connect("processed.sqlite3")
+        conn.execute("ATTACH DATABASE 'raw.sqlite3' AS raw")
+        make_inflection_table(conn, "de")
+        make_entry(conn, "de")
+        log_query_plans(conn, "de")
+        with open("dictionaries/logs/process-de.plan") as f:
+            log = f.read()
+        self.assertIn("SCAN raw.entry USING INDEX entry_lexentry_idx", log)
+        # the form query needs the entry table, which exists by now
+        self.assertIn("SEARCH entry USING COVERING INDEX", log)
+        conn.close()
+
+
+class TestSense(unittest.TestCase):
+    # lexentry, sense_num, sense, trans
+    translations = {
+        "de": [
+            ("fra/maison", "1", "[[bâtiment]] d'habitation", "Haus"),
+            ("fra/maison", "2", "<i>famille</i>", "Familie"),
+            ("fra/lire", "", "Traductions à trier", "lesen"),
+            ("fra/lire", "", None, "vorlesen"),
+            ("fra/lire", "", " ", "durchlesen"),
+        ],
+        "en": [
+            ("fra/maison", "1", "[[bâtiment]] d'habitation", "house"),
+            ("fra/lire", "1", "''comprendre'' un texte", "read"),
+        ],
+    }
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name)
+        os.makedirs("dictionaries/raw")
+        for to_lang, rows in self.translations.items():
+            create_db(
+                f"dictionaries/raw/fr-{to_lang}.sqlite3",
+                {"translation (lexentry, sense_num, sense, trans)": rows},
+            ).close()
+        # a pair without translations
+        create_db("dictionaries/raw/fr-sv.sqlite3", {}).close()
+
+        self.lang = create_db(
+            "fr.sqlite3",
+            {
+                "entry (lexentry_id INTEGER, lexentry, vocable, written_rep)": [
+                    (1, "fra/lire", "fra/lire", "lire"),
+                    (2, "fra/maison", "fra/maison", "maison"),
+                ],
+                "rel_importance (vocable, rel_score)": [
+                    ("fra/lire", 0.5),
+                    ("fra/maison", 0.8),
+                ],
+            },
+        )
+        self.addCleanup(self.lang.close)
+        create_db(
+            "de.sqlite3", {"rel_importance (written_rep_guess, rel_score)": []}
+        ).close()
+        with redirect_stdout(io.StringIO()):
+            make_sense(self.lang, "fr")
+        self.lang.commit()
+
+    def build_translation(self):
+        conn = sqlite3.connect("fr-de.sqlite3")
+        conn.execute("ATTACH DATABASE 'dictionaries/raw/fr-de.sqlite3' AS raw")
+        conn.execute("ATTACH DATABASE 'fr.sqlite3' AS lang")
+        conn.execute("ATTACH DATABASE 'de.sqlite3' AS other_lang")
+        with redirect_stdout(io.StringIO()):
+            make_translation(conn, "fr-de", version="1")
+        cleaned = conn.execute(
+            "SELECT lexentry_id, sense FROM cleaned_translation ORDER BY rowid"
+        ).fetchall()
+        translation = conn.execute(
+            "SELECT * FROM translation ORDER BY sense_num, sense, trans"
+        ).fetchall()
+        conn.close()
+        return cleaned, translation
+
+    def test_senses_of_all_pairs(self):
+        raw_senses = {
+            sense
+            for rows in self.translations.values()
+            for _, _, sense, _ in rows
+            if sense is not None
+        }
+        self.assertEqual(
+            dict(self.lang.execute("SELECT raw_sense, sense FROM sense")),
+            {raw_sense: parse_sense(raw_sense, "fr") for raw_sense in raw_senses},
+        )
+
+    def test_same_as_cleaning_each_pair(self):
+        cleaned, translation = self.build_translation()
+        self.assertEqual(
+            cleaned,
+            [
+                (2 if lexentry == "fra/maison" else 1, parse_sense(sense, "fr"))
+                for lexentry, _, sense, _ in self.translations["de"]
+            ],
+        )
+        # sense_num, sense and trans
+        self.assertEqual(
+            [row[1:3] + row[4:5] for row in translation],
+            [
+                (None, None, "durchlesen"),
+                (None, None, "lesen"),
+                (None, None, "vorlesen"),
+                ("01", "bâtiment d'habitation", "Haus"),
+                ("02", "famille", "Familie"),
+            ],
+        )
+
+        # without the cleaned senses, each pair cleans its senses itself
+        self.lang.execute("DELETE FROM sense")
+        self.lang.commit()
+        self.assertEqual(self.build_translation(), (cleaned, translation))
+
+
+class TestTranslationGrouping(unittest.TestCase):
+    def test_grouped_in_index_order(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        lang_path = os.path.join(tmp.name, "en.sqlite3")
+        other_lang_path = os.path.join(tmp.name, "de.sqlite3")
+        create_db(
+            lang_path,
+            {
+                "entry (lexentry_id, vocable, written_rep)": [
+                    (1, "eng/walk", "walk"),
+                    (2, "eng/walk", "walk"),
+                    (3, "eng/house", "house"),
+                ],
+                "rel_importance (vocable, rel_score)": [
+                    ("eng/walk", 0.5),
+                    ("eng/house", 0.8),
+                ],
+            },
+        )
+        create_db(
+            other_lang_path,
+            {
+                "rel_importance (written_rep_guess, rel_score)": [("Haus", 0.9)],
+            },
+        )
+        conn = create_db(
+            ":memory:",
+            {
+                """cleaned_translation (lexentry_id INTEGER, sense_num,
+                    orig_sense_num TEXT, sense, raw_trans TEXT, trans)""": [
+                    # the transitive and intransitive variants of a vocable
+                    (2, "1", "1", "to go on foot", "gehen", "gehen"),
+                    (1, "1", "1", "to go on foot", "gehen", "gehen"),
+                    (1, "1", "1", "to go on foot", "laufen", "laufen"),
+                    (3, "", "", "", "Haus", "Haus"),
+                    (3, "", "", "", "", ""),
+                ],
+            },
+        )
+        conn.execute("ATTACH DATABASE ? AS lang", [lang_path])
+        conn.execute("ATTACH DATABASE ? AS other_lang", [other_lang_path])
+        stage_translations(conn)
+        plan = conn.execute("EXPLAIN QUERY PLAN " + TRANSLATION_QUERY).fetchall()
+        self.assertFalse([detail for *_, detail in plan if "TEMP B-TREE" in detail])
+        self.assertEqual(
+            conn.execute(TRANSLATION_QUERY).fetchall(),
+            [
+                (3, "", "", "house", "Haus", 0.8, 0.9, "[3]"),
+                (1, "1", "to go on foot", "walk", "gehen", 0.5, 0.001, "[1,2]"),
+                (1, "1", "to go on foot", "walk", "laufen", 0.5, 0.001, "[1]"),
+            ],
+        )
+
+
+class TestLocalImportance(unittest.TestCase):
+    def test_scores(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        raw_path = os.path.join(tmp.name, "raw.sqlite3")
+        create_db(
+            raw_path,
+            {
+                "entry (lexentry, vocable, written_rep)": [
+                    ("eng/house__Noun__1", "eng/house", "house"),
+                    ("eng/house__Verb__1", "eng/house", "house"),
+                    ("eng/home__Noun__1", "eng/home", "home"),
+                    ("eng/H__Letter__1", "eng/H", "H"),
+                ],
+                "pos (lexentry, part_of_speech)": [
+                    ("eng/house__Noun__1", "noun"),
+                    ("eng/house__Verb__1", "verb"),
+                    ("eng/home__Noun__1", "noun"),
+                    ("eng/H__Letter__1", "letter"),
+                ],
+                "nym (f, nym, t_rep)": [
+                    ("eng/home__Noun__1", "synonym", "house"),
+                    ("eng/dwelling__Noun__1", "synonym", "house"),
+                    ("eng/dwelling__Noun__1", "antonym", "home"),
+                ],
+            },
+        )
+        translations = [
+            ("eng/house__Noun__1", "eng/__tr_deu_1_house__Noun__1"),
+            ("eng/house__Verb__1", "eng/__tr_deu_1_house__Verb__1"),
+            ("eng/house__Verb__1", "eng/__tr_deu_1_house__Verb__1"),
+            ("eng/home__Noun__1", "eng/__tr_deu_1_home__Noun__1"),
+            ("eng/H__Letter__1", "eng/__tr_deu_1_H__Letter__1"),
+        ]
+        pair_paths = []
+        for to_lang, table in [("de", "translation_gloss"), ("fr", "translation")]:
+            rows = [
+                (lexentry, "", "gloss", trans_entity.replace("deu", to_lang), "x")
+                for lexentry, trans_entity in translations
+            ]
+            # translations of a sense are not counted, like in the SPARQL query
+            rows.append(
+                (
+                    "eng/home__Noun__1",
+                    "1",
+                    "a home",
+                    f"eng/__tr_{to_lang}_1_home__Noun__1",
+                    "y",
+                )
+            )
+            path = os.path.join(tmp.name, "en-%s.sqlite3" % to_lang)
+            create_db(
+                path,
+                {f"{table} (lexentry, sense_num, sense, trans_entity, trans)": rows},
+            )
+            pair_paths.append(path)
+
+        conn = sqlite3.connect(":memory:")
+        conn.execute("ATTACH DATABASE ? AS raw", [raw_path])
+        local_importance(conn, pair_paths)
+        self.assertEqual(
+            conn.execute(
+                "SELECT vocable, round(score, 6) FROM local_importance ORDER BY 1"
+            ).fetchall(),
+            [
+                ("eng/home", round(2**0.5, 6)),
+                ("eng/house", round(4**0.5 + 2**0.5, 6)),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,536 @@
+# vim: set fileencoding=utf-8 :
+import contextlib
+import hashlib
+import http.server
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import unittest
+from functools import partial
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from sparql import queries, run
+from sparql.queries import (
+    BindingStream,
+    ResponseCache,
+    parse_tsv_term,
+    strip_namespace,
+)
+
+
+class TestBindingStream(unittest.TestCase):
+    result = {
+        "head": {"link": [], "vars": ["lexentry", "score"]},
+        "results": {
+            "distinct": False,
+            "ordered": True,
+            "bindings": [
+                {
+                    "lexentry": {"type": "uri", "value": "http://x/deu/Haus"},
+                    "score": {
+                        "type": "typed-literal",
+                        "datatype": "http://www.w3.org/2001/XMLSchema#double",
+                        "value": "1.5",
+                    },
+                },
+                {"lexentry": {"type": "literal", "value": "Hütte, \"klein\""}},
+            ],
+        },
+    }
+
+    def test_small_chunks(self):
+        data = json.dumps(self.result, indent=2, ensure_ascii=False).encode()
+        for chunk_size in [1, 7, 1 << 16]:
+            with self.subTest(chunk_size):
+                bindings = BindingStream(io.BytesIO(data), chunk_size=chunk_size)
+                self.assertEqual(bindings.cols, ["lexentry", "score"])
+                self.assertEqual(list(bindings), self.result["results"]["bindings"])
+
+    def test_empty(self):
+        data = b'{"head": {"vars": ["a"]}, "results": {"bindings": []}}'
+        self.assertEqual(list(BindingStream(io.BytesIO(data))), [])
+
+
+class TestStripNamespace(unittest.TestCase):
+    def test_strip(self):
+        for uri, value in [
+            ("http://kaiko.getalp.org/dbnary/deu/Haus", "deu/Haus"),
+            ("http://kaiko.getalp.org/dbnary/eng/C#__Noun__1", "eng/C#__Noun__1"),
+            ("http://kaiko.getalp.org/dbnary#Page", "Page"),
+            ("http://purl.org/olia/olia.owl#Singular", "Singular"),
+            ("http://lexvo.org/id/iso639-3/deu", "http://lexvo.org/id/iso639-3/deu"),
+        ]:
+            with self.subTest(uri):
+                self.assertEqual(strip_namespace(uri), value)
+
+
+class TestTsv(unittest.TestCase):
+    def test_terms(self):
+        for term, value in [
+            ("<http://kaiko.getalp.org/dbnary/deu/Haus>", "deu/Haus"),
+            ("<http://www.lexinfo.net/ontology/2.0/lexinfo#noun>", "noun"),
+            ('"Haus"@de', "Haus"),
+            ('"1"^^<http://www.w3.org/2001/XMLSchema#integer>', "1"),
+            ("12.5", "12.5"),
+            (r'"ein \"Haus\"\tmit\nTab"', 'ein "Haus"\tmit\nTab'),
+            (r'"H\u00fctte"', "Hütte"),
+        ]:
+            with self.subTest(term):
+                self.assertEqual(parse_tsv_term(term), value)
+
+    def test_iri_column(self):
+        term = '"http://kaiko.getalp.org/dbnary/deu/Haus"'
+        self.assertEqual(parse_tsv_term(term, iri=True), "deu/Haus")
+        self.assertEqual(parse_tsv_term(term), term[1:-1])
+
+    def test_same_as_json(self):
+        cols = ["lexentry", "sense_num", "sense", "trans_entity", "trans"]
+        cells = [
+            ("uri", "http://kaiko.getalp.org/dbnary/eng/AC__Noun__1"),
+            ("literal", "1"),
+            ("literal", "http://en.wiktionary.org/wiki/AC/DC#English"),
+            ("uri", "http://kaiko.getalp.org/dbnary/eng/__tr_deu_1_AC__Noun__1"),
+            ("literal", "AC/DC"),
+        ]
+        binding = {
+            col: {"type": cell_type, "value": value}
+            for col, (cell_type, value) in zip(cols, cells)
+        }
+        tsv_row = [
+            '"%s"' % value if cell_type == "uri" else '"%s"@en' % value
+            for cell_type, value in cells
+        ]
+        converters = {
+            result_format: converter("translation", cols, "en")
+            for result_format, converter in queries.row_converters.items()
+        }
+        self.assertEqual(converters["tsv"](tsv_row), converters["json"](binding))
+        self.assertEqual(
+            converters["tsv"](tsv_row),
+            [
+                "eng/AC__Noun__1",
+                "1",
+                "http://en.wiktionary.org/wiki/AC/DC#English",
+                "eng/__tr_deu_1_AC__Noun__1",
+                "AC/DC",
+            ],
+        )
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache = ResponseCache("v1", max_size=25, path=self.tmp_dir.name)
+        patcher = mock.patch(
+            "sparql.queries.urlopen",
+            side_effect=lambda url: io.BytesIO(url.encode() * 10),
+        )
+        self.urlopen = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        self.assertEqual(self.cache.open("a").read(), b"a" * 10)
+        self.assertEqual(self.cache.open("a").read(), b"a" * 10)
+        self.assertEqual(self.urlopen.call_count, 1)
+
+        self.cache.refresh = True
+        self.assertEqual(self.cache.open("a").read(), b"a" * 10)
+        self.assertEqual(self.urlopen.call_count, 2)
+
+        # the version is part of the key
+        self.cache.refresh = False
+        self.cache.version = "v2"
+        self.assertEqual(self.cache.open("a").read(), b"a" * 10)
+        self.assertEqual(self.urlopen.call_count, 3)
+
+    def test_incomplete(self):
+        response = self.cache.open("a")
+        response.read(1)
+        response.close()
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_evict(self):
+        for url in "abc":
+            self.cache.open(url).read()
+            # make sure the modification times differ
+            for entry in os.scandir(self.tmp_dir.name):
+                os.utime(entry.path, (0, os.stat(entry.path).st_mtime - 1))
+        self.assertEqual(len(os.listdir(self.tmp_dir.name)), 2)
+        self.cache.open("c").read()
+        self.cache.open("b").read()
+        self.assertEqual(self.urlopen.call_count, 3)
+
+
+class TestBucketQuery(unittest.TestCase):
+    def test_filter_outside(self):
+        query = queries.bucket_query(queries.basic_entry_pos_query, "a")
+        self.assertIn('FILTER (STRSTARTS(MD5(STR(?lexentry)), "a"))', query)
+        self.assertGreater(
+            query.index("STRSTARTS"), query.index(queries.basic_entry_pos_query)
+        )
+
+    def test_filter_before_grouping(self):
+        query = queries.bucket_query(queries.importance_query, "a")
+        self.assertEqual(query.count("STRSTARTS"), 1)
+        self.assertNotIn(queries.BUCKET_FILTER, query)
+        # inside the grouping subquery, before the outer query's ORDER BY
+        self.assertIn('FILTER (STRSTARTS(MD5(STR(?vocable)), "a"))', query)
+        self.assertLess(query.index("STRSTARTS"), query.index("}\n    }\n"))
+
+
+class TestResume(unittest.TestCase):
+    rows = [("eng/word%02d" % i, "noun") for i in range(23)]
+    fail_at_offset = None
+    fail_at_bucket = ""
+
+    def urlopen(self, url):
+        query = parse_qs(urlsplit(url).query)["query"][0]
+        offset, limit = map(
+            int, re.search(r"OFFSET (\d+)\s+LIMIT (\d+)", query).groups()
+        )
+        bucket = re.search(r'STRSTARTS\(MD5\(STR\(\?\w+\)\), "(\w*)"\)', query)
+        prefix = bucket.group(1) if bucket else ""
+        if (prefix, offset) == (self.fail_at_bucket, self.fail_at_offset):
+            raise ConnectionError("Virtuoso died")
+        rows = [
+            row
+            for row in self.rows
+            if hashlib.md5(
+                ("http://kaiko.getalp.org/dbnary/" + row[0]).encode()
+            ).hexdigest().startswith(prefix)
+        ]
+        lines = ["?lexentry\t?part_of_speech"] + [
+            '<http://kaiko.getalp.org/dbnary/%s>\t"%s"' % row
+            for row in rows[offset : offset + limit]
+        ]
+        return io.BytesIO(("\n".join(lines) + "\n").encode())
+
+    def test_resume(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, "en.sqlite3")
+        fetch = lambda: queries.get_query(
+            "pos",
+            queries.basic_entry_pos_query,
+            result_format="tsv",
+            db_path=db_path,
+            lang="en",
+            limit=5,
+            buckets=1,
+        )
+        with mock.patch("sparql.queries.urlopen", self.urlopen):
+            self.fail_at_offset = 15
+            self.assertRaises(ConnectionError, fetch)
+            conn = sqlite3.connect(db_path)
+            self.assertEqual(
+                conn.execute("SELECT count(*) FROM pos").fetchone(), (15,)
+            )
+            conn.close()
+
+            self.fail_at_offset = 5  # already fetched, must not be requested
+            fetch()
+            conn = sqlite3.connect(db_path)
+            self.assertEqual(conn.execute("SELECT * FROM pos").fetchall(), self.rows)
+            self.assertIsNone(
+                conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'raw_progress'"
+                ).fetchone()
+            )
+            conn.close()
+
+    def test_resume_buckets(self):
+        self.rows = [("eng/word%03d" % i, "noun") for i in range(300)]
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, "en.sqlite3")
+        fetch = lambda: queries.get_query(
+            "pos",
+            queries.basic_entry_pos_query,
+            result_format="tsv",
+            db_path=db_path,
+            lang="en",
+            limit=5,
+            buckets=16,
+            bucket_jobs=16,
+        )
+        # Small batches interleave the pages of the buckets
+        page_through_buckets = partial(queries.page_through_buckets, batch_size=2)
+        with mock.patch("sparql.queries.urlopen", self.urlopen), mock.patch(
+            "sparql.queries.page_through_buckets", page_through_buckets
+        ):
+            self.fail_at_bucket, self.fail_at_offset = "0", 10
+            self.assertRaises(ConnectionError, fetch)
+            self.fail_at_offset = None
+            fetch()
+        conn = sqlite3.connect(db_path)
+        self.assertEqual(
+            sorted(conn.execute("SELECT * FROM pos").fetchall()), self.rows
+        )
+        conn.close()
+
+    def test_json_columns(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp_dir.name)
+        os.makedirs("src/sql/sparql")
+
+        def urlopen(url):
+            _header, *lines = self.urlopen(url).read().decode().splitlines()
+            bindings = []
+            for line in lines:
+                lexentry, pos = line.split("\t")
+                bindings.append(
+                    {
+                        "lexentry": {"type": "uri", "value": lexentry[1:-1]},
+                        "part_of_speech": {"type": "literal", "value": pos[1:-1]},
+                    }
+                )
+            result = {
+                "head": {"vars": ["lexentry", "part_of_speech"]},
+                "results": {"bindings": bindings},
+            }
+            return io.BytesIO(json.dumps(result).encode())
+
+        with mock.patch("sparql.queries.urlopen", urlopen):
+            queries.get_query(
+                "pos",
+                queries.basic_entry_pos_query,
+                db_path="en.sqlite3",
+                lang="en",
+                limit=5,
+                buckets=16,
+            )
+        conn = sqlite3.connect("en.sqlite3")
+        self.assertEqual(
+            [col[1:3] for col in conn.execute("PRAGMA table_info(pos)")],
+            [("lexentry", "iri text"), ("part_of_speech", "TEXT")],
+        )
+        self.assertEqual(
+            sorted(conn.execute("SELECT * FROM pos").fetchall()), self.rows
+        )
+        conn.close()
+
+
+class TestSavedTables(unittest.TestCase):
+    sql_dir = os.path.join(os.path.dirname(__file__), "..", "sql", "sparql")
+
+    def test_written_by_create_table(self):
+        """The saved definitions are what `create_table` writes for them"""
+        datatypes = {
+            "int": "http://www.w3.org/2001/XMLSchema#integer",
+            "real": "http://www.w3.org/2001/XMLSchema#double",
+            "text": None,
+        }
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        saved = {}
+        for filename in os.listdir(self.sql_dir):
+            with open(os.path.join(self.sql_dir, filename)) as f:
+                saved[filename[: -len(".sql")]] = f.read()
+        os.chdir(tmp_dir.name)
+        os.makedirs("src/sql/sparql")
+
+        conn = sqlite3.connect(":memory:")
+        self.addCleanup(conn.close)
+        for table_name, sql in sorted(saved.items()):
+            cols, first_result = [], {}
+            for col, col_type in re.findall(r'"(\w+)" (iri text|\w+)', sql):
+                cols.append(col)
+                if col_type == "iri text":
+                    first_result[col] = {"type": "uri"}
+                else:
+                    first_result[col] = {
+                        "type": "literal",
+                        "datatype": datatypes[col_type],
+                    }
+            queries.create_table(conn, table_name, first_result, cols)
+            with open(queries.sql_filename(table_name)) as f:
+                self.assertEqual(f.read(), sql, table_name)
+
+
+class TsvPages:
+    """Return pages of TSV results like the response cache
+
+    Unlike a mocked urlopen, this also works in the processes of
+    `run.fetch_tables`.
+    """
+
+    words = ["eng/word%02d" % i for i in range(12)]
+    results = {
+        "partOfSpeech": (
+            "?lexentry\t?part_of_speech",
+            "<http://www.lexinfo.net/ontology/2.0/lexinfo#noun>",
+        ),
+        "phoneticRep": ("?lexentry\t?pronun", '"/w\\u025C\\u02D0d/"@en'),
+    }
+
+    def open(self, url):
+        query = parse_qs(urlsplit(url).query)["query"][0]
+        offset, limit = map(
+            int, re.search(r"OFFSET (\d+)\s+LIMIT (\d+)", query).groups()
+        )
+        [(header, value)] = [
+            result for marker, result in self.results.items() if marker in query
+        ]
+        lines = [header] + [
+            "<%s%s>\t%s" % (queries.DBNARY_NS, word, value)
+            for word in self.words[offset : offset + limit]
+        ]
+        return io.BytesIO(("\n".join(lines) + "\n").encode())
+
+
+class TestFetchTables(unittest.TestCase):
+    def test_same_for_all_jobs(self):
+        src_path = os.path.abspath("src")
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp_dir.name)
+        os.symlink(src_path, "src")  # for the saved table definitions
+
+        tables = {}
+        for jobs in [1, 2]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run.fetch_tables(
+                    "en",
+                    {
+                        "pos": queries.basic_entry_pos_query,
+                        "pronun": queries.basic_entry_pronun_query,
+                    },
+                    jobs,
+                    lang="en",
+                    limit=5,
+                    result_format="tsv",
+                    cache=TsvPages(),
+                )
+            conn = sqlite3.connect("dictionaries/raw/en.sqlite3")
+            tables[jobs] = {
+                name: (sql, conn.execute(f"SELECT * FROM {name}").fetchall())
+                for name, sql in conn.execute(
+                    "SELECT name, sql FROM sqlite_master ORDER BY name"
+                )
+            }
+            conn.close()
+            os.remove("dictionaries/raw/en.sqlite3")
+
+        self.assertEqual(list(tables[1]), ["pos", "pronun"])
+        self.assertEqual(tables[1]["pronun"][1][0], ("eng/word00", "/w\u025c\u02d0d/"))
+        self.assertEqual(len(tables[1]["pos"][1]), len(TsvPages.words))
+        self.assertEqual(tables[2], tables[1])
+        self.assertEqual(os.listdir("dictionaries/raw/staging"), [])
+
+
+class TestUrlopen(unittest.TestCase):
+    def test_retry_closed_connection(self):
+        connections = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                connections.append(self.client_address)
+
+            def do_GET(self):
+                body = self.path.encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                # close without telling the client, like an idle timeout
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever, args=[0.01])
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+
+        url = "http://127.0.0.1:%d/sparql" % server.server_port
+        self.assertEqual(queries.urlopen(url + "?a").read(), b"/sparql?a")
+        self.assertEqual(queries.urlopen(url + "?b").read(), b"/sparql?b")
+        self.assertEqual(len(connections), 2)
+
+
+class TestAllPairs(unittest.TestCase):
+    # lexentry, sense_num, sense, trans, target language
+    rows = {
+        "translation_sense": [
+            ("eng/house", "1", "a building", "Haus", "deu"),
+            ("eng/house", "1", "a building", "maison", "fra"),
+            ("eng/home", "2", "a place", "Heim", "deu"),
+        ],
+        "translation_gloss": [
+            ("eng/house", "", "building", "Haus", "deu"),
+            ("eng/tree", "", "plant", "arbre", "fra"),
+        ],
+    }
+
+    def urlopen(self, url):
+        query = parse_qs(urlsplit(url).query)["query"][0]
+        table = "translation_sense" if "?def_value" in query else "translation_gloss"
+        cols = ["lexentry", "sense_num", "sense", "trans_entity", "trans"]
+        cols.append("target_lang")
+        lines = ["\t".join("?" + col for col in cols)]
+        for lexentry, sense_num, sense, trans, lang3 in self.rows[table]:
+            lines.append(
+                '<%s%s>\t"%s"\t"%s"\t<%s%s/%s>\t"%s"@%s\t<%s%s>'
+                % (
+                    queries.DBNARY_NS,
+                    lexentry,
+                    sense_num,
+                    sense,
+                    queries.DBNARY_NS,
+                    lexentry,
+                    trans,
+                    trans,
+                    lang3,
+                    queries.LEXVO_NS,
+                    lang3,
+                )
+            )
+        return io.BytesIO(("\n".join(lines) + "\n").encode())
+
+    def test_rows_by_target(self):
+        src_path = os.path.abspath("src")
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp_dir.name)
+        os.symlink(src_path, "src")  # for the saved table definitions
+
+        with mock.patch("sparql.queries.urlopen", self.urlopen), mock.patch(
+            "sparql.run.supported_langs", ["en", "de", "fr"]
+        ), contextlib.redirect_stdout(io.StringIO()):
+            run.make_raw_all_pairs("en", only=None, result_format="tsv")
+
+        for to_lang, lang3 in [("de", "deu"), ("fr", "fra")]:
+            conn = sqlite3.connect(f"dictionaries/raw/en-{to_lang}.sqlite3")
+            for table, rows in self.rows.items():
+                self.assertEqual(
+                    conn.execute(
+                        f"SELECT lexentry, sense_num, sense, trans FROM {table}"
+                    ).fetchall(),
+                    [row[:4] for row in rows if row[4] == lang3],
+                )
+            # the gloss duplicates the sense translation
+            self.assertEqual(
+                conn.execute("SELECT count(*) FROM translation").fetchone(), (2,)
+            )
+            conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+# vim: set fileencoding=utf-8 :
+import io
+import sqlite3
+import unittest
+
+from sparql import ttl
+from turtle_reader import RDF, XSD, Literal, TurtleError, read_triples, tokenize
+
+DUMP = r"""
+@prefix dbnary: <http://kaiko.getalp.org/dbnary#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+@prefix eng: <http://kaiko.getalp.org/dbnary/eng/> .
+@prefix lexinfo: <http://www.lexinfo.net/ontology/2.0/lexinfo#> .
+@prefix lexvo: <http://lexvo.org/id/iso639-3/> .
+@prefix olia: <http://purl.org/olia/olia.owl#> .
+@prefix ontolex: <http://www.w3.org/ns/lemon/ontolex#> .
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
+@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+
+eng:house a dbnary:Page ;
+    dbnary:describes eng:house__Noun__1 .
+
+eng:home a dbnary:Page ;
+    dbnary:describes eng:home__Noun__1 .
+
+eng:house__Noun__1 a ontolex:LexicalEntry , ontolex:Word ;
+    dct:language lexvo:eng ;
+    lexinfo:partOfSpeech lexinfo:noun ;
+    ontolex:canonicalForm [
+        ontolex:writtenRep "house"@en ;
+        ontolex:phoneticRep "/haʊs/"@en-fonipa
+    ] ;
+    ontolex:otherForm [
+        ontolex:writtenRep "houses"@en ;
+        olia:hasNumber olia:Plural
+    ] ;
+    ontolex:sense eng:__ws_1_house__Noun__1 ;
+    dbnary:synonym eng:home .
+
+eng:home__Noun__1 a ontolex:LexicalEntry ;
+    dct:language lexvo:eng ;
+    lexinfo:partOfSpeech lexinfo:noun ;
+    ontolex:canonicalForm [ ontolex:writtenRep "home"@en ] .
+
+eng:__ws_1_house__Noun__1 a ontolex:LexicalSense ;
+    dbnary:senseNumber "1"^^<http://www.w3.org/2001/XMLSchema#string> ;
+    skos:definition [ rdf:value "A \"structure\" serving as a dwelling."@en ] .
+
+eng:__tr_deu_1_house__Noun__1 a dbnary:Translation ;
+    dbnary:isTranslationOf eng:__ws_1_house__Noun__1 ;
+    dbnary:targetLanguage lexvo:deu ;
+    dbnary:writtenForm "Haus"@de .
+
+eng:__tr_swe_1_house__Noun__1 a dbnary:Translation ;
+    dbnary:isTranslationOf eng:house__Noun__1 ;
+    dbnary:targetLanguage lexvo:swe ;
+    dbnary:gloss [ rdf:value "building"@en ] ;
+    dbnary:writtenForm "hus"@sv , "hus"@sv .
+"""
+
+
+class TestTurtleParser(unittest.TestCase):
+    def test_syntax(self):
+        data = """
+            PREFIX ex: <http://ex/>
+            @base <http://base/> .
+            <a> ex:p 1, -2.5, 3e4, true ;
+                ex:q ( "x" ), 'y'@de-at ;
+                ;
+                a ex:C .
+            [] ex:r _:b1 .
+            _:b1 ex:s '''multi
+line''', "tab\\t\\u00e4"^^ex:T .
+        """
+        triples = list(read_triples(io.StringIO(data), bnode_prefix="f."))
+        a, p = "http://base/a", "http://ex/p"
+        self.assertEqual(
+            triples,
+            [
+                (a, p, Literal("1", XSD + "integer", None)),
+                (a, p, Literal("-2.5", XSD + "decimal", None)),
+                (a, p, Literal("3e4", XSD + "double", None)),
+                (a, p, Literal("true", XSD + "boolean", None)),
+                ("_:f.anon1", RDF + "first", Literal("x", None, None)),
+                ("_:f.anon1", RDF + "rest", RDF + "nil"),
+                ("http://base/a", "http://ex/q", "_:f.anon1"),
+                ("http://base/a", "http://ex/q", Literal("y", None, "de-at")),
+                ("http://base/a", RDF + "type", "http://ex/C"),
+                ("_:f.anon2", "http://ex/r", "_:f.b1"),
+                ("_:f.b1", "http://ex/s", Literal("multi\nline", None, None)),
+                ("_:f.b1", "http://ex/s", Literal("tab\tä", "http://ex/T", None)),
+            ],
+        )
+
+    def test_small_chunks(self):
+        self.assertEqual(
+            list(tokenize(io.StringIO(DUMP), chunk_size=7, lookahead=64)),
+            list(tokenize(io.StringIO(DUMP))),
+        )
+
+    def test_long_string_across_chunks(self):
+        definition = "A structure\nserving as a \"dwelling\". " * 10
+        data = '<a> <b> """%s""" .' % definition
+        self.assertEqual(
+            list(tokenize(io.StringIO(data), chunk_size=16, lookahead=8)),
+            [
+                ("iri", "<a>"),
+                ("iri", "<b>"),
+                ("long_string", '"""%s"""' % definition),
+                ("punct", "."),
+            ],
+        )
+
+    def test_unterminated_long_string(self):
+        tokens = tokenize(io.StringIO('<a> <b> """no end .'), chunk_size=16)
+        self.assertRaises(TurtleError, list, tokens)
+
+
+class TestTtlStore(unittest.TestCase):
+    def setUp(self):
+        self.store = ttl.connect_store(":memory:")
+        ttl.create_store(self.store)
+        # every triple twice, as if it was in two dumps
+        ttl.load_ttl(self.store, io.StringIO(DUMP), bnode_prefix="f0.")
+        ttl.load_ttl(self.store, io.StringIO(DUMP), bnode_prefix="f0.")
+        ttl.index_store(self.store)
+
+    def query(self, table_name, lang="en"):
+        rows = ttl.query_rows(
+            self.store, table_name, ttl.raw_queries[table_name], lang
+        )
+        return sorted(map(tuple, rows))
+
+    def test_entry(self):
+        self.assertEqual(
+            self.query("entry"),
+            [
+                ("eng/home__Noun__1", "eng/home", "home"),
+                ("eng/house__Noun__1", "eng/house", "house"),
+            ],
+        )
+        self.assertEqual(
+            self.query("pos"),
+            [("eng/home__Noun__1", "noun"), ("eng/house__Noun__1", "noun")],
+        )
+        self.assertEqual(self.query("pronun"), [("eng/house__Noun__1", "/haʊs/")])
+        self.assertEqual(
+            self.query("gender"),
+            [("eng/home__Noun__1", None), ("eng/house__Noun__1", None)],
+        )
+        self.assertEqual(self.query("entry", lang="de"), [])
+
+    def test_form(self):
+        self.assertEqual(
+            self.query("form"),
+            [("eng/house__Noun__1", "houses", "noun", None, "Plural")
+             + (None,) * 7],
+        )
+
+    def test_nym_and_importance(self):
+        self.assertEqual(
+            self.query("nym"), [("eng/house__Noun__1", "synonym", "home")]
+        )
+        self.assertEqual(
+            self.query("importance"), [("eng/home", 1.0), ("eng/house", 1.0)]
+        )
+
+    def test_translations(self):
+        conns = {lang: sqlite3.connect(":memory:") for lang in ["de", "sv", "fr"]}
+        ttl.insert_translations(self.store, conns, "en", only=None)
+        translations = {
+            lang: conn.execute(
+                "SELECT * FROM translation_sense UNION ALL "
+                "SELECT * FROM translation_gloss"
+            ).fetchall()
+            for lang, conn in conns.items()
+        }
+        self.assertEqual(
+            translations,
+            {
+                "de": [
+                    (
+                        "eng/house__Noun__1",
+                        "1",
+                        'A "structure" serving as a dwelling.',
+                        "eng/__tr_deu_1_house__Noun__1",
+                        "Haus",
+                    )
+                ],
+                "sv": [
+                    (
+                        "eng/house__Noun__1",
+                        "",
+                        "building",
+                        "eng/__tr_swe_1_house__Noun__1",
+                        "hus",
+                    )
+                ],
+                "fr": [],
+            },
+        )
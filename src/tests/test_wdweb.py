@@ -0,0 +1,133 @@
+# vim: set fileencoding=utf-8 :
+import json
+import sqlite3
+import unittest
+
+from wdweb import make_search_by_form, make_translation_block
+
+
+class TestTranslationBlock(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        self.conn.execute("ATTACH DATABASE ':memory:' AS generic")
+        self.conn.executescript(
+            """
+            CREATE TABLE generic.translation_grouped (
+                lexentry_id, written_rep, min_sense_num, sense_list, trans_list,
+                score, importance
+            );
+            INSERT INTO generic.translation_grouped VALUES
+                (1, 'house', '1', 'a building | a home', 'Haus | Gebäude', 30, 0.5),
+                (1, 'house', '2', 'a family', 'Haus', 20, 0.5),
+                (2, 'house', NULL, NULL, 'hausen', 10, 0.1);
+
+            CREATE TABLE entry (
+                lexentry_id INTEGER PRIMARY KEY, lexentry, written_rep,
+                part_of_speech, gender, pronun_list
+            );
+            INSERT INTO entry VALUES
+                (1, 'eng/house__Noun__1', 'house', 'noun', NULL, 'haʊs'),
+                (2, 'eng/house__Verb__1', 'house', 'verb', NULL, NULL);
+
+            CREATE TABLE form (lexentry_id, other_written, rank);
+            INSERT INTO form VALUES
+                (1, 'houses', 1),
+                (1, 'house''s', 2),
+                (2, 'housed', 1),
+                (2, 'housing', 1),
+                (2, 'house', NULL);
+
+            CREATE VIRTUAL TABLE search_trans USING fts4(form, written_rep);
+        """
+        )
+        make_translation_block(self.conn, "en-de")
+
+    def test_blocks(self):
+        cur = self.conn.execute("SELECT * FROM translation_block ORDER BY rowid")
+        cols = [col[0] for col in cur.description]
+        self.assertEqual(
+            cols,
+            [
+                "lexentry_id",
+                "lexentry",
+                "written_rep",
+                "part_of_speech",
+                "gender",
+                "pronuns",
+                "sense_groups",
+                "translation_score",
+                "importance",
+                "forms",
+            ],
+        )
+        json_cols = {"pronuns", "sense_groups", "forms"}
+        rows = [
+            tuple(
+                json.loads(value) if col in json_cols and value else value
+                for col, value in zip(cols, row)
+            )
+            for row in cur
+        ]
+        self.assertEqual(
+            rows,
+            [
+                (
+                    1,
+                    "eng/house__Noun__1",
+                    "house",
+                    "noun",
+                    None,
+                    ["haʊs"],
+                    [
+                        {
+                            "senses": ["a building", "a home"],
+                            "translations": ["Haus", "Gebäude"],
+                        },
+                        {"senses": ["a family"], "translations": ["Haus"]},
+                    ],
+                    30,
+                    0.5,
+                    ["houses", "house's"],
+                ),
+                (
+                    2,
+                    "eng/house__Verb__1",
+                    "house",
+                    "verb",
+                    None,
+                    None,
+                    [{"senses": None, "translations": ["hausen"]}],
+                    10,
+                    0.1,
+                    ["housed/housing"],
+                ),
+            ],
+        )
+
+    def test_search_by_form(self):
+        make_search_by_form(self.conn, "en-de")
+        self.assertEqual(
+            self.conn.execute(
+                """
+                SELECT form, lexentry, form_importance
+                FROM search_by_form
+                    JOIN translation_block
+                        ON (translation_block_rowid = translation_block.rowid)
+                ORDER BY 1, 2, 3
+                """
+            ).fetchall(),
+            [
+                ("house", "eng/house__Noun__1", 1),
+                ("house", "eng/house__Verb__1", 0.5),
+                ("house", "eng/house__Verb__1", 1),
+                ("house's", "eng/house__Noun__1", 0.5),
+                ("housed", "eng/house__Verb__1", 0.5),
+                ("houses", "eng/house__Noun__1", 0.5),
+                ("housing", "eng/house__Verb__1", 0.5),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
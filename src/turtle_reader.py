@@ -0,0 +1,240 @@
+"""Incremental reader for the Turtle files of the dbnary dumps
+
+Only the parts of Turtle are supported that are needed to read the dumps
+correctly, but those are handled in a streaming fashion: the input is read
+in chunks and the triples are returned statement by statement, so that the
+memory usage does not depend on the size of the file.
+"""
+import re
+from collections import namedtuple
+from urllib.parse import urljoin
+
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+Literal = namedtuple("Literal", ["value", "datatype", "lang"])
+
+token_re = re.compile(
+    r"""
+      (?P<ws>(?:\s+|\#[^\n]*)+)
+    | (?P<iri><[^<>"{}|^`\\\s]*>)
+    | (?P<long_string>\"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"|'''(?:[^'\\]|\\.|'(?!''))*''')
+    | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    | (?P<langtag>@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*)
+    | (?P<datatype>\^\^)
+    | (?P<double>[+-]?(?:\d+\.\d*|\.\d+|\d+)[eE][+-]?\d+)
+    | (?P<decimal>[+-]?\d*\.\d+)
+    | (?P<integer>[+-]?\d+)
+    | (?P<bnode>_:[\w-]+(?:\.+[\w-]+)*)
+    | (?P<pname>(?:[A-Za-z][\w-]*(?:\.+[\w-]+)*)?:
+        (?:(?:[\w:%-]|\\[^\s])(?:\.*(?:[\w:%-]|\\[^\s]))*)?)
+    | (?P<punct>[.;,\[\]()])
+    | (?P<keyword>(?:a|true|false|PREFIX|BASE)\b)
+    """,
+    re.VERBOSE,
+)
+string_escape_re = re.compile(
+    r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))", re.DOTALL
+)
+string_escapes = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+local_escape_re = re.compile(r"\\(.)")
+
+
+class TurtleError(Exception):
+    pass
+
+
+def _unescape(match):
+    if match.group(3) is not None:
+        return string_escapes.get(match.group(3), match.group(3))
+    return chr(int(match.group(1) or match.group(2), 16))
+
+
+def tokenize(stream, chunk_size=1 << 20, lookahead=1 << 12):
+    """Yield (kind, text) for all tokens in the text `stream`
+
+    Before a token is matched, at least `lookahead` characters must be in the
+    buffer (unless the stream has ended). Otherwise the regex could match
+    only a prefix of a token that is cut at the end of the buffer. Long
+    strings can be longer than that, so the buffer is extended until it
+    contains their end.
+    """
+    buf = ""
+    pos = 0
+    eof = False
+    while pos < len(buf) or not eof:
+        match = None
+        if eof or len(buf) - pos >= lookahead:
+            match = token_re.match(buf, pos)
+        # Without its end, a long string would be matched as an empty string
+        unterminated = (
+            match is not None
+            and match.lastgroup != "long_string"
+            and buf.startswith(('"""', "'''"), pos)
+        )
+        if not eof and (match is None or match.end() == len(buf) or unterminated):
+            data = stream.read(chunk_size)
+            eof = not data
+            buf = buf[pos:] + data
+            pos = 0
+            continue
+        if match is None or unterminated:
+            raise TurtleError("Invalid Turtle near %r" % buf[pos : pos + 50])
+        pos = match.end()
+        if match.lastgroup != "ws":
+            yield match.lastgroup, match.group()
+
+
+class TurtleParser:
+    """Parse Turtle into (subject, predicate, object) triples
+
+    IRIs are returned as str, blank nodes as str starting with "_:" and
+    literals as `Literal`. Blank node labels get `bnode_prefix`, so that
+    labels from different files don't clash.
+    """
+
+    def __init__(self, stream, bnode_prefix=""):
+        self.tokens = tokenize(stream)
+        self.lookahead = None
+        self.prefixes = {}
+        self.base = ""
+        self.bnode_prefix = "_:" + bnode_prefix
+        self.bnode_count = 0
+        self.out = []
+
+    def _next(self):
+        if self.lookahead is not None:
+            token, self.lookahead = self.lookahead, None
+            return token
+        return next(self.tokens, (None, None))
+
+    def _peek(self):
+        if self.lookahead is None:
+            self.lookahead = next(self.tokens, (None, None))
+        return self.lookahead
+
+    def _expect(self, text):
+        kind, value = self._next()
+        if value != text:
+            raise TurtleError("Expected %r, got %r" % (text, value))
+
+    def _new_bnode(self):
+        self.bnode_count += 1
+        return "%sanon%d" % (self.bnode_prefix, self.bnode_count)
+
+    def _iri(self, kind, value):
+        if kind == "iri":
+            iri = value[1:-1]
+            if "\\" in iri:
+                iri = string_escape_re.sub(_unescape, iri)
+            return urljoin(self.base, iri) if self.base else iri
+        prefix, local = value.split(":", 1)
+        if prefix not in self.prefixes:
+            raise TurtleError("Unknown prefix %r" % prefix)
+        if "\\" in local:
+            local = local_escape_re.sub(r"\1", local)
+        return self.prefixes[prefix] + local
+
+    def __iter__(self):
+        while True:
+            kind, value = self._next()
+            if kind is None:
+                return
+            if value in ("@prefix", "PREFIX"):
+                _, pname = self._next()
+                self.prefixes[pname[:-1]] = self._iri(*self._next())
+                if value == "@prefix":
+                    self._expect(".")
+            elif value in ("@base", "BASE"):
+                self.base = self._iri(*self._next())
+                if value == "@base":
+                    self._expect(".")
+            else:
+                if value == "[":
+                    subject = self._blank_node_property_list()
+                    if self._peek()[1] != ".":
+                        self._predicate_object_list(subject)
+                else:
+                    subject = self._term(kind, value)
+                    self._predicate_object_list(subject)
+                self._expect(".")
+                yield from self.out
+                self.out.clear()
+
+    def _predicate_object_list(self, subject):
+        while True:
+            kind, value = self._next()
+            predicate = RDF + "type" if value == "a" else self._iri(kind, value)
+            while True:
+                self.out.append((subject, predicate, self._object()))
+                if self._peek()[1] != ",":
+                    break
+                self._next()
+            # Any number of semicolons can separate predicate-object pairs
+            if self._peek()[1] != ";":
+                return
+            while self._peek()[1] == ";":
+                self._next()
+            if self._peek()[1] in (".", "]"):
+                return
+
+    def _blank_node_property_list(self):
+        node = self._new_bnode()
+        if self._peek()[1] == "]":
+            self._next()
+            return node
+        self._predicate_object_list(node)
+        self._expect("]")
+        return node
+
+    def _collection(self):
+        head = RDF + "nil"
+        previous = None
+        while self._peek()[1] != ")":
+            node = self._new_bnode()
+            if previous is None:
+                head = node
+            else:
+                self.out.append((previous, RDF + "rest", node))
+            self.out.append((node, RDF + "first", self._object()))
+            previous = node
+        self._next()
+        if previous is not None:
+            self.out.append((previous, RDF + "rest", RDF + "nil"))
+        return head
+
+    def _object(self):
+        kind, value = self._next()
+        if value == "[":
+            return self._blank_node_property_list()
+        if value == "(":
+            return self._collection()
+        return self._term(kind, value)
+
+    def _term(self, kind, value):
+        if kind in ("iri", "pname"):
+            return self._iri(kind, value)
+        if kind == "bnode":
+            return self.bnode_prefix + value[2:]
+        if kind in ("string", "long_string"):
+            quotes = 3 if kind == "long_string" else 1
+            text = value[quotes:-quotes]
+            if "\\" in text:
+                text = string_escape_re.sub(_unescape, text)
+            next_kind, next_value = self._peek()
+            if next_kind == "langtag":
+                self._next()
+                return Literal(text, None, next_value[1:])
+            if next_kind == "datatype":
+                self._next()
+                return Literal(text, self._iri(*self._next()), None)
+            return Literal(text, None, None)
+        if kind in ("integer", "decimal", "double"):
+            return Literal(value, XSD + kind, None)
+        if value in ("true", "false"):
+            return Literal(value, XSD + "boolean", None)
+        raise TurtleError("Unexpected token %r" % value)
+
+
+def read_triples(stream, bnode_prefix=""):
+    return iter(TurtleParser(stream, bnode_prefix))
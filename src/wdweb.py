@@ -29,7 +29,7 @@ def make_entry(conn, lang):
         CREATE TABLE main.entry AS
         SELECT entry.*, display, display_addition
         FROM processed.entry
-             LEFT JOIN lexentry_display USING (lexentry)
+             LEFT JOIN lexentry_display USING (lexentry_id)
         WHERE written_rep IS NOT NULL;
 
         CREATE INDEX main.entry_written_rep_idx ON entry(written_rep);
@@ -60,35 +60,35 @@ def make_display(conn, lang):
             """
             CREATE TABLE lexentry_display AS
             WITH noun AS (
-                SELECT lexentry, other_written, number
+                SELECT lexentry_id, other_written, number
                 FROM processed.form
                 WHERE pos = 'noun'
                     AND "case" = 'Nominative'
                     AND (inflection = 'WeakInflection'
                          OR inflection IS NULL)
             )
-            SELECT lexentry, singular AS display,
+            SELECT lexentry_id, singular AS display,
                 'Pl.: ' || plural AS display_addition
             FROM (
-                SELECT lexentry, other_written AS singular
+                SELECT lexentry_id, other_written AS singular
                 FROM noun
                 WHERE number = 'Singular'
                 GROUP BY 1
                 HAVING count(DISTINCT other_written) = 1
             ) JOIN (
-                SELECT lexentry, other_written AS plural
+                SELECT lexentry_id, other_written AS plural
                 FROM noun
                 WHERE number = 'Plural'
                 GROUP BY 1
                 HAVING count(DISTINCT other_written) = 1
-            ) USING (lexentry)
+            ) USING (lexentry_id)
         """
         )
     else:
         conn.execute(
             """
             CREATE TABLE lexentry_display AS
-            SELECT '' AS lexentry, '' AS display, '' AS display_addition
+            SELECT NULL AS lexentry_id, '' AS display, '' AS display_addition
         """
         )
 
@@ -104,9 +104,9 @@ def make_translation(conn, lang_pair):
                importance
         FROM translation_grouped 
             LEFT JOIN (
-                SELECT lexentry, part_of_speech
+                SELECT lexentry_id, lexentry, part_of_speech
                 FROM entry
-            ) USING (lexentry)
+            ) USING (lexentry_id)
         ORDER BY lexentry, min_sense_num;
         --CREATE INDEX main.translation_lexentry_idx ON translation('lexentry');
         CREATE INDEX main.translation_written_rep_idx ON translation('written_rep');
@@ -158,10 +158,11 @@ def make_translation_block(conn, lang_pair):
         """
         DROP TABLE IF EXISTS main.translation_block;
         CREATE TABLE main.translation_block AS
-        SELECT *, 
-            grouped_forms.forms AS forms
+        SELECT lexentry_id, lexentry, written_rep, part_of_speech, gender,
+            pronuns, sense_groups, translation_score, importance, forms
         FROM (
             SELECT
+                lexentry_id,
                 lexentry,
                 written_rep,
                 part_of_speech,
@@ -173,7 +174,7 @@ def make_translation_block(conn, lang_pair):
                 importance
             FROM
                 (
-                    SELECT lexentry, written_rep,
+                    SELECT lexentry_id, written_rep,
                         json_group_array(json_object(
                             'senses', json(list_to_array(sense_list)),
                             'translations', json(list_to_array(trans_list))
@@ -183,31 +184,31 @@ def make_translation_block(conn, lang_pair):
                     FROM (
                         SELECT *
                         FROM translation_grouped
-                        ORDER BY lexentry, score DESC
+                        ORDER BY lexentry_id, score DESC
                     )
-                    GROUP BY lexentry, written_rep
+                    GROUP BY lexentry_id, written_rep
                 ) translation_grouped 
                 LEFT JOIN (
-                    SELECT lexentry, part_of_speech, gender, pronun_list
+                    SELECT lexentry_id, lexentry, part_of_speech, gender, pronun_list
                     FROM entry
-                ) USING (lexentry)
-            GROUP BY lexentry, written_rep, part_of_speech, gender, pronun_list
+                ) USING (lexentry_id)
+            GROUP BY lexentry_id, written_rep, part_of_speech, gender, pronun_list
         ) t
         LEFT JOIN (
-            SELECT lexentry, json_group_array(other_written) AS forms
+            SELECT lexentry_id, json_group_array(other_written) AS forms
             FROM (
-                SELECT lexentry, group_concat(other_written, '/') AS other_written
+                SELECT lexentry_id, group_concat(other_written, '/') AS other_written
                 FROM (
-                    SELECT lexentry, other_written, min(rank) AS rank
+                    SELECT lexentry_id, other_written, min(rank) AS rank
                     FROM form
                     WHERE rank IS NOT NULL
-                    GROUP BY lexentry, other_written
+                    GROUP BY lexentry_id, other_written
                 )
-                GROUP BY lexentry, rank
+                GROUP BY lexentry_id, rank
                 ORDER BY rank
             )
-            GROUP BY lexentry
-        ) grouped_forms USING (lexentry);
+            GROUP BY lexentry_id
+        ) grouped_forms USING (lexentry_id);
 
         CREATE INDEX main.translation_block_written_rep_idx ON translation_block('written_rep');
     """
@@ -250,7 +251,7 @@ def make_search_index(conn, lang_pair):
         UNION
         SELECT other_written, written_rep
         FROM form
-            JOIN entry USING (lexentry)
+            JOIN entry USING (lexentry_id)
         WHERE written_rep IN (
             SELECT written_rep FROM main.translation
         );
@@ -278,7 +279,7 @@ def make_search_by_form(conn, lang_pair):
         INSERT INTO main.search_by_form
         SELECT other_written, translation_block.rowid, 0.5 AS form_importance
         FROM translation_block
-            JOIN form USING (lexentry)
+            JOIN form USING (lexentry_id)
         UNION
         SELECT written_rep, translation_block.rowid, 1 AS form_importance
         FROM translation_block;